@@ -0,0 +1,87 @@
+#  Benchmark the tests pool dispatch cost. Generates a configuration with a growing number of
+#  tests, where most of the tests compete on a scarce resource pool, and measures the average
+#  time it takes the runner threads to get and release a work item. The tests themselves are
+#  not run, so the measured time is the dispatch overhead alone.
+#
+#  Usage: PYTHONPATH=src python scripts/bench_dispatch.py [THREADS]
+
+from xeet.core import BaseXeetSettings, TestsCriteria
+from xeet.core.xeet_conf import xeet_conf, clear_conf_cache
+from xeet.core.tests_runner import _TestsPool, _WorkItem, SchedulePolicy
+from xeet.core.history import TestsHistory
+from xeet.core.result import MtrxResult
+from threading import Thread
+from timeit import default_timer as timer
+import tempfile
+import time
+import yaml
+import sys
+import os
+
+_TESTS_COUNTS = [250, 1000, 4000, 16000]
+_SCARCE_RESOURCES = 2
+_HOLD_TIME = 0.0001  # Time a runner holds a work item, as if it runs the test
+
+
+def _gen_config(path: str, count: int) -> None:
+    tests = []
+    for i in range(count):
+        desc = {"name": f"test{i}", "run": [{"type": "dummy"}]}
+        if i % 4 != 0:
+            desc["resources"] = [{"pool": "scarce", "count": 1}]
+        tests.append(desc)
+    conf = {
+        "resources": {"scarce": [{"value": i} for i in range(_SCARCE_RESOURCES)]},
+        "tests": tests,
+    }
+    with open(path, "w") as f:
+        yaml.dump(conf, f)
+
+
+def _info(*_, **__) -> None:
+    pass
+
+
+def _runner(pool: _TestsPool) -> None:
+    while True:
+        item = pool.next_item(_info)
+        if item is None:
+            break
+        time.sleep(_HOLD_TIME)
+        pool.release_item(item)
+
+
+def _bench(tmp_dir: str, count: int, threads: int) -> float:
+    path = os.path.join(tmp_dir, f"xeet_{count}.yaml")
+    _gen_config(path, count)
+    clear_conf_cache()
+    tests = xeet_conf(BaseXeetSettings(path)).get_tests(TestsCriteria())
+    history = TestsHistory(os.path.join(tmp_dir, "history.json"))
+    pool = _TestsPool(threads, SchedulePolicy.Config, history)
+    mtrx_res = MtrxResult({}, 0)
+    items = [_WorkItem(test, mtrx_res) for test in tests]
+
+    runners = [Thread(target=_runner, args=(pool,)) for _ in range(threads)]
+    start = timer()
+    for runner in runners:
+        runner.start()
+    pool.add(items)
+    pool.wait_idle()
+    pool.close()
+    for runner in runners:
+        runner.join()
+    return (timer() - start) / count
+
+
+def main() -> None:
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    print(f"Threads: {threads}, scarce resources: {_SCARCE_RESOURCES}")
+    print(f"{'tests':>8}  {'usec/dispatch':>14}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for count in _TESTS_COUNTS:
+            per_dispatch = _bench(tmp_dir, count, threads)
+            print(f"{count:>8}  {per_dispatch * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
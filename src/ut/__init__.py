@@ -8,6 +8,7 @@ from xeet.core.test import Test, Phase
 from xeet.core.result import (TestResult, PhaseResult, TestStatus, TestPrimaryStatus, RunResult,
                               StepResult)
 from tempfile import gettempdir
+from dataclasses import fields
 from typing import Any, Iterable
 from collections.abc import Callable
 from copy import copy
@@ -145,6 +146,9 @@ class ConfigTestWrapper:
         clear_conf_cache()
 
 
+_RUN_SETTINGS_FIELDS = {f.name for f in fields(XeetRunSettings)}
+
+
 class XeetUnittest(ConfigTestWrapper):
     def __init__(self, name: str):
         super().__init__(name)
@@ -152,10 +156,15 @@ class XeetUnittest(ConfigTestWrapper):
     def gen_xvars(self) -> XeetVars:
         return XeetVars(self.variables)
 
-    def run_tests(self, iteraions: int = 1, threads: int = 1, **kwargs) -> RunResult:
+    #  Keyword arguments that are run settings fields are passed to the run settings, the rest
+    #  are passed to the tests criteria
+    def run_tests(self, iteraions: int = 1, threads: int = 1, concurrent_prmttns: bool = False,
+                  **kwargs) -> RunResult:
+        settings_kwargs = {k: kwargs.pop(k) for k in list(kwargs) if k in _RUN_SETTINGS_FIELDS}
         criteria = TestsCriteria(**kwargs)
         run_sttings = XeetRunSettings(file_path=self.file_path, criteria=criteria,
-                                      iterations=iteraions, jobs=threads)
+                                      iterations=iteraions, jobs=threads,
+                                      concurrent_prmttns=concurrent_prmttns, **settings_kwargs)
         return run_tests(run_sttings)
 
     def run_test(self, name: str, **kwargs) -> TestResult:
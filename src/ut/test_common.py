@@ -1,10 +1,14 @@
 from ut import pytest, ref_str
 from xeet.common import (text_file_tail, XeetVars, XeetNoSuchVarException,
                          XeetRecursiveVarException, XeetBadVarNameException, filter_str,
-                         StrFilterData, validate_str, validate_types)
+                         StrFilterData, validate_str, validate_types, json_value, json_values,
+                         XeetException, bounded_unified_diff, iter_text_lines,
+                         text_streams_equal, StrFilter, atomic_write)
 from xeet.core.resource import ResourcePool, ResourceModel, Resource
 from xeet.core.matrix import Matrix
 from typing import Any
+from io import StringIO
+import difflib
 import tempfile
 import os
 
@@ -186,6 +190,26 @@ def test_xeet_vars_string_literals():
         xvars.expand("{{var2}}")
 
 
+def test_xeet_vars_templates():
+    n = 2000  # More references than the recursion limit allows to expand one by one
+    xvars = XeetVars({f"var{i}": f"value{i}" for i in range(n)})
+    s = " ".join(f"-{{var{i}}}" for i in range(n))
+    assert xvars.expand(s) == " ".join(f"-value{i}" for i in range(n))
+
+    #  Substituted text is expanded with the text around it
+    xvars = XeetVars({"var1": "value1", "var2": "var1", "var3": r"\{var1}", "var4": "\\"})
+    assert xvars.expand("{{var2}}") == "value1"
+    assert xvars.expand("x {{var2}} {var1}") == "x value1 value1"
+    assert xvars.expand("{var3}") == "value1"
+    assert xvars.expand("{var4}{var1}") == "{var1}"
+    assert xvars.expand("awk '{print $1}' {var1}") == "awk '{print $1}' value1"
+
+    xvars = XeetVars({"var1": "{var2}", "var2": ["{var3}"], "var3": "$ref://var1"})
+    with pytest.raises(XeetRecursiveVarException) as e:
+        xvars.expand("_{var1}_")
+    assert "var1 -> var2 -> var3 -> var1" in str(e.value)
+
+
 def test_xeet_vars_scopes():
     xvars0 = XeetVars({"var1": "value1", "var2": 5})
     xvars1 = XeetVars({"var1": "value2", "var3": 10}, xvars0)
@@ -220,6 +244,30 @@ def test_xeet_vars_scopes():
         xvars2.expand(ref_str("varx"))
 
 
+def test_xeet_vars_expansion_cache():
+    xvars0 = XeetVars({"var1": "value1"})
+    xvars1 = XeetVars({"var2": "{var1}_2"}, xvars0)
+    xvars2 = XeetVars({"var3": "{var1}_3"}, xvars0)
+    assert xvars1.expand("{var2}") == "value1_2"
+    assert xvars2.expand("{var3}") == "value1_3"
+
+    #  Changes of other scopes don't drop a scope's cached expansions
+    xvars2.reset()
+    assert "{var2}" in xvars1._cache
+    assert xvars1.expand("{var2}") == "value1_2"
+
+    #  Changes of a parent scope invalidate its children's cached expansions
+    xvars0.set_vars({"var1": "other"})
+    assert xvars1.expand("{var2}") == "other_2"
+    xvars1.pop_vars(["var2"])
+    with pytest.raises(XeetNoSuchVarException):
+        xvars1.expand("{var2}")
+
+    for i in range(XeetVars._MAX_CACHED * 2):
+        assert xvars1.expand(f"{{var1}}_{i}") == f"other_{i}"
+    assert len(xvars1._cache) <= XeetVars._MAX_CACHED
+
+
 def test_xeet_vars_path():
     xvars = XeetVars({
         "var1": {
@@ -251,6 +299,70 @@ def test_xeet_vars_path():
     assert xvars.expand("{v}") == "1"
 
 
+def test_json_values():
+    obj = {"a": {"b": [{"c": 1}, {"c": 2, "d": None}], "e": "xyz"}, "where": 3}
+    assert json_value(obj, "a.b[1].c") == (2, True)
+    assert json_value(obj, "a.b[1].d") == (None, True)
+    assert json_value(obj, "a.e[1]") == ("y", True)
+    assert json_value(obj, "a.b[2].c") == (None, False)
+    assert json_value(obj, "a.b.c") == (None, False)
+    assert json_value(obj, "a[0]") == (None, False)
+    assert json_value(obj, "a.b[0].c.d") == (None, False)
+    #  Not plain paths
+    assert json_values(obj, "a.b[*].c") == [1, 2]
+    assert json_value(obj, "a.b[?(@.c == 2)].c") == (2, True)
+    with pytest.raises(XeetException):
+        json_value(obj, "a.b[*].c")
+    with pytest.raises(XeetException):
+        json_values(obj, "a.where")
+    with pytest.raises(XeetException):
+        json_values(obj, "a..[")
+
+
+def test_atomic_write():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "sub", "file")
+        assert atomic_write(path, "text", "test file")
+        assert atomic_write(path, "new text", "test file")
+        with open(path) as f:
+            assert f.read() == "new text"
+        assert os.listdir(os.path.dirname(path)) == ["file"]
+        #  The directory is a file
+        assert not atomic_write(os.path.join(path, "file"), b"data", "test file")
+
+
+def test_bounded_unified_diff():
+    a = [str(i) for i in range(10)]
+    b = a[:4] + ["x"] + a[5:]
+    expected = "\n".join(difflib.unified_diff(a, b, fromfile="a", tofile="b", lineterm=""))
+    assert bounded_unified_diff(iter(a), iter(b), "a", "b", 100) == expected
+    assert bounded_unified_diff(iter(a), iter(a), "a", "b", 100) == ""
+
+    #  Only a window around the first difference is diffed, numbered by the full sequences
+    a = [str(i) for i in range(100000)]
+    b = a[:50000] + ["x"] + a[50001:]
+    b[80000] = "y"
+    diff = bounded_unified_diff(iter(a), iter(b), "a", "b", 20).split("\n")
+    assert diff[:3] == ["--- a", "+++ b", "@@ -49998,7 +49998,7 @@"]
+    assert "-50000" in diff and "+x" in diff and "+y" not in diff
+    assert diff[-1] == "... diff truncated"
+    assert len(diff) <= 21
+
+    #  Long hunks are cut
+    diff = bounded_unified_diff(iter(a), iter(["x"] * 1000), "a", "b", 10).split("\n")
+    assert len(diff) == 11
+    assert diff[-1] == "... diff truncated"
+
+
+def test_text_streams():
+    assert list(iter_text_lines(StringIO("a\nb"))) == "a\nb".split("\n")
+    assert list(iter_text_lines(StringIO("a\nb\n"))) == "a\nb\n".split("\n")
+    assert list(iter_text_lines(StringIO(""))) == [""]
+    assert text_streams_equal(StringIO("a\nb"), StringIO("a\nb"))
+    assert not text_streams_equal(StringIO("a\nb"), StringIO("a\nb\n"))
+    assert not text_streams_equal(StringIO("a\nb"), StringIO("a\nc"))
+
+
 def test_value_validations():
     class A:
         def __init__(self, value=None):
@@ -306,6 +418,25 @@ def test_filter_string():
     filter3 = StrFilterData(from_str="[a-z]{3}", to_str="***")
     assert filter_str(s, [filter3]) == s
 
+    #  Independent plain filters are applied in a single pass
+    str_filter = StrFilter([filter0, filter1])
+    assert len(str_filter.stages) == 1
+    assert str_filter.line_safe
+    assert str_filter(s) == "abc xyz ghi 123 xyz"
+    #  Filters that depend on each other are not
+    filter4 = StrFilterData(from_str="xyz", to_str="!")
+    str_filter = StrFilter([filter0, filter4, filter1])
+    assert len(str_filter.stages) == 2
+    assert str_filter(s) == "abc ! ghi 123 !"
+    str_filter = StrFilter([filter0, filter2, filter1])
+    assert len(str_filter.stages) == 3
+    assert not str_filter.line_safe
+    assert not StrFilter([StrFilterData(from_str="a\nb", to_str="")]).line_safe
+    assert "".join(StrFilter([filter0]).filter_stream(StringIO("def\nxdef\n"))) == \
+        "xyz\nxxyz\n"
+    with pytest.raises(XeetException):
+        StrFilter([StrFilterData(from_str="[a-", to_str="", regex=True)])
+
 
 def test_resource_pool():
     def assert_resource(r: list[Resource], values: list[Any]):
@@ -1,15 +1,21 @@
 from ut import *
 from ut.ut_dummy_defs import *
-from ut.ut_exec_defs import gen_sleep_cmd, gen_exec_step_desc
+from ut.ut_exec_defs import gen_sleep_cmd, gen_exec_step_desc, gen_echo_cmd
 from xeet import XeetException
 from xeet.core.result import (StepResult, TestResult, PhaseResult, TestStatus, TestPrimaryStatus,
                               TestSecondaryStatus)
 from xeet.core.test import Test, TestResult, TestStatus
 from xeet.steps.dummy_step import DummyStepModel
-from xeet.core.api import fetch_tests_list
-from xeet.core import TestsCriteria
+from xeet.core.api import fetch_tests_list, SchedulePolicy, ExecutorType
+from xeet.core.history import TestsHistory
+from xeet.core.sharding import shard_units
+from xeet.core.worker import serve_workers
+from xeet.core import TestsCriteria, BaseXeetSettings
 from xeet.common import platform_path
 from timeit import default_timer as timer
+from multiprocessing import get_context
+import socket
+import shutil
 import os
 
 
@@ -63,6 +69,9 @@ def test_step_model_inheritance(xut: XeetUnittest):
     assert isinstance(model, DummyStepModel)
     assert model.step_type == "dummy"
     assert model.dummy_val0 == "test"
+    #  Base steps models are built once and shared
+    steps = xut.get_test(TEST0).main_phase.steps
+    assert steps[0].model.parent is steps[1].model.parent.parent
 
     test = xut.get_test(TEST1)
     assert test.error != ""
@@ -479,3 +488,348 @@ def test_test_matrix_support_direct(xut: XeetUnittest):
                                main_results=[expected_step])
     expected_step.dummy_val0 = str(values[1])
     assert_test_results_equal(test_res, expected)
+
+
+#  Assert the tests ran side by side - there is a time when all of them were running
+def _assert_overlap(results: list[TestResult]) -> None:
+    assert max(r.start_time for r in results) < min(r.end_time for r in results)
+
+
+def test_concurrent_matrix_permutations(xut: XeetUnittest):
+    values = ["a", "b", "c"]
+    xut.add_matrix("m0", values, reset=True)
+    step_desc = gen_dummy_step_desc(dummy_val0="{m0} {XEET_TEST_OUT_DIR}")
+    xut.add_test(TEST0, run=[step_desc])
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=gen_sleep_cmd(0.5))], save=True)
+
+    run_result = xut.run_tests(threads=6, concurrent_prmttns=True)
+    #  All the permutations sleep side by side, there is no per permutation barrier
+    _assert_overlap([m.results[TEST1] for m in run_result.iter_results[0].mtrx_results])
+
+    out_dir = platform_path(f"{os.path.dirname(xut.file_path)}/xeet.out")
+    mtrx_results = run_result.iter_results[0].mtrx_results
+    assert len(mtrx_results) == len(values)
+    tests = set()
+    for i, v in enumerate(values):
+        assert mtrx_results[i].mpi == i
+        res = mtrx_results[i].results[TEST0]
+        assert res.status == PASSED_TEST_STTS
+        step_res = res.main_res.steps_results[0]
+        assert step_res.dummy_val0 == f"{v} {out_dir}/m{i}/{TEST0}"  # type: ignore
+        assert mtrx_results[i].results[TEST1].status == PASSED_TEST_STTS
+        tests.add(id(res.test))
+    #  Each permutation runs its own test instance
+    assert len(tests) == len(values)
+
+
+def test_concurrent_iterations(xut: XeetUnittest):
+    values = ["a", "b"]
+    iterations = 3
+    xut.add_matrix("m0", values, reset=True)
+    step_desc = gen_dummy_step_desc(dummy_val0="{m0} {XEET_TEST_OUT_DIR}")
+    xut.add_test(TEST0, run=[step_desc])
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=gen_sleep_cmd(0.5))], save=True)
+
+    run_result = xut.run_tests(iteraions=iterations, threads=len(values) * iterations,
+                               concurrent_prmttns=True)
+    #  All the iterations sleep side by side, there is no per iteration barrier
+    _assert_overlap([m.results[TEST1] for iter_res in run_result.iter_results
+                     for m in iter_res.mtrx_results])
+
+    out_dir = platform_path(f"{os.path.dirname(xut.file_path)}/xeet.out")
+    assert len(run_result.iter_results) == iterations
+    for iter_res in run_result.iter_results:
+        mtrx_results = iter_res.mtrx_results
+        assert len(mtrx_results) == len(values)
+        for i, v in enumerate(values):
+            res = mtrx_results[i].results[TEST0]
+            assert res.status == PASSED_TEST_STTS
+            step_res = res.main_res.steps_results[0]
+            expected_dir = f"{out_dir}/{iter_res.iter_n}/m{i}/{TEST0}"
+            assert step_res.dummy_val0 == f"{v} {expected_dir}"  # type: ignore
+            assert mtrx_results[i].results[TEST1].status == PASSED_TEST_STTS
+
+
+def test_longest_first_schedule(xut: XeetUnittest):
+    tests = [TEST0, TEST1, TEST2, TEST3]
+    for t in tests:
+        xut.add_test(t, run=[DUMMY_OK_STEP_DESC])
+    xut.save()
+    history_file = platform_path(f"{os.path.dirname(xut.file_path)}/history.json")
+    if os.path.exists(history_file):
+        os.remove(history_file)
+    history = TestsHistory(history_file)
+    history.add(TEST0, 0, 1.0)
+    history.add(TEST1, 0, 3.0)
+    history.add(TEST3, 0, 2.0)
+    history.save()
+
+    run_result = xut.run_tests(schedule=SchedulePolicy.LongestFirst, history_file=history_file)
+    results = run_result.iter_results[0].mtrx_results[0].results
+    order = sorted(results.keys(), key=lambda name: results[name].start_time)
+    #  Tests with no history come first, then the longest ones
+    assert order == [TEST2, TEST1, TEST3, TEST0]
+
+    #  The history is updated with the run durations
+    history = TestsHistory(history_file)
+    for t in tests:
+        duration = history.duration(t, 0)
+        assert duration is not None
+    assert history.duration(TEST2, 1) is None
+    assert history.duration(TEST1, 0) < 3.0  # type: ignore
+
+
+def test_process_executor(xut: XeetUnittest):
+    values = ["a", "b"]
+    xut.add_matrix("m0", values, reset=True)
+    step_desc = gen_dummy_step_desc(dummy_val0="{m0} {XEET_TEST_OUT_DIR}")
+    xut.add_test(TEST0, run=[step_desc])
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=gen_sleep_cmd(0.5))])
+    xut.add_test(TEST2, run=[DUMMY_OK_STEP_DESC], skip=True, save=True)
+
+    for concurrent in (False, True):
+        run_result = xut.run_tests(threads=2, executor=ExecutorType.Process,
+                                   concurrent_prmttns=concurrent)
+        out_dir = platform_path(f"{os.path.dirname(xut.file_path)}/xeet.out")
+        mtrx_results = run_result.iter_results[0].mtrx_results
+        assert len(mtrx_results) == len(values)
+        for i, v in enumerate(values):
+            results = mtrx_results[i].results
+            res = results[TEST0]
+            assert res.status == PASSED_TEST_STTS
+            #  Results are attached to the tests and steps of the parent process
+            step_res = res.main_res.steps_results[0]
+            assert id(step_res.step) == id(res.test.main_phase.steps[0])
+            expected_dir = f"{out_dir}/m{i}/{TEST0}" if concurrent else f"{out_dir}/{TEST0}"
+            assert step_res.dummy_val0 == f"{v} {expected_dir}"  # type: ignore
+            assert results[TEST1].status == PASSED_TEST_STTS
+            assert results[TEST2].status.primary == TestPrimaryStatus.Skipped
+
+
+def test_fail_fast(xut: XeetUnittest):
+    sleep_desc = gen_exec_step_desc(cmd=gen_sleep_cmd(5))
+    xut.add_test(TEST0, run=[DUMMY_FAILING_STEP_DESC], reset=True)
+    xut.add_test(TEST1, run=[sleep_desc])
+    xut.add_test(TEST2, run=[DUMMY_OK_STEP_DESC])
+    xut.add_test(TEST3, run=[DUMMY_OK_STEP_DESC], save=True)
+
+    start = timer()
+    run_result = xut.run_tests(threads=2, fail_fast=1)
+    #  The sleeping test is stopped, not waited for
+    assert timer() - start < 4
+    assert run_result.stop_reason
+    assert run_result.cancel_duration < 4
+    results = run_result.iter_results[0].mtrx_results[0].results
+    assert len(results) == 4
+    assert results[TEST0].status == FAILED_TEST_STTS
+    stopped = TestStatus(TestPrimaryStatus.NotRun, TestSecondaryStatus.Stopped)
+    for name in (TEST1, TEST2, TEST3):
+        assert results[name].status == stopped
+
+    #  The run isn't stopped before the failures count is reached
+    run_result = xut.run_tests(threads=2, fail_fast=2, names={TEST0, TEST2, TEST3})
+    assert not run_result.stop_reason
+    results = run_result.iter_results[0].mtrx_results[0].results
+    assert results[TEST0].status == FAILED_TEST_STTS
+    assert results[TEST2].status == PASSED_TEST_STTS
+    assert results[TEST3].status == PASSED_TEST_STTS
+
+
+def test_sharding(xut: XeetUnittest):
+    tests = [TEST0, TEST1, TEST2, TEST3, TEST4, TEST5]
+    for t in tests:
+        xut.add_test(t, run=[DUMMY_OK_STEP_DESC])
+    xut.save()
+    history_file = platform_path(f"{os.path.dirname(xut.file_path)}/history.json")
+    if os.path.exists(history_file):
+        os.remove(history_file)
+    history = TestsHistory(history_file)
+    units = [(t, 0) for t in tests]
+
+    #  No history, units are placed by their hash
+    shards = [shard_units(units, i, 3, history) for i in range(1, 4)]
+    assert set().union(*shards) == set(units)
+    assert sum(len(s) for s in shards) == len(units)
+    assert shards == [shard_units(units, i, 3, history) for i in range(1, 4)]
+
+    #  With history, shards are balanced by duration
+    for i, t in enumerate(tests):
+        history.add(t, 0, float(i + 1))
+    history.save()
+    shards = [shard_units(units, i, 3, history) for i in range(1, 4)]
+    assert set().union(*shards) == set(units)
+    for shard in shards:
+        assert sum(history.duration(*u) for u in shard) == 7.0  # type: ignore
+
+    with pytest.raises(XeetException):
+        shard_units(units, 4, 3, history)
+
+    run_tests = set()
+    for i in range(1, 4):
+        run_result = xut.run_tests(shard=(i, 3), history_file=history_file)
+        results = run_result.iter_results[0].mtrx_results[0].results
+        assert {(name, 0) for name in results} == shards[i - 1]
+        run_tests.update(results)
+        #  The history must not change between the shards runs for the split to hold
+        history.save()
+    assert run_tests == set(tests)
+
+
+def test_remote_workers(xut: XeetUnittest):
+    xut.add_test(TEST0, run=[gen_dummy_step_desc(dummy_val0="{XEET_TEST_OUT_DIR}")], reset=True)
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=gen_sleep_cmd(0.5))])
+    xut.add_test(TEST2, run=[DUMMY_FAILING_STEP_DESC], save=True)
+
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    authkey = b"xeet"
+    #  The worker writes to its own output directory, not the coordinator's
+    worker_out_dir = platform_path(f"{os.path.dirname(xut.file_path)}/worker.out")
+    server = get_context("spawn").Process(
+        target=serve_workers, args=(BaseXeetSettings(xut.file_path, output_dir=worker_out_dir),
+                                    ("localhost", port), authkey))
+    server.start()
+    try:
+        workers = [f"localhost:{port}"] * 2
+        run_result = xut.run_tests(workers=workers, workers_authkey=authkey)
+        results = run_result.iter_results[0].mtrx_results[0].results
+        assert results[TEST0].status == PASSED_TEST_STTS
+        step_res = results[TEST0].main_res.steps_results[0]
+        assert id(step_res.step) == id(results[TEST0].test.main_phase.steps[0])
+        assert step_res.dummy_val0 == f"{worker_out_dir}/{TEST0}"  # type: ignore
+        assert results[TEST1].status == PASSED_TEST_STTS
+        step_res = results[TEST1].main_res.steps_results[0]
+        assert step_res.stdout_file.startswith(f"{worker_out_dir}/{TEST1}/")  # type: ignore
+        assert os.path.isfile(step_res.stdout_file)  # type: ignore
+        assert results[TEST2].status == FAILED_TEST_STTS
+
+        run_result = xut.run_tests(iteraions=2, workers=workers, workers_authkey=authkey)
+        results = run_result.iter_results[1].mtrx_results[0].results
+        step_res = results[TEST0].main_res.steps_results[0]
+        assert step_res.dummy_val0 == f"{worker_out_dir}/1/{TEST0}"  # type: ignore
+
+        #  Wrong key, the run must fail and not hang
+        with pytest.raises(XeetException):
+            xut.run_tests(workers=workers, workers_authkey=b"wrong")
+    finally:
+        server.terminate()
+        server.join()
+
+
+def test_remote_worker_errors(xut: XeetUnittest):
+    xut.add_test(TEST0, run=[DUMMY_OK_STEP_DESC], reset=True, save=True)
+    #  The worker's configuration doesn't have the second test
+    worker_file_path = os.path.join(os.path.dirname(xut.file_path), "worker_conf.yaml")
+    shutil.copy(xut.file_path, worker_file_path)
+    xut.add_test(TEST1, run=[DUMMY_OK_STEP_DESC], save=True)
+
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    authkey = b"xeet"
+    server = get_context("spawn").Process(
+        target=serve_workers, args=(BaseXeetSettings(worker_file_path), ("localhost", port),
+                                    authkey))
+    server.start()
+    try:
+        run_result = xut.run_tests(workers=[f"localhost:{port}"], workers_authkey=authkey)
+        results = run_result.iter_results[0].mtrx_results[0].results
+        assert results[TEST0].status == PASSED_TEST_STTS
+        #  The worker's error is the test's error, the run goes on
+        assert results[TEST1].status == TestStatus(TestPrimaryStatus.NotRun,
+                                                   TestSecondaryStatus.TestErr)
+        assert "not found in worker" in results[TEST1].status_reason
+    finally:
+        server.terminate()
+        server.join()
+        os.remove(worker_file_path)
+
+
+def test_result_cache(xut: XeetUnittest, monkeypatch):
+    root = os.path.dirname(xut.file_path)
+    expected_file = platform_path(f"{root}/cache_expected.txt")
+    input_file = platform_path(f"{root}/cache_input.txt")
+    cache_file = platform_path(f"{root}/results_cache.json")
+    for path, content in ((expected_file, "hello\n"), (input_file, "0")):
+        with open(path, "w") as f:
+            f.write(content)
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+
+    xut.add_test(TEST0, run=[gen_exec_step_desc(cmd=gen_echo_cmd("hello"),
+                                                expected_stdout_file=expected_file)], reset=True)
+    xut.add_test(TEST1, run=[DUMMY_FAILING_STEP_DESC])
+    xut.add_test(TEST2, run=[DUMMY_OK_STEP_DESC], inputs=["cache_input.*"], save=True)
+
+    def run() -> dict[str, TestResult]:
+        run_result = xut.run_tests(use_cache=True, cache_file=cache_file)
+        return run_result.iter_results[0].mtrx_results[0].results
+
+    #  Fingerprinting sets the tests up, the run must not set them up again
+    setups: list[str] = []
+    orig_setup = Test.setup
+
+    def counted_setup(test: Test) -> None:
+        setups.append(test.name)
+        orig_setup(test)
+
+    with monkeypatch.context() as m:
+        m.setattr(Test, "setup", counted_setup)
+        results = run()
+    assert all(r.status.secondary != TestSecondaryStatus.Cached for r in results.values())
+    assert results[TEST0].status == PASSED_TEST_STTS
+    assert sorted(setups) == [TEST0, TEST1, TEST2]
+
+    results = run()
+    for name in (TEST0, TEST2):
+        assert results[name].status.primary == TestPrimaryStatus.Passed
+        assert results[name].status.secondary == TestSecondaryStatus.Cached
+    assert results[TEST1].status == FAILED_TEST_STTS
+
+    #  Changing an input file invalidates only the tests that use it
+    with open(input_file, "w") as f:
+        f.write("1")
+    results = run()
+    assert results[TEST0].status.secondary == TestSecondaryStatus.Cached
+    assert results[TEST2].status == PASSED_TEST_STTS
+
+    #  Without the cache, everything runs
+    results = xut.run_tests(cache_file=cache_file).iter_results[0].mtrx_results[0].results
+    assert all(r.status.secondary != TestSecondaryStatus.Cached for r in results.values())
+
+
+def test_last_failed(xut: XeetUnittest):
+    results_file = platform_path(f"{os.path.dirname(xut.file_path)}/results.json")
+    if os.path.exists(results_file):
+        os.remove(results_file)
+    xut.add_test(TEST0, run=[DUMMY_OK_STEP_DESC], reset=True)
+    xut.add_test(TEST1, run=[DUMMY_FAILING_STEP_DESC])
+    xut.add_test(TEST2, run=[DUMMY_OK_STEP_DESC])
+    xut.add_test(TEST3, run=[DUMMY_FAILING_STEP_DESC], save=True)
+
+    def run(**kwargs) -> dict[str, TestResult]:
+        run_result = xut.run_tests(results_file=results_file, **kwargs)
+        return run_result.iter_results[0].mtrx_results[0].results
+
+    #  No results yet, all the tests run
+    assert len(run(last_failed=True)) == 4
+
+    results = run(last_failed=True)
+    assert set(results) == {TEST1, TEST3}
+    assert all(r.status == FAILED_TEST_STTS for r in results.values())
+
+    #  Failed tests run first
+    results = run(failed_first=True)
+    assert list(results)[:2] == [TEST1, TEST3]
+
+    #  Results of tests that weren't run are kept
+    xut.add_test(TEST0, run=[DUMMY_OK_STEP_DESC], reset=True)
+    xut.add_test(TEST1, run=[DUMMY_OK_STEP_DESC])
+    xut.add_test(TEST2, run=[DUMMY_OK_STEP_DESC])
+    xut.add_test(TEST3, run=[DUMMY_FAILING_STEP_DESC], save=True)
+    results = run(last_failed=True, names={TEST1})
+    assert set(results) == {TEST1}
+    assert results[TEST1].status == PASSED_TEST_STTS
+    results = run(last_failed=True)
+    assert set(results) == {TEST3}
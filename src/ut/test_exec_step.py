@@ -1,9 +1,18 @@
 from ut import *
 from ut.ut_exec_defs import *
-from xeet.steps.exec_step import ExecStepModel, _OutputBehavior, ExecStepResult
+from xeet.steps.exec_step import ExecStepModel, _OutputBehavior, ExecStepResult, _OutputVerifier
 from xeet.core.result import TestStatus, TestPrimaryStatus, TestSecondaryStatus
-from xeet.common import in_windows, platform_path
+from xeet.core.api import ExecutorType
+from xeet.core.supervisor import ProcessSupervisor
+from xeet.common import in_windows, platform_path, StrFilter, StrFilterData
+from threading import Thread
+import threading
 import tempfile
+import subprocess
+import signal
+import sys
+import time
+import io
 import os
 import json
 
@@ -123,6 +132,61 @@ def test_timeout(xut: XeetUnittest):
     assert res.main_res.steps_results[0].duration >= timeout
 
 
+def test_async_executor(xut: XeetUnittest):
+    cmd = f"{OUTPUT_CMD} --stdout O --stderr E"
+    xut.add_test(TEST0, run=[gen_exec_step_desc(cmd=cmd, expected_stdout="OE")], reset=True)
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=cmd, expected_stdout="O",
+                                                expected_stderr="E",
+                                                output_behavior=str(_OutputBehavior.Split))])
+    xut.add_test(TEST2, run=[gen_exec_step_desc(cmd=FALSE_CMD)])
+    xut.add_test(TEST3, run=[gen_exec_step_desc(cmd=gen_sleep_cmd(1), timeout=0.5)])
+    xut.add_test(TEST4, run=[gen_exec_step_desc(cmd=BAD_CMD)], save=True)
+
+    for debug in (False, True):
+        run_res = xut.run_tests(threads=5, executor=ExecutorType.Async, debug=debug)
+        assert run_res.test_result(TEST0, 0, 0).status == PASSED_TEST_STTS
+        assert run_res.test_result(TEST1, 0, 0).status == PASSED_TEST_STTS
+        res = run_res.test_result(TEST2, 0, 0)
+        assert res.status == FAILED_TEST_STTS
+        assert res.main_res.steps_results[0].rc == 1  # type: ignore
+        res = run_res.test_result(TEST3, 0, 0)
+        assert res.status == TestStatus(TestPrimaryStatus.NotRun, TestSecondaryStatus.TestErr)
+        assert res.main_res.steps_results[0].timeout_period == 0.5  # type: ignore
+        res = run_res.test_result(TEST4, 0, 0)
+        assert res.main_res.steps_results[0].os_error is not None  # type: ignore
+
+
+def test_async_executor_threads(xut: XeetUnittest):
+    #  The async executor runs all the tests on the supervisor loop, so the number of threads
+    #  must not grow with the number of jobs
+    jobs = 30
+    names = [f"test{i}" for i in range(jobs)]
+    for i, name in enumerate(names):
+        xut.add_test(name, run=[gen_exec_step_desc(cmd=gen_sleep_cmd(1))], reset=i == 0,
+                     save=i == jobs - 1)
+
+    base_threads = threading.active_count()
+    peak = base_threads
+    done = threading.Event()
+
+    def _sample() -> None:
+        nonlocal peak
+        while not done.wait(0.05):
+            peak = max(peak, threading.active_count())
+
+    sampler = Thread(target=_sample)
+    sampler.start()
+    try:
+        run_res = xut.run_tests(threads=jobs, executor=ExecutorType.Async)
+    finally:
+        done.set()
+        sampler.join()
+    results = [run_res.test_result(name, 0, 0) for name in names]
+    assert all(r.status == PASSED_TEST_STTS for r in results)
+    assert max(r.start_time for r in results) < min(r.end_time for r in results)
+    assert peak - base_threads < jobs // 2
+
+
 def test_env(xut: XeetUnittest):
     step_desc = gen_exec_step_desc(cmd=f"{SHOWENV_CMD} TEST_ENV", env={"TEST_ENV": "test"},
                                    expected_stdout="test\n")
@@ -307,3 +371,214 @@ def test_output_filter(xut: XeetUnittest):
     step_desc = gen_exec_step_desc(cmd=cmd, expected_stdout="***def", output_filters=filters)
     xut.add_test(TEST0, run=[step_desc], reset=True, save=True)
     xut.run_compare_test(TEST0, expected)
+
+
+def test_debug_output(xut: XeetUnittest):
+    #  Writes alternately to stdout and stderr
+    cmd = "python -c \"import sys; [print(s + str(i), file=f, flush=True) for i in range(3) " \
+          "for s, f in (('o', sys.stdout), ('e', sys.stderr))]\""
+    expected = "o0\ne0\no1\ne1\no2\ne2\n"
+    xut.add_test(TEST0, run=[gen_exec_step_desc(cmd=cmd, expected_stdout=expected)], reset=True)
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=cmd, expected_stdout="o0\no1\no2\n",
+                                                expected_stderr="e0\ne1\ne2\n",
+                                                output_behavior=str(_OutputBehavior.Split))],
+                 save=True)
+    for executor in (ExecutorType.Thread, ExecutorType.Async):
+        run_res = xut.run_tests(threads=2, executor=executor, debug=True)
+        assert run_res.test_result(TEST0, 0, 0).status == PASSED_TEST_STTS
+        assert run_res.test_result(TEST1, 0, 0).status == PASSED_TEST_STTS
+
+
+def test_stream_verification(xut: XeetUnittest):
+    sleep_period = 10
+    #  Prints the given lines and sleeps, so the test ends early only if the process is stopped
+    cmd = f"python -c \"import sys, time; print('\\\\n'.join(sys.argv[1:]), flush=True); " \
+          f"time.sleep({sleep_period})\""
+    filters = [{"from_str": "b", "to_str": "x"}]
+    xut.add_test(TEST0, run=[gen_exec_step_desc(cmd=f"{cmd} a wrong c", expected_stdout="a\nb\nc\n",
+                                                stream_verification=True, timeout=30)],
+                 reset=True)
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=f"{cmd} a b c d", expected_stdout="a\nx\nc\n",
+                                                stream_verification=True, timeout=30,
+                                                output_filters=filters)])
+    xut.add_test(TEST2, run=[gen_exec_step_desc(cmd=f"{OUTPUT_CMD} --stdout O --stderr E",
+                                                expected_stdout="O", expected_stderr="E",
+                                                output_behavior=str(_OutputBehavior.Split),
+                                                stream_verification=True)])
+    xut.add_test(TEST3, run=[gen_exec_step_desc(cmd=f"{cmd} a b", expected_stdout="a\nb\n",
+                                                stream_verification=True, timeout=0.5)],
+                 save=True)
+
+    for executor in (ExecutorType.Thread, ExecutorType.Async):
+        for debug in (False, True):
+            run_res = xut.run_tests(threads=4, executor=executor, debug=debug)
+            for test in (TEST0, TEST1):
+                res = run_res.test_result(test, 0, 0)
+                assert res.status == FAILED_TEST_STTS
+                assert res.duration < sleep_period
+                step_res = res.main_res.steps_results[0]
+                assert isinstance(step_res, ExecStepResult)
+                assert step_res.stdout_diff
+                assert "process was stopped" in step_res.errmsg
+                with open(step_res.stdout_file) as f:
+                    assert f.read().startswith("a\n")
+            assert run_res.test_result(TEST2, 0, 0).status == PASSED_TEST_STTS
+            #  Matching output is verified after the process ends
+            res = run_res.test_result(TEST3, 0, 0)
+            assert res.status == TestStatus(TestPrimaryStatus.NotRun, TestSecondaryStatus.TestErr)
+
+
+def test_stream_verification_filters(xut: XeetUnittest):
+    #  A regex filter isn't line safe, so the output is verified after the process ends
+    cmd = "python -c \"print('foo' + chr(10) + 'foo')\""
+    filters = [{"from_str": "^foo", "to_str": "bar", "regex": True}]
+    xut.add_test(TEST0, run=[gen_exec_step_desc(cmd=cmd, expected_stdout="bar\nfoo\n",
+                                                stream_verification=True,
+                                                output_filters=filters)], reset=True, save=True)
+    for executor in (ExecutorType.Thread, ExecutorType.Async):
+        run_res = xut.run_tests(threads=1, executor=executor)
+        assert run_res.test_result(TEST0, 0, 0).status == PASSED_TEST_STTS
+
+    #  Lines are filtered only once they are complete
+    expected = io.StringIO("axc\naxd\n")
+    verifier = _OutputVerifier("stdout", expected, StrFilter([StrFilterData("bc", "xc"),
+                                                             StrFilterData("bd", "xd")]))
+    for text in ("a", "b", "c\na", "b", "d\n"):
+        assert verifier.feed(text)
+    assert verifier.line_no == 2
+    assert not verifier.feed("e\n")
+
+
+def test_large_output_verification(xut: XeetUnittest):
+    lines = 100000
+    cmd = f"python -c \"print('\\\\n'.join(str(i) for i in range({lines})))\""
+    expected_lines = [str(i) for i in range(lines)]
+    with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
+        f.write("\n".join(expected_lines) + "\n")
+    expected_same = platform_path(f.name)
+    expected_lines[50000] = "x"
+    with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
+        f.write("\n".join(expected_lines) + "\n")
+    expected_diff = platform_path(f.name)
+
+    xut.add_test(TEST0, run=[gen_exec_step_desc(cmd=cmd, expected_stdout_file=expected_same)],
+                 reset=True)
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=cmd, expected_stdout_file=expected_diff,
+                                                max_diff_lines=20)], save=True)
+    run_res = xut.run_tests()
+    assert run_res.test_result(TEST0, 0, 0).status == PASSED_TEST_STTS
+    res = run_res.test_result(TEST1, 0, 0)
+    assert res.status == FAILED_TEST_STTS
+    step_res = res.main_res.steps_results[0]
+    assert isinstance(step_res, ExecStepResult)
+    diff = step_res.stdout_diff.split("\n")
+    assert diff[2] == "@@ -49998,7 +49998,7 @@"
+    assert "-50000" in diff and "+x" in diff
+    assert len(diff) <= 21
+
+    os.remove(expected_same)
+    os.remove(expected_diff)
+
+
+def _process_running(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] not in ("Z", "X")
+    except OSError:
+        return False
+
+
+def test_process_group_cleanup(xut: XeetUnittest):
+    if in_windows() or not os.path.isdir("/proc"):
+        return
+    pid_files = [os.path.join(tempfile.gettempdir(), f"xeet_ut_pid{i}") for i in range(4)]
+
+    #  Starts a background process, and writes its pid to a file
+    def bg_cmd(i: int, fg_cmd: str = "") -> str:
+        return f"sleep 30 & echo $! > {pid_files[i]}; {fg_cmd}"
+
+    xut.add_test(TEST0, run=[gen_exec_step_desc(cmd=bg_cmd(0, "sleep 30"), use_shell=True,
+                                                timeout=0.5)], reset=True)
+    xut.add_test(TEST1, run=[gen_exec_step_desc(cmd=bg_cmd(1), use_shell=True)])
+    xut.add_test(TEST2, run=[gen_exec_step_desc(cmd=bg_cmd(2), use_shell=True,
+                                                leftover_processes="kill")])
+    #  Output is read from a pipe, which the left process keeps open
+    xut.add_test(TEST3, run=[gen_exec_step_desc(cmd=bg_cmd(3, "echo a"), use_shell=True,
+                                                expected_stdout="a\n", stream_verification=True,
+                                                leftover_processes="kill")], save=True)
+    for executor in (ExecutorType.Thread, ExecutorType.Async):
+        run_res = xut.run_tests(threads=4, executor=executor)
+        pids = []
+        for pid_file in pid_files:
+            with open(pid_file) as f:
+                pids.append(int(f.read()))
+            os.remove(pid_file)
+        res = run_res.test_result(TEST0, 0, 0)
+        assert res.main_res.steps_results[0].timeout_period == 0.5  # type: ignore
+        assert not _process_running(pids[0])
+
+        step_res = run_res.test_result(TEST1, 0, 0).main_res.steps_results[0]
+        assert isinstance(step_res, ExecStepResult)
+        assert step_res.leftover_pids == [pids[1]]
+        assert _process_running(pids[1])
+        os.kill(pids[1], 9)
+
+        for test, pid in ((TEST2, pids[2]), (TEST3, pids[3])):
+            res = run_res.test_result(test, 0, 0)
+            assert res.status == PASSED_TEST_STTS
+            assert res.main_res.steps_results[0].leftover_pids == [pid]  # type: ignore
+            assert not _process_running(pid)
+
+
+def test_process_groups_killed_on_sigterm():
+    if in_windows() or not os.path.isdir("/proc"):
+        return
+    script = "; ".join([
+        "import subprocess, sys, time",
+        "from xeet.core.process_group import handle_exit_signals, register_process_group",
+        "handle_exit_signals()",
+        "p = subprocess.Popen(['sleep', '30'], start_new_session=True)",
+        "register_process_group(p.pid)",
+        "print(p.pid, flush=True)",
+        "time.sleep(30)",
+    ])
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    proc = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, env=env,
+                            text=True)
+    try:
+        pid = int(proc.stdout.readline())  # type: ignore
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(10) == -signal.SIGTERM
+    finally:
+        proc.kill()
+        proc.wait()
+    deadline = time.monotonic() + 5
+    while _process_running(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not _process_running(pid)
+
+
+def test_long_output_lines():
+    line_len = 200000  # Longer than the pipes read limit
+    cmd = ["python", "-c", f"print('x' * {line_len}); print('y')"]
+    tails = []
+    supervisor = ProcessSupervisor()
+    supervisor.start()
+    with tempfile.TemporaryFile(mode="w+") as f:
+        async def _run() -> int:
+            proc = await supervisor.spawn(cmd, shell=False, stdout=f, stderr=f,
+                                          tail=lambda text, **_: tails.append(text))
+            rc = await supervisor.wait(proc, 10)
+            await supervisor.wait_output(proc, 10)
+            return rc
+
+        try:
+            #  A hang fails the test
+            assert supervisor.submit(_run()).result(30) == 0
+        finally:
+            supervisor.stop()
+        expected = "x" * line_len + "\ny\n"
+        assert "".join(tails) == expected
+        assert tails[-1] == "y\n"
+        f.seek(0)
+        assert f.read() == expected
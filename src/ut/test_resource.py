@@ -2,10 +2,12 @@ from ut import *
 from ut.ut_dummy_defs import *
 from ut.ut_exec_defs import gen_sleep_cmd, gen_exec_step_desc, GOOD_EXEC_STEP_RES
 from xeet.core.result import TestStatus, TestPrimaryStatus, TestSecondaryStatus
-from xeet.core.test import TestPrimaryStatus
+from xeet.core.test import TestPrimaryStatus, Test
+from xeet.core.tests_runner import _TestsPool
 from timeit import default_timer as timer
 from typing import Any
 import random
+import threading
 
 
 def gen_resouce_req(res_name: str, count: int | None = None, names: list[str] = list(),
@@ -124,3 +126,64 @@ def test_randomized_resource_race(xut: XeetUnittest):
         for name, res in results.items():
             xut.update_test_res_test(expected, name)
             assert_test_results_equal(res, expected)
+
+
+def test_resource_wait_order(xut: XeetUnittest):
+    xut.add_resource("res1", "", "simple", reset=True)
+    sleep_desc = gen_exec_step_desc(cmd=gen_sleep_cmd(0.05))
+    res_tests = [f"test{i}" for i in range(5)]
+    for name in res_tests:
+        xut.add_test(name, run=[sleep_desc], resources=[gen_resouce_req("res1")])
+    xut.add_test("free_test", run=[sleep_desc], save=True)
+
+    results = xut.run_tests(threads=3).iter_results[0].mtrx_results[0].results
+    for res in results.values():
+        assert res.status == PASSED_TEST_STTS
+    #  Tests waiting for a resource get it in their queueing order, one at a time
+    res_results = sorted([results[name] for name in res_tests], key=lambda r: r.start_time)
+    assert [r.test.name for r in res_results] == res_tests
+    for prev, curr in zip(res_results, res_results[1:]):
+        assert curr.start_time >= prev.end_time
+    #  A test with no resources doesn't wait for the busy resource
+    assert results["free_test"].start_time < res_results[1].start_time
+
+
+def test_resource_vars(xut: XeetUnittest, monkeypatch):
+    xut.add_resource("res1", "r0", "value0", reset=True)
+    step_desc = gen_dummy_step_desc(dummy_val0="{res_var}")
+    xut.add_test(TEST0, run=[step_desc], resources=[gen_resouce_req("res1", 1, as_var="res_var")])
+    #  The resource variable conflicts with a test variable
+    xut.add_test(TEST1, run=[step_desc], variables={"res_var": 1},
+                 resources=[gen_resouce_req("res1", 1, as_var="res_var")], save=True)
+
+    #  Tests are materialized by their runners, not while the tests pool is locked
+    in_pool = threading.local()
+    next_item = _TestsPool._next_item
+    materialize = Test.materialize
+
+    def checked_next_item(self, *args, **kwargs):
+        in_pool.locked = True
+        try:
+            return next_item(self, *args, **kwargs)
+        finally:
+            in_pool.locked = False
+
+    locked_materializations = []
+
+    def checked_materialize(self) -> None:
+        if getattr(in_pool, "locked", False):
+            locked_materializations.append(self.name)
+        materialize(self)
+
+    monkeypatch.setattr(_TestsPool, "_next_item", checked_next_item)
+    monkeypatch.setattr(Test, "materialize", checked_materialize)
+
+    step_res = gen_dummy_step_result(step_desc)
+    step_res.dummy_val0 = "value0"
+    expected = gen_test_result(status=PASSED_TEST_STTS, main_results=[step_res])
+    xut.run_compare_test(TEST0, expected)
+
+    res = xut.run_test(TEST1)
+    assert res.status == TestStatus(TestPrimaryStatus.NotRun, TestSecondaryStatus.InitErr)
+    assert "already exists" in res.status_reason
+    assert not locked_materializations
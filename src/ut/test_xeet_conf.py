@@ -2,8 +2,11 @@ from ut import *
 from ut.ut_dummy_defs import *
 from xeet.core import TestsCriteria
 from xeet.core.xeet_conf import (XeetModel, XeetIncludeLoopException, _XeetConf, xeet_conf,
-                                 clear_conf_cache, BaseXeetSettings)
+                                 clear_conf_cache, BaseXeetSettings, _read_conf_file)
+from xeet.core import RuntimeInfo
+import xeet.core.xeet_conf as xeet_conf_mod
 from xeet.core.test import StepsInheritType, TestModel
+from xeet.core.matrix import Matrix
 import os
 
 
@@ -131,6 +134,111 @@ def test_inclusion_loop():
         xeet_conf(BaseXeetSettings(conf2.file_path))
 
 
+def test_config_disk_cache(monkeypatch):
+    CONF0 = "cache_conf0.yaml"
+    CONF1 = "cache_conf1.yaml"
+
+    conf0 = ConfigTestWrapper(CONF0)
+    conf0.add_test(TEST0, arg=1)
+    conf0.add_var("var0", 0, save=True)
+    conf1 = ConfigTestWrapper(CONF1)
+    conf1.add_include(conf0.file_path)
+    conf1.add_test(TEST1, arg=2, save=True)
+
+    def load() -> XeetModel:
+        clear_conf_cache()
+        return xeet_conf(BaseXeetSettings(conf1.file_path, save_conf_cache=True)).model
+
+    model = load()
+    assert [t["name"] for t in model.tests] == [TEST0, TEST1]
+
+    #  Unchanged files are not read again
+    def no_read(*_, **__):
+        raise AssertionError("configuration file was read")
+
+    with monkeypatch.context() as m:
+        m.setattr("xeet.core.xeet_conf._read_conf_file", no_read)
+        cached = load()
+    assert cached.tests == model.tests
+    assert cached.variables == {"var0": 0}
+
+    #  Touched files that didn't change don't invalidate the cache
+    os.utime(conf0.file_path, ns=(0, 0))
+    with monkeypatch.context() as m:
+        m.setattr("xeet.core.xeet_conf._read_conf_file", no_read)
+        cached = load()
+    assert cached.tests == model.tests
+
+    #  A change in an included file invalidates the cache
+    conf0.add_var("var0", 1, save=True)
+    model = load()
+    assert model.variables == {"var0": 1}
+
+
+def test_config_disk_cache_env(monkeypatch):
+    conf0 = ConfigTestWrapper("cache_env_conf0.yaml")
+    conf0.add_var("var0", 0, save=True)
+    conf1 = ConfigTestWrapper("cache_env_conf1.yaml")
+    conf1.add_var("var0", 1, save=True)
+    conf2 = ConfigTestWrapper("cache_env_conf2.yaml")
+    conf2.add_include("{$XEET_UT_CONF}", save=True)
+
+    def load() -> XeetModel:
+        clear_conf_cache()
+        return xeet_conf(BaseXeetSettings(conf2.file_path, save_conf_cache=True)).model
+
+    #  The cache is invalid once an environment variable in an include path changes
+    monkeypatch.setenv("XEET_UT_CONF", conf0.file_path)
+    assert load().variables == {"var0": 0}
+    monkeypatch.setenv("XEET_UT_CONF", conf1.file_path)
+    assert load().variables == {"var0": 1}
+
+
+def test_config_disk_cache_not_saved():
+    conf = ConfigTestWrapper("cache_no_save.yaml")
+    conf.add_test(TEST0, arg=1, save=True)
+    clear_conf_cache()
+    xeet = xeet_conf(BaseXeetSettings(conf.file_path))
+    cache_path = xeet_conf_mod._conf_cache_path(xeet.rti)
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    clear_conf_cache()
+    xeet_conf(BaseXeetSettings(conf.file_path))
+    assert not os.path.exists(cache_path)
+
+
+def test_shared_include_parsed_once(monkeypatch):
+    base = ConfigTestWrapper("shared_base.yaml")
+    base.add_test(TEST0, arg=0)
+    base.add_var("var0", 0, save=True)
+    mid0 = ConfigTestWrapper("shared_mid0.yaml")
+    mid0.add_include(base.file_path)
+    mid0.add_test(TEST1, arg=1, save=True)
+    mid1 = ConfigTestWrapper("shared_mid1.yaml")
+    mid1.add_include(base.file_path)
+    mid1.add_test(TEST2, arg=2, save=True)
+    top = ConfigTestWrapper("shared_top.yaml")
+    top.add_include(mid0.file_path)
+    top.add_include(mid1.file_path)
+    top.add_test(TEST3, arg=3, save=True)
+
+    parsed = []
+    parse_conf_file = xeet_conf_mod._parse_conf_file
+
+    def counting_parse(path: str, root_dir: str) -> XeetModel:
+        parsed.append(path)
+        return parse_conf_file(path, root_dir)
+
+    monkeypatch.setattr(xeet_conf_mod, "_parse_conf_file", counting_parse)
+    rti = RuntimeInfo(BaseXeetSettings(top.file_path))
+    sources = xeet_conf_mod._ConfSources()
+    model = _read_conf_file(rti.xeet_file_path, rti.xvars, rti.root_dir, sources=sources)
+    assert sorted(parsed) == sorted(sources.files)
+    assert len(parsed) == 4
+    assert {t["name"] for t in model.tests} == {TEST0, TEST1, TEST2, TEST3}
+    assert model.variables == {"var0": 0}
+
+
 def test_get_test_by_name():
     CONF0 = "conf0.yaml"
     conf0 = ConfigTestWrapper(CONF0)
@@ -300,6 +408,34 @@ def test_step_lists_inheritance():
                             post_run=[DUMMY_OK_STEP_DESC, DUMMY_OK_STEP_DESC])
 
 
+def test_base_models_resolved_once():
+    conf0 = ConfigTestWrapper("bases_conf.yaml")
+    conf0.add_test(TEST0, run=[DUMMY_OK_STEP_DESC], abstract=True, reset=True)
+    conf0.add_test(TEST1, pre_run=[DUMMY_OK_STEP_DESC], base=TEST0, abstract=True)
+    for i in range(2, 7):
+        conf0.add_test(f"test{i}", base=TEST1, post_run=[DUMMY_OK_STEP_DESC])
+    conf0.save()
+    clear_conf_cache()
+    xeet = xeet_conf(BaseXeetSettings(conf0.file_path))
+
+    looked_up = []
+    test_desc = xeet.test_desc
+
+    def counting_test_desc(name: str):
+        looked_up.append(name)
+        return test_desc(name)
+
+    xeet.test_desc = counting_test_desc  # type: ignore
+    tests = xeet.get_tests(TestsCriteria())
+    assert len(tests) == 5
+    assert sorted(looked_up) == [TEST0, TEST1]
+    assert set(xeet.base_models.keys()) == {TEST0, TEST1}
+    for test in tests:
+        assert len(test.model.pre_run) == 1
+        assert len(test.model.run) == 1
+        assert len(test.model.post_run) == 1
+
+
 def test_exclude_tests():
     CONF0 = "conf0.yaml"
     conf0 = ConfigTestWrapper(CONF0)
@@ -313,6 +449,70 @@ def test_exclude_tests():
     assert tests[0].name == TEST2
 
 
+def test_lazy_matrix_tests():
+    matrix = {"m0": [0, 1, 2, 3], "m1": ["a", "b", "c", "d", "e"], "m2": list(range(6))}
+    conf0 = ConfigTestWrapper("lazy_mtrx_conf.yaml")
+    conf0.add_test(TEST0, matrix=matrix, reset=True)
+    conf0.add_test(TEST1, save=True)
+    clear_conf_cache()
+
+    xeet = xeet_conf(BaseXeetSettings(conf0.file_path))
+    #  Permutations tests aren't stored in the model
+    assert [t["name"] for t in xeet.model.tests] == [TEST0, TEST1]
+
+    prmttns = list(Matrix(matrix).permutations())
+    assert len(prmttns) == 120
+    assert [Matrix(matrix).permutation(i) for i in range(120)] == prmttns
+
+    tests = xeet.get_tests(_ALL_TESTS_CRIT)
+    assert [t.name for t in tests] == [f"{TEST0}:{i}" for i in range(120)] + [TEST1]
+    for i in (0, 57, 119):
+        assert tests[i].model.prmttn == prmttns[i]
+        assert not tests[i].model.matrix
+
+    desc = xeet.test_desc(f"{TEST0}:57")
+    assert desc is not None
+    assert desc["prmttn"] == prmttns[57]
+    assert "matrix" not in desc
+    assert xeet.test_desc(f"{TEST0}:120") is None
+    assert xeet.test_desc(f"{TEST1}:0") is None
+
+
+def test_lazy_tests():
+    conf0 = ConfigTestWrapper("lazy_tests_conf.yaml")
+    conf0.add_test(TEST0, short_desc="first", run=[DUMMY_OK_STEP_DESC], reset=True)
+    conf0.add_test(TEST1, short_desc="second", run=[{"type": "no_such_type"}], save=True)
+    clear_conf_cache()
+    xeet = xeet_conf(BaseXeetSettings(conf0.file_path))
+
+    headers = xeet.get_test_headers(_ALL_TESTS_CRIT)
+    assert [(h.name, h.short_desc, h.error) for h in headers] == \
+        [(TEST0, "first", ""), (TEST1, "second", "")]
+
+    tests = xeet.get_tests(_ALL_TESTS_CRIT)
+    #  Steps are built only when needed
+    assert all(not t._main_phase.steps for t in tests)
+    assert not tests[0].error
+    assert len(tests[0].main_phase.steps) == 1
+    assert tests[1].error
+
+
+def test_lazy_tests_phases():
+    conf0 = ConfigTestWrapper("lazy_tests_phases_conf.yaml")
+    conf0.add_test(TEST0, pre_run=[DUMMY_OK_STEP_DESC], run=[DUMMY_OK_STEP_DESC],
+                   post_run=[DUMMY_OK_STEP_DESC, DUMMY_OK_STEP_DESC], reset=True, save=True)
+    clear_conf_cache()
+    xeet = xeet_conf(BaseXeetSettings(conf0.file_path))
+
+    #  Accessing a phase builds the steps of all the phases
+    test = xeet.get_tests(_ALL_TESTS_CRIT)[0]
+    assert not test._materialized
+    assert len(test.post_phase.steps) == 2
+    assert test._materialized
+    assert len(test.pre_phase.steps) == 1
+    assert len(test.main_phase.steps) == 1
+
+
 def test_fuzzy_names():
     CONF0 = "conf0.yaml"
     conf0 = ConfigTestWrapper(CONF0)
@@ -355,6 +555,33 @@ def test_misc_test_filtering():
     assert len(tests) == 0
 
 
+def test_tests_index_selection():
+    conf0 = ConfigTestWrapper("index_conf.yaml")
+    conf0.add_test(TEST0, matrix={"m0": [0, 1, 2]}, groups=[GROUP0], reset=True)
+    conf0.add_test(TEST1, groups=[GROUP0, GROUP1])
+    conf0.add_test("other_test", groups=[GROUP1])
+    conf0.add_test("ot", save=True)
+    clear_conf_cache()
+
+    xeet = xeet_conf(BaseXeetSettings(conf0.file_path))
+
+    def names(**kwargs) -> list[str]:
+        return [t.name for t in xeet.get_tests(TestsCriteria(**kwargs))]
+
+    prmttns = [f"{TEST0}:{i}" for i in range(3)]
+    assert names() == prmttns + [TEST1, "other_test", "ot"]
+    assert names(names={TEST0}) == prmttns
+    assert names(names={f"{TEST0}:1"}) == [f"{TEST0}:1"]
+    assert names(include_groups={GROUP0}, exclude_names={f"{TEST0}:0", TEST1}) == prmttns[1:]
+    assert names(exclude_names={TEST0}) == [TEST1, "other_test", "ot"]
+    assert names(require_groups={GROUP0, GROUP1}) == [TEST1]
+    assert names(fuzzy_names=["her_te"]) == ["other_test"]
+    assert names(fuzzy_names=["ot"]) == ["other_test", "ot"]
+    assert names(fuzzy_names=["no_such_name"]) == []
+    assert names(fuzzy_exclude_names={"test"}) == ["ot"]
+    assert names(matrix_tests=True, prmttn_tests=False, names={TEST0}) == [TEST0]
+
+
 def test_get_groups():
     CONF0 = "conf0.yaml"
     conf0 = ConfigTestWrapper(CONF0)
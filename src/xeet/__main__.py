@@ -2,7 +2,7 @@ from xeet import xeet_version
 from xeet.common import XeetException
 from xeet.log import init_logging, log_error, log_info
 from xeet.pr import *
-from xeet.core.api import SchemaType
+from xeet.core.api import SchemaType, SchedulePolicy, ExecutorType
 from xeet.core import TestsCriteria
 from xeet.console_printer import ConsolePrinterTestTimingOpts, ConsoleDisplayOpts
 import xeet.cli as actions
@@ -20,6 +20,8 @@ _DUMP_CMD = "dump"
 _DUMP_TEST_CMD = "test"
 _DUMP_SCHEMA_CMD = "schema"
 _DUMP_CONFIG_CMD = "config"
+_SERVE_WORKERS_CMD = "serve-workers"
+_WORKERS_AUTHKEY_ENV = "XEET_WORKERS_AUTHKEY"
 
 
 _DISPLAY_COMPONENTS = ConsoleDisplayOpts.components()
@@ -88,6 +90,16 @@ def _index_list_type_checker(value: str) -> set[int]:
     return indices
 
 
+def _shard_type_checker(value: str) -> tuple[int, int]:
+    tokens = value.strip().split('/')
+    if len(tokens) != 2 or not tokens[0].strip().isdigit() or not tokens[1].strip().isdigit():
+        raise argparse.ArgumentTypeError(f"'{value}' is not a valid shard, expected K/N")
+    index, count = int(tokens[0]), int(tokens[1])
+    if count < 1 or index < 1 or index > count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected 1 <= K <= N")
+    return index, count
+
+
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(prog='xeet')
     parser.add_argument('--version', action='version', version=f'v{xeet_version}')
@@ -133,7 +145,34 @@ def parse_arguments() -> argparse.Namespace:
                             help='set a variable')
     run_parser.add_argument('-j', '--jobs', metavar='NUMBER', nargs='?', default=1, type=int,
                             help='number of jobs to use')
-    run_parser.add_argument('--randomize', action='store_true', default=False)
+    run_parser.add_argument('--randomize', action='store_true', default=False,
+                            help='same as --schedule=random')
+    run_parser.add_argument('--schedule', choices=[s.value for s in SchedulePolicy],
+                            default=SchedulePolicy.Config.value, help='tests scheduling policy')
+    run_parser.add_argument('--history-file', metavar='FILE', default="",
+                            help='tests durations history file')
+    run_parser.add_argument('--executor', choices=[e.value for e in ExecutorType],
+                            default=ExecutorType.Thread.value,
+                            help='tests execution backend')
+    run_parser.add_argument('--fail-fast', metavar='N', nargs='?', const=1, default=0, type=int,
+                            help='stop the run after N failed tests (default: 1)')
+    run_parser.add_argument('--shard', metavar='K/N', default=(1, 1), type=_shard_type_checker,
+                            help='run only shard K of N, balanced by the tests history')
+    run_parser.add_argument('--use-cache', action='store_true', default=False,
+                            help='reuse passed results of unchanged tests')
+    run_parser.add_argument('--cache-file', metavar='FILE', default="",
+                            help='results cache file')
+    run_parser.add_argument('--results-file', metavar='FILE', default="",
+                            help='last run results file')
+    run_parser.add_argument('--last-failed', action='store_true', default=False,
+                            help='run only the tests that failed in the last run')
+    run_parser.add_argument('--failed-first', action='store_true', default=False,
+                            help='run the tests that failed in the last run first')
+    run_parser.add_argument('--workers', metavar='ADDRS', default=[],
+                            type=_tokens_list_type_checker,
+                            help='run on remote workers (comma separated HOST:PORT list)')
+    run_parser.add_argument('--concurrent-permutations', action='store_true', default=False,
+                            help='run all matrix permutations and iterations concurrently')
     run_parser.add_argument('-p', '--permutations', default=set(), metavar='IDX',
                             type=_index_list_type_checker, help='matrix permutations to run')
     run_parser.add_argument('-P', '--no-permutations',  default=set(), metavar='IDX',
@@ -182,6 +221,15 @@ def parse_arguments() -> argparse.Namespace:
 
     subparsers.add_parser(_GROUPS_CMD, parents=[common_parser], help='list groups')
 
+    serve_parser = subparsers.add_parser(_SERVE_WORKERS_CMD, parents=[common_parser],
+                                         help='serve tests workers for remote runs')
+    serve_parser.add_argument('--listen', metavar='HOST:PORT', required=True,
+                              help='address to listen on')
+    serve_parser.add_argument('--debug', action='store_true', default=False,
+                              help='run tests in debug mode')
+    serve_parser.add_argument('-O', '--output-dir', metavar='DIR', default=None,
+                              help='output directory for test results')
+
     dump_parser = subparsers.add_parser(_DUMP_CMD,
                                         help='dump a test, schema or configuration descriptor')
     dump_subparsers = dump_parser.add_subparsers(dest='dump_type', help='dump commands')
@@ -212,6 +260,14 @@ def parse_arguments() -> argparse.Namespace:
                 args.jobs = 1
         elif args.jobs <= 0:
             parser.error("number of jobs must be a positive integer")
+        if args.fail_fast < 0:
+            parser.error("fail-fast count can't be negative")
+        if args.workers and not os.environ.get(_WORKERS_AUTHKEY_ENV):
+            parser.error(f"remote workers require the {_WORKERS_AUTHKEY_ENV} environment variable")
+    elif args.subparsers_name == _SERVE_WORKERS_CMD:
+        if not os.environ.get(_WORKERS_AUTHKEY_ENV):
+            parser.error(f"serving workers requires the {_WORKERS_AUTHKEY_ENV} environment "
+                         "variable")
     elif args.subparsers_name == _INFO_CMD:
         args.all = True
     return args
@@ -256,7 +312,24 @@ def _run_settings(args: argparse.Namespace) -> actions.XeetRunSettings:
         debug=args.debug,
         iterations=args.repeat,
         jobs=args.jobs,
-        randomize=args.randomize)
+        randomize=args.randomize,
+        schedule=args.schedule,
+        history_file=args.history_file,
+        concurrent_prmttns=args.concurrent_permutations,
+        executor=args.executor,
+        fail_fast=args.fail_fast,
+        shard=args.shard,
+        use_cache=args.use_cache,
+        cache_file=args.cache_file,
+        results_file=args.results_file,
+        last_failed=args.last_failed,
+        failed_first=args.failed_first,
+        workers=args.workers,
+        workers_authkey=_workers_authkey())
+
+
+def _workers_authkey() -> bytes:
+    return os.environ.get(_WORKERS_AUTHKEY_ENV, "").encode()
 
 
 def xrun() -> int:
@@ -286,6 +359,10 @@ def xrun() -> int:
             actions.list_tests(args.conf, args.names_only, criteria)
         elif cmd_name == _GROUPS_CMD:
             actions.list_groups(args.conf)
+        elif cmd_name == _SERVE_WORKERS_CMD:
+            settings = actions.BaseXeetSettings(file_path=args.conf, debug=args.debug,
+                                                output_dir=args.output_dir)
+            actions.serve_workers(settings, args.listen, _workers_authkey())
         elif cmd_name == _INFO_CMD:
             criteria = _tests_criteria(args, args.all, not args.no_matrix_tests,
                                        args.show_permutations_tests)
@@ -1,6 +1,6 @@
 from xeet.core.test import Test
 from xeet.core.step import Step
-from xeet.core import TestsCriteria
+from xeet.core import TestsCriteria, BaseXeetSettings
 from xeet.pr import stdout, pr_warn
 from xeet.log import log_verbose
 from .console_printer import (ConsolePrinter, ConsoleDisplayOpts, DebugPrinter,
@@ -92,7 +92,7 @@ def list_tests(conf: str, names_only: bool, criteria: TestsCriteria) -> None:
         return short_str(token, max_len)
 
     log_verbose(f"Fetch tests list cirteria: {criteria}")
-    tests = core.fetch_tests_list(conf, criteria)
+    tests = core.fetch_test_headers(conf, criteria)
 
     _max_name_print_len = 40
     _max_desc_print_len = 65
@@ -113,7 +113,7 @@ def list_tests(conf: str, names_only: bool, criteria: TestsCriteria) -> None:
             pr_info(err_print_fmt.format(name_str, error_str))
             continue
         pr_info(print_fmt.format(_display_token(test.name, _max_name_print_len),
-                                 _display_token(test.model.short_desc, _max_desc_print_len)))
+                                 _display_token(test.short_desc, _max_desc_print_len)))
 
 
 RunVerbosity = ConsolePrinterVerbosity
@@ -137,6 +137,16 @@ def run_tests(run_settings: XeetRunSettings, display_opts: ConsoleDisplayOpts) -
         return rc
 
 
+def serve_workers(settings: BaseXeetSettings, address: str, authkey: bytes) -> None:
+    pr_info(f"Serving workers on {address}, press Ctrl-C to stop")
+    try:
+        core.serve_workers(settings, address, authkey)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        raise XeetException(f"Error serving workers on {address} - {e}")
+
+
 def dump_test(file_path: str, name: str) -> None:
     desc = core.fetch_test_desc(file_path, name)
     if desc is None:
@@ -1,18 +1,22 @@
 from xeet import XeetException
 from xeet.pr import *
+from xeet.log import log_warn
 from pydantic import Field, RootModel, ValidationError, BaseModel
 from pydantic.json_schema import SkipJsonSchema
-from typing import Any
-from collections.abc import Iterable, Callable
+from typing import Any, Coroutine, IO
+from collections.abc import Iterable, Iterator, Callable
+from collections import deque
+from itertools import islice
 from jsonpath_ng.ext import parse as parse_ext
 from jsonpath_ng.exceptions import JsonPathParserError
-from functools import cache, wraps
+from functools import cache, lru_cache, partial, wraps
 from pathlib import PureWindowsPath
 from dataclasses import dataclass
 from rich.text import Text
 from threading import Lock
 import re
-import time
+import difflib
+import itertools
 import threading
 import re
 import os
@@ -61,14 +65,96 @@ class XeetInvalidVarType(XeetException):
 
 
 _REF_PREFIX = "$ref://"
+_VAR_NAME_CHARS = r'a-zA-Z0-9"\'_\.\$\[\]'
+_VAR_RE = re.compile(rf'\\*{{[{_VAR_NAME_CHARS}]*?}}')
+#  An unmatched '{', followed only by characters that can be a part of a variable name
+_OPEN_BRACE_RE = re.compile(rf'{{[{_VAR_NAME_CHARS}]*$')
+
+#  Template segments kinds
+_LITERAL = 0
+_VAR = 1
+_ENV = 2
+
+
+#  A string compiled to a list of literal text, variable references and environment variable
+#  references segments. Escaped references and backslashes are resolved at compile time to
+#  literal text.
+@dataclass
+class _StrTemplate:
+    segments: list[tuple[int, str]]
+    #  Set if references substitution might form new references with the text around them,
+    #  (e.g., '{{var}}'), which requires rescanning the string after every substitution
+    rescan: bool
+
+
+#  Return the string's template, or None if the string has no references
+@lru_cache(maxsize=4096)
+def _compile_str(s: str) -> _StrTemplate | None:
+    segments: list[tuple[int, str]] = []
+    rescan = False
+    literal = ""
+    pos = 0
+    for m in _VAR_RE.finditer(s):
+        raw = s[pos:m.start()]
+        pos = m.end()
+        m_str = m.group()
+        name_start = m_str.index("{")
+        n_backslashes = name_start
+        #  Backslashes pairs are kept as they are, an odd backslash escapes the reference
+        if n_backslashes % 2:
+            literal += raw + m_str[:n_backslashes - 1] + m_str[name_start:]
+            continue
+        if n_backslashes == 0 and _OPEN_BRACE_RE.search(raw):
+            rescan = True
+        literal += raw + m_str[:n_backslashes]
+        if literal:
+            segments.append((_LITERAL, literal))
+            literal = ""
+        name = m_str[name_start + 1:-1]
+        if name.startswith("$"):
+            segments.append((_ENV, name[1:]))
+        else:
+            segments.append((_VAR, name))
+    if pos == 0 and not segments and not literal:
+        return None
+    literal += s[pos:]
+    if literal:
+        segments.append((_LITERAL, literal))
+    return _StrTemplate(segments, rescan)
+
+
+#  Names of the environment variables the string references directly
+def env_var_refs(s: str) -> list[str]:
+    template = _compile_str(s)
+    if template is None:
+        return []
+    return [text for kind, text in template.segments if kind == _ENV]
+
+
+#  Substituted text with these characters might form new references with the text around it
+_RESCAN_CHARS_RE = re.compile(r'[{}\\]')
+
+#  Variables being expanded by the current thread, to detect recursive expansion
+_expansion_state = threading.local()
+
+
+_version_counter = itertools.count(1)
 
 
 class XeetVars:
-    _var_re = re.compile(r'\\*{[a-zA-Z0-9"\'_\.\$\[\]]*?}')
+    _var_re = _VAR_RE
+    _MAX_CACHED = 1024
 
     def __init__(self, start_vars: dict | None = None, parent: "XeetVars | None" = None) -> None:
         self.parent = parent
         self.vars_map = {}
+        #  Expanded strings cache of this instance. Entries are stamped with the versions of
+        #  the variables of this instance and its parents when they were expanded, and are used
+        #  only if none of them changed since. Versions are taken from a global counter, so a
+        #  version is never reused.
+        self.version = next(_version_counter)
+        self._cache: dict[str, tuple[tuple[int, ...], Any]] = {}
+        self._cache_lock = Lock()
         if start_vars:
             self.set_vars(start_vars)
 
@@ -95,6 +181,24 @@ class XeetVars:
         except XeetException as e:
             raise XeetNoSuchVarException(f"Invalid variable path '{name}.{path}' - {e}")
 
+    #  Expanded value of a variable. A variable whose expansion requires its own value is
+    #  reported with the chain of variables that lead to it.
+    def _expand_var(self, name: str) -> Any:
+        chain: dict[tuple[int, str], str] | None = getattr(_expansion_state, "chain", None)
+        if chain is None:
+            chain = _expansion_state.chain = {}
+        key = (id(self), name)
+        if key in chain:
+            names = list(chain.values())
+            names = names[names.index(name):] + [name]
+            raise XeetRecursiveVarException(
+                f"Recursive var expansion for '{name}' ({' -> '.join(names)})")
+        chain[key] = name
+        try:
+            return self.expand(self._value_of(name))
+        finally:
+            del chain[key]
+
     def has_var(self, name: str) -> bool:
         try:
             self._value_of(name)
@@ -110,19 +214,32 @@ class XeetVars:
     def _pop_var(self, name: str) -> Any:
         return self.vars_map.pop(name)
 
+    def _changed(self) -> None:
+        self.version = next(_version_counter)
+        with self._cache_lock:
+            self._cache.clear()
+
     def set_vars(self, vars_map: dict) -> None:
         for name, value in vars_map.items():
             self._set_var(name, value)
-        self._expand_str.cache_clear()
+        self._changed()
 
     def pop_vars(self, var_names: Iterable) -> None:
         for name in var_names:
             self._pop_var(name)
-        self._expand_str.cache_clear()
+        self._changed()
 
     def reset(self) -> None:
         self.vars_map.clear()
-        self._expand_str.cache_clear()
+        self._changed()
+
+    def _stamp(self) -> tuple[int, ...]:
+        ret = []
+        xvars = self
+        while xvars is not None:
+            ret.append(xvars.version)
+            xvars = xvars.parent
+        return tuple(ret)
 
     def expand(self, v: Any) -> Any:
         try:
@@ -136,12 +253,23 @@ class XeetVars:
                 ret = v
             return ret
         except RecursionError:
-            raise XeetRecursiveVarException("Recursive var expansion for '{s}'")
+            raise XeetRecursiveVarException(f"Recursive var expansion for '{v}'")
 
-    @cache
     def _expand_str(self, s: str) -> Any:
         if not s:
             return s
+        stamp = self._stamp()
+        cached = self._cache.get(s)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        ret = self._expand_str_uncached(s)
+        with self._cache_lock:
+            if len(self._cache) >= self._MAX_CACHED:
+                del self._cache[next(iter(self._cache))]  # Drop the oldest entry
+            self._cache[s] = (stamp, ret)
+        return ret
+
+    def _expand_str_uncached(self, s: str) -> Any:
         if len(s) >= len(_REF_PREFIX):
             if s.startswith(_REF_PREFIX[0]) and s[1:].startswith(_REF_PREFIX):
                 return s[1:]
@@ -149,11 +277,34 @@ class XeetVars:
                 var_name = s[len(_REF_PREFIX):]
                 if not var_name:
                     raise XeetBadVarNameException("Empty variable name")
-                v = self._value_of(var_name)
-                return self.expand(v)
+                return self._expand_var(var_name)
         return self._expand_str_literals(s)
 
+    #  Strings are compiled once, and expanded in a single pass over their segments. If the
+    #  substituted text might form new references, the string is expanded by rescanning instead.
     def _expand_str_literals(self, s: str) -> str:
+        template = _compile_str(s)
+        if template is None:
+            return s
+        if template.rescan:
+            return self._rescan_str_literals(s)
+        parts = []
+        for kind, text in template.segments:
+            if kind == _LITERAL:
+                parts.append(text)
+                continue
+            if kind == _ENV:
+                value = os.getenv(text, "")
+            else:
+                value = str(self._expand_var(text))
+            if _RESCAN_CHARS_RE.search(value):
+                return self._rescan_str_literals(s)
+            parts.append(value)
+        return "".join(parts)
+
+    #  Expand the first reference and expand the result again, so the substituted text is
+    #  expanded with the text around it
+    def _rescan_str_literals(self, s: str) -> str:
         if not s:
             return s
         m = XeetVars._var_re.search(s)
@@ -179,7 +330,7 @@ class XeetVars:
         else:
             #  In case the value is a string, it might be expanded to a refernce
             #  string, soe expand it again.
-            m_str_value = self.expand(self._value_of(m_str))
+            m_str_value = self._expand_var(m_str)
             ret += str(m_str_value)
         e = m.end()
         s2 = s[e:]
@@ -250,9 +401,36 @@ def validate_str(v: str, min_len: int = -1, max_len: int = -1, strip: bool = Fal
     return True
 
 
+#  Write the content to a temporary file next to the file, and replace the file with it, so the
+#  file is never left partially written. Errors are logged as warnings, with the file's
+#  description. Returns False on error.
+def atomic_write(path: str, content: str | bytes, desc: str) -> bool:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp_path, "wb" if isinstance(content, bytes) else "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log_warn(f"Error saving {desc} '{path}' - {e.strerror or e}")
+        return False
+    return True
+
+
 #  Read the last n lines of a text file. Allows at most max_bytes to be read.
 #  this isn't very efficient for large files if max_bytes value is big, but
 #  it's intended for small text content.
+#  Run a coroutine that never suspends to completion, without an event loop. Tests and steps
+#  run as coroutines, which suspend only when they run on the process supervisor's loop.
+def run_sync(coro: Coroutine) -> Any:
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    coro.close()
+    raise XeetException("Coroutine suspended outside of an event loop")
+
+
 def text_file_tail(file_path: str, n_lines: int = 30, max_bytes=4096) -> str:
     if n_lines <= 0 or max_bytes <= 0:
         raise ValueError("Invalid n_lines or max_bytes")
@@ -319,15 +497,51 @@ def platform_path(path: str) -> str:
     return path
 
 
-#  Return a list of values found by the JSONPath expression
-def json_values(obj: dict | list, path: str) -> list[Any]:
+_SIMPLE_JSON_PATH_RE = re.compile(r"^[a-zA-Z_]\w*(\[\d+\])*(\.[a-zA-Z_]\w*(\[\d+\])*)*$",
+                                  re.ASCII)
+_SIMPLE_JSON_PATH_PART_RE = re.compile(r"([a-zA-Z_]\w*)|\[(\d+)\]", re.ASCII)
+#  Words that aren't field names in JSONPath expressions
+_JSON_PATH_KEYWORDS = {"where", "wherenot", "true", "false"}
+
+_SimpleJsonPath = tuple[str | int, ...]
+
+
+#  Plain dotted paths with indices (e.g., 'settings.steps[0].cmd') are compiled to a list of keys
+#  and indices, looked up directly. Other paths are parsed as JSONPath expressions.
+@lru_cache(maxsize=1024)
+def _compile_json_path(path: str) -> Any:
+    if _SIMPLE_JSON_PATH_RE.match(path):
+        parts = tuple(m.group(1) if m.group(1) is not None else int(m.group(2))
+                      for m in _SIMPLE_JSON_PATH_PART_RE.finditer(path))
+        if not _JSON_PATH_KEYWORDS.intersection(p for p in parts if isinstance(p, str)):
+            return parts
     try:
-        expr = parse_ext(path)
-        return [match.value for match in expr.find(obj)]
+        return parse_ext(path)
     except JsonPathParserError as e:
         raise XeetException(f"Invalid JSONPath expression: {path} - {e}")
 
 
+#  Same as matching a JSONPath expression of fields and indices: fields match keys of
+#  dictionaries, indices match items of lists and characters of strings
+def _simple_json_values(obj: Any, path: _SimpleJsonPath) -> list[Any]:
+    for part in path:
+        if isinstance(part, str):
+            if not isinstance(obj, dict) or part not in obj:
+                return []
+        elif not isinstance(obj, (list, str)) or part >= len(obj):
+            return []
+        obj = obj[part]
+    return [obj]
+
+
+#  Return a list of values found by the JSONPath expression
+def json_values(obj: dict | list, path: str) -> list[Any]:
+    expr = _compile_json_path(path)
+    if isinstance(expr, tuple):
+        return _simple_json_values(obj, expr)
+    return [match.value for match in expr.find(obj)]
+
+
 #  Return the first value found by the JSONPath expression. If no value is found, return None
 #  If multiple values are found, raise an exception
 def json_value(obj: dict | list, path: str) -> tuple[Any, bool]:
@@ -339,49 +553,104 @@ def json_value(obj: dict | list, path: str) -> tuple[Any, bool]:
     return values[0], True
 
 
-def short_str(s: str, max_len: int) -> str:
-    if len(s) <= max_len:
-        return s
-    return s[:max_len - 3] + "..."
+#  Iterate the lines of a text stream, without line breaks, the same as splitting its content
+#  by line breaks - content that ends with a line break has an empty last line
+def iter_text_lines(f: IO[str]) -> Iterator[str]:
+    for line in f:
+        if not line.endswith("\n"):
+            yield line
+            return
+        yield line[:-1]
+    yield ""
 
 
-class FileTailer:
-    def __init__(self, file_path: str, poll_interval: float = 0.05, pr_func: Callable = print
-                 ) -> None:
-        self.file_path = file_path
-        self.poll_interval = poll_interval
-        self.stop_event = threading.Event()
-        self.kill_event = threading.Event()
-        self.pr_func = pr_func
-        self.thread = threading.Thread(target=self.go)
+_TEXT_CHUNK_SIZE = 1 << 20
 
-    def start(self) -> None:
-        self.thread.start()
 
-    def go(self) -> None:
-        try:
-            with open(self.file_path, 'r') as file:
-                while True:
-                    if self.kill_event.is_set():
-                        return
-                    if self.stop_event.is_set() and file.tell() >= os.path.getsize(self.file_path):
-                        return
-                    where = file.tell()
-                    line = file.readline()
-                    if line:
-                        self.pr_func(line, end="")
-                    else:
-                        time.sleep(self.poll_interval)
-                        file.seek(where)  # Reset file pointer if no new data
-        except Exception as e:
-            self.pr_func(f"Error tailing file: {e}")
-
-    def stop(self, kill: bool = False) -> None:
-        self.stop_event.set()
-        if kill:
-            self.kill_event.set()
-        if self.thread.is_alive():
-            self.thread.join()
+#  Compare text streams in chunks, without reading them entirely
+def text_streams_equal(a: IO[str], b: IO[str]) -> bool:
+    while True:
+        chunk_a = a.read(_TEXT_CHUNK_SIZE)
+        if chunk_a != b.read(_TEXT_CHUNK_SIZE):
+            return False
+        if not chunk_a:
+            return True
+
+
+_DIFF_CONTEXT = 3
+_DIFF_TRUNCATED = "... diff truncated"
+_HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@$")
+
+
+#  Unified diff of two sequences of lines, with a bounded number of lines kept in memory. The
+#  lines are compared up to the first difference, and only a window of lines around it is
+#  diffed, so the diff's time and memory don't depend on the sequences length. Sequences that
+#  fit in the window get the same diff as difflib.unified_diff's.
+#  The diff is cut to max_lines lines, at hunks boundaries if possible. Hunks near the end of
+#  a window that doesn't reach the end of its sequence are left out, as they might be
+#  artifacts of the window's end.
+def bounded_unified_diff(a: Iterator[str], b: Iterator[str], fromfile: str, tofile: str,
+                         max_lines: int) -> str:
+    window_size = max(2 * max_lines, 100)
+    context: deque[str] = deque(maxlen=window_size)
+    start = 0
+    while True:
+        a_line = next(a, None)
+        b_line = next(b, None)
+        if a_line is None and b_line is None:
+            return ""
+        if a_line != b_line:
+            break
+        context.append(a_line)  # type: ignore
+        start += 1
+    offset = start - len(context)
+
+    windows: list[list[str]] = []
+    cut: list[bool] = []
+    for first, it in ((a_line, a), (b_line, b)):
+        window = list(context)
+        if first is not None:
+            window.append(first)
+            window.extend(islice(it, window_size - 1))
+        windows.append(window)
+        cut.append(first is not None and next(it, None) is not None)
+
+    margin = _DIFF_CONTEXT + 1
+    diff = difflib.unified_diff(windows[0], windows[1], fromfile=fromfile, tofile=tofile,
+                                lineterm="")
+    ret = [next(diff), next(diff)]  # File headers
+    hunks: list[list[str]] = []
+    for line in diff:
+        if line.startswith("@@"):
+            hunks.append([])
+        hunks[-1].append(line)
+    truncated = any(cut)
+    for i, hunk in enumerate(hunks):
+        m = _HUNK_HEADER_RE.match(hunk[0])
+        assert m is not None
+        a_end = int(m.group(1)) + int((m.group(2) or ",1")[1:])
+        b_end = int(m.group(3)) + int((m.group(4) or ",1")[1:])
+        if i > 0 and ((cut[0] and a_end > len(windows[0]) - margin) or
+                      (cut[1] and b_end > len(windows[1]) - margin)):
+            truncated = True
+            break
+        hunk[0] = f"@@ -{int(m.group(1)) + offset}{m.group(2) or ''} " \
+            f"+{int(m.group(3)) + offset}{m.group(4) or ''} @@"
+        if len(ret) + len(hunk) > max_lines:
+            if i == 0:
+                ret.extend(hunk[:max(max_lines - len(ret), 1)])
+            truncated = True
+            break
+        ret.extend(hunk)
+    if truncated:
+        ret.append(_DIFF_TRUNCATED)
+    return "\n".join(ret)
+
+
+def short_str(s: str, max_len: int) -> str:
+    if len(s) <= max_len:
+        return s
+    return s[:max_len - 3] + "..."
 
 
 @dataclass
@@ -389,21 +658,86 @@ class StrFilterData:
     from_str: str
     to_str: str
     regex: bool = False
-    from_re: re.Pattern | None = None
 
 
-def filter_str(s: str, filters: Iterable[StrFilterData]) -> str:
-    def _filter_all(s: str, fltr: StrFilterData) -> str:
-        if fltr.regex:
-            if fltr.from_re is None:
-                fltr.from_re = re.compile(fltr.from_str)
-            return fltr.from_re.sub(fltr.to_str, s)
+def _strs_overlap(a: str, b: str) -> bool:
+    if a in b or b in a:
+        return True
+    return any(a.endswith(b[:i]) or b.endswith(a[:i]) for i in range(1, min(len(a), len(b))))
 
-        return s.replace(fltr.from_str, fltr.to_str)
 
-    for fltr in filters:
-        s = _filter_all(s, fltr)
-    return s
+#  Whether applying the plain filters 'first' and 'second' in a single pass is the same as
+#  applying them one after the other. Their 'from' strings mustn't overlap, and 'first' mustn't
+#  create 'second's 'from' string - by its 'to' string, or by joining the text around it.
+def _independent_filters(first: StrFilterData, second: StrFilterData) -> bool:
+    if not first.from_str or not second.from_str:
+        return False
+    if _strs_overlap(first.from_str, second.from_str):
+        return False
+    if set(first.to_str) & set(second.from_str):
+        return False
+    return bool(first.to_str) or len(second.from_str) == 1
+
+
+#  String filters, compiled once and applied to many strings, possibly by several threads.
+#  Consecutive plain filters that are independent of each other are merged to a single regex
+#  alternation, so they are applied in a single pass. Filters that never match across lines
+#  (plain filters with no line breaks) can be applied line by line.
+class StrFilter:
+    def __init__(self, filters: Iterable[StrFilterData]) -> None:
+        self.filters = list(filters)
+        self.stages: list[Callable[[str], str]] = []
+        self.line_safe = True
+        group: list[StrFilterData] = []
+        for fltr in self.filters:
+            if fltr.regex:
+                self._add_plain_stage(group)
+                group = []
+                try:
+                    from_re = re.compile(fltr.from_str)
+                except re.error as e:
+                    raise XeetException(f"Invalid filter regex '{fltr.from_str}' - {e}")
+                self.stages.append(partial(from_re.sub, fltr.to_str))
+                self.line_safe = False
+                continue
+            if not fltr.from_str or "\n" in fltr.from_str:
+                self.line_safe = False
+            if not all(_independent_filters(prev, fltr) for prev in group):
+                self._add_plain_stage(group)
+                group = []
+            group.append(fltr)
+        self._add_plain_stage(group)
+
+    def _add_plain_stage(self, group: list[StrFilterData]) -> None:
+        if not group:
+            return
+        if len(group) == 1:
+            from_str, to_str = group[0].from_str, group[0].to_str
+            self.stages.append(lambda s: s.replace(from_str, to_str))
+            return
+        replacements = {fltr.from_str: fltr.to_str for fltr in group}
+        from_re = re.compile("|".join(re.escape(fltr.from_str) for fltr in group))
+        self.stages.append(partial(from_re.sub, lambda m: replacements[m.group()]))
+
+    def __bool__(self) -> bool:
+        return bool(self.stages)
+
+    def __call__(self, s: str) -> str:
+        for stage in self.stages:
+            s = stage(s)
+        return s
+
+    #  Filter the content of a text stream, line by line if possible
+    def filter_stream(self, f: IO[str]) -> Iterator[str]:
+        if self.line_safe:
+            for line in f:
+                yield self(line)
+        else:
+            yield self(f.read())
+
+
+def filter_str(s: str, filters: Iterable[StrFilterData]) -> str:
+    return StrFilter(filters)(s)
 
 
 def underline(title: str, underline_char='=') -> str:
@@ -134,10 +134,24 @@ class ConsolePrinter(LockableEventReporter):
             for k, v in self.mtrx.values.items():
                 pr_info(f"  {k}: {', '.join(map(str, v))}")
 
+    #  When matrix permutations run concurrently, the results of different permutations and
+    #  iterations are mixed, so the permutation and iteration indexes are added to the test name.
+    def _test_name(self, test: Test) -> str:
+        if test.scope is None:
+            return test.name
+        tags = []
+        if self.mtrx_count > 1:
+            tags.append(f"#{test.scope.mpi}")
+        if self.iterations > 1:
+            tags.append(f"i{test.scope.iteration}")
+        if not tags:
+            return test.name
+        return f"{test.name} ({'@'.join(tags)})"
+
     @locked
     def on_test_start(self, test: Test) -> None:
 
-        self.curr_tests.append(test.name)
+        self.curr_tests.append(self._test_name(test))
         self._print_curr_tests()
 
     @locked
@@ -145,7 +159,8 @@ class ConsolePrinter(LockableEventReporter):
         if not self.display.tests:
             return
         test = test_res.test
-        msg = short_str(test.name, 40)
+        test_name = self._test_name(test)
+        msg = short_str(test_name, 40)
         msg = colorize_str(f"{msg:<45}", XColors.Bold)
 
         status_text = str(TestStatus(test_res.status.primary))
@@ -171,13 +186,21 @@ class ConsolePrinter(LockableEventReporter):
                 #  Escape special characters (e.g. Saure brackets) so rich won't get confused
                 details = rich_escape(details)
                 msg += f"\n{details}\n"
-        self.curr_tests.remove(test.name)
+        self.curr_tests.remove(test_name)
         pr_info(msg)
 
     def on_matrix_start(self) -> None:
         if not self.display.tests:
             return
 
+        if self.concurrent_prmttns:
+            #  All the iterations and permutations are streamed together, so only an empty line
+            #  is printed before the first one
+            assert self.iter_res is not None
+            if self.iteration_index == 0 and self.mtrx_res is self.iter_res.mtrx_results[0]:
+                pr_info()
+            return
+
         pr_info()
         if self.mtrx_count == 1 and self.iterations == 1:
             return
@@ -220,6 +243,9 @@ class ConsolePrinter(LockableEventReporter):
     def on_run_end(self) -> None:
         assert self.run_res is not None
         self.live.update("")
+        if self.run_res.stop_reason:
+            pr_warn(f"\n{self.run_res.stop_reason} (cancellation took "
+                    f"{self.run_res.cancel_duration:.3f}s)")
         if not self.display.summary and not self.display.iter_summary:
             return
 
@@ -1,11 +1,16 @@
 from xeet import XeetException
 from .events import EventNotifier, EventReporter
 from .resource import ResourceModel, ResourcePool, Resource
+from .supervisor import ProcessSupervisor
 from xeet.common import in_windows, platform_path, json_value, cache, XeetVars, validate_token
 from dataclasses import dataclass, field
-from typing import Any
+from typing import Any, TYPE_CHECKING
 import os
 
+if TYPE_CHECKING:
+    from .result_cache import ResultCache
+    from .step import StepModel
+
 
 _SYS_VAR_PREFIX = "XEET_"
 
@@ -23,6 +28,7 @@ class BaseXeetSettings:
     file_path: str = ""
     debug: bool = False
     output_dir: str = ""
+    save_conf_cache: bool = False  # Save the parsed configuration for later invocations
 
     def __hash__(self) -> int:
         return hash((self.file_path, self.debug, self.output_dir))
@@ -58,11 +64,17 @@ class RuntimeInfo:
             system_var_name("PLATFORM"): os.name.lower(),
         })
         self.defs_dict = {}
+        #  Models of base steps, by their reference path, shared by the steps that inherit them
+        self.base_step_models: dict[str, "StepModel"] = {}
         self.resources: dict[str, ResourcePool] = {}
         self.debug_mode = settings.debug
         self.notifier = EventNotifier()
         self.iterations = 0
         self.iteration = 0
+        #  If set, exec steps processes are supervised by it instead of by their runner threads
+        self.supervisor: ProcessSupervisor | None = None
+        #  If set, passed tests results are reused for unchanged tests
+        self.result_cache: "ResultCache | None" = None
 
     def add_run_reporter(self, reporter: EventReporter) -> None:
         reporter.rti = self
@@ -70,6 +82,7 @@ class RuntimeInfo:
 
     def set_defs(self, defs_dict: dict) -> None:
         self.defs_dict = defs_dict
+        self.base_step_models = {}
 
     def add_resource_pool(self, name: str, resources: list[ResourceModel]) -> None:
         if not validate_token(name):
@@ -82,12 +95,14 @@ class RuntimeInfo:
         except KeyError:
             raise XeetException(f"Resource pool '{pool}' not found")
 
+    def iteration_output_dir(self, iteration: int) -> str:
+        if self.iterations > 1:
+            return f"{self.base_output_dir}/{iteration}"
+        return self.base_output_dir
+
     def set_iteration(self, iteration: int) -> None:
         self.iteration = iteration
-        if self.iterations > 1:
-            self.output_dir = f"{self.base_output_dir}/{iteration}"
-        elif iteration == 0:
-            self.output_dir = self.base_output_dir
+        self.output_dir = self.iteration_output_dir(iteration)
         self.xvars.set_vars({
             system_var_name("OUT_DIR"): self.output_dir,
         })
@@ -97,6 +112,21 @@ class RuntimeInfo:
         return json_value(self.defs_dict, path)
 
 
+#  A run scope holds the state that is specific to a single matrix permutation run. Tests
+#  that are created with a scope use its variables and output directory instead of the
+#  global ones, so several permutations can run side by side without changing the shared
+#  runtime info variables.
+class RunScope:
+    def __init__(self, rti: RuntimeInfo, iteration: int, mpi: int, prmttn: dict[str, Any],
+                 output_dir: str) -> None:
+        self.iteration = iteration
+        self.mpi = mpi
+        self.prmttn = prmttn
+        self.output_dir = output_dir
+        self.xvars = XeetVars({**prmttn, system_var_name("OUT_DIR"): output_dir},
+                              parent=rti.xvars)
+
+
 @dataclass
 class TestsCriteria:
     names: set[str] = field(default_factory=set)
@@ -2,8 +2,11 @@ from . import BaseXeetSettings
 from . import TestsCriteria
 from .test import Test, TestModel
 from .result import RunResult
-from .xeet_conf import XeetModel, xeet_conf
-from .tests_runner import XeetRunner, XeetRunSettings, is_empty_run_result as is_empty_run_result
+from .xeet_conf import XeetModel, TestHeader, xeet_conf
+from .worker import serve_workers as _serve_workers, parse_worker_address
+from .tests_runner import (XeetRunner, XeetRunSettings, SchedulePolicy as SchedulePolicy,
+                           ExecutorType as ExecutorType,
+                           is_empty_run_result as is_empty_run_result)
 from xeet import XeetException
 from enum import Enum
 
@@ -12,6 +15,10 @@ def fetch_tests_list(config_path: str, criteria: TestsCriteria) -> list[Test]:
     return xeet_conf(BaseXeetSettings(config_path)).get_tests(criteria)
 
 
+def fetch_test_headers(config_path: str, criteria: TestsCriteria) -> list[TestHeader]:
+    return xeet_conf(BaseXeetSettings(config_path)).get_test_headers(criteria)
+
+
 def fetch_groups_list(config_path: str) -> list[str]:
     config = xeet_conf(BaseXeetSettings(config_path))
     return list(config.all_groups())
@@ -45,3 +52,7 @@ def fetch_schema(schema_type: str) -> dict:
 
 def run_tests(run_settings: XeetRunSettings) -> RunResult:
     return XeetRunner(run_settings).run()
+
+
+def serve_workers(settings: BaseXeetSettings, address: str, authkey: bytes) -> None:
+    _serve_workers(settings, parse_worker_address(address), authkey)
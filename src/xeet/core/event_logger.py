@@ -20,9 +20,14 @@ class EventLogger(EventReporter):
     def _test_prefix(self, test: Test) -> str:
         #  Messages issued before the run starts will occur before run result and iteration result
         #  are set
+        name = test.name
+        if test.scope is not None and self.mtrx_count > 1:
+            name = f"{name}@m{test.scope.mpi}"
         if self.run_res is None or self.iter_res is None or self.run_res.iterations == 1:
-            return test.name
-        return f"{test.name}@i{self.iter_res.iter_n}"
+            return name
+        if test.scope is not None:
+            return f"{name}@i{test.scope.iteration}"
+        return f"{name}@i{self.iter_res.iter_n}"
 
     def __hash__(self):
         return hash(id(self))
@@ -137,6 +142,9 @@ class EventLogger(EventReporter):
     def on_step_message(self, step: Step, msg: str, *args, **kwargs) -> None:
         if kwargs.pop("dbg_pr", False):
             return
+        #  Tailed output lines are printed as they are, but logged as lines
+        if kwargs.pop("end", None) is not None:
+            msg = msg.rstrip("\n")
         prefix = self._step_prefix(step)
         log_general(f"{prefix}: {msg}", *args, **kwargs)
 
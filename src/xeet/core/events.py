@@ -18,6 +18,7 @@ class EventReporter:
     iter_res: "IterationResult | None" = None
     tests: list["Test"] = field(default_factory=list)
     threads: int = 1
+    concurrent_prmttns: bool = False
     mtrx: "Matrix" = None  # type: ignore
     mtrx_prmttn: "MatrixPermutation" = None  # type: ignore
     mtrx_res: "MtrxResult" = None  # type: ignore
@@ -129,12 +130,13 @@ class EventNotifier:
             r.on_init()
 
     #  Global events
-    def on_run_start(self, run_res: "RunResult", tests: list["Test"], mtrx: "Matrix", threads: int
-                     ) -> None:
+    def on_run_start(self, run_res: "RunResult", tests: list["Test"], mtrx: "Matrix", threads: int,
+                     concurrent_prmttns: bool = False) -> None:
         for r in self._reporters:
             r.run_res = run_res
             r.tests = tests
             r.threads = threads
+            r.concurrent_prmttns = concurrent_prmttns
             r.mtrx = mtrx
             r.on_run_start()
 
@@ -148,8 +150,12 @@ class EventNotifier:
             r.iter_res = iter_res
             r.on_iteration_start()
 
-    def on_iteration_end(self) -> None:
+    #  Like matrix end events, the iteration end events of concurrent runs are issued after
+    #  all the iterations have started, so the ending iteration is set again.
+    def on_iteration_end(self, iter_res: "IterationResult | None" = None) -> None:
         for r in self._reporters:
+            if iter_res is not None:
+                r.iter_res = iter_res
             r.on_iteration_end()
             r.iter_res = None
 
@@ -159,8 +165,18 @@ class EventNotifier:
             r.mtrx_prmttn = mtrx_prmttn
             r.on_matrix_start()
 
-    def on_matrix_end(self) -> None:
+    #  When permutations run concurrently, the matrix end events are issued after all the
+    #  permutations have started, so the iteration and permutation of the ending matrix are set
+    #  again.
+    def on_matrix_end(self, mtrx_prmttn: "MatrixPermutation | None" = None,
+                      mtrx_res: "MtrxResult | None" = None,
+                      iter_res: "IterationResult | None" = None) -> None:
         for r in self._reporters:
+            if iter_res is not None:
+                r.iter_res = iter_res
+            if mtrx_res is not None:
+                r.mtrx_res = mtrx_res
+                r.mtrx_prmttn = mtrx_prmttn  # type: ignore
             r.on_matrix_end()
             r.mtrx_prmttn = None  # type: ignore
             r.mtrx_res = None  # type: ignore
@@ -0,0 +1,68 @@
+from .result import RunResult, TestPrimaryStatus, TestSecondaryStatus
+from xeet.log import log_info, log_warn
+from xeet.common import atomic_write
+from threading import Lock
+import json
+import os
+
+
+_HISTORY_VERSION = 1
+#  Weight of the newest duration in the running average
+_DURATION_WEIGHT = 0.5
+
+
+#  Tests durations history. Durations are kept per test name and matrix permutation index,
+#  as a running average of the test runs durations. Only tests that actually ran (passed or
+#  failed, and not taken from the results cache) are recorded.
+class TestsHistory:
+    __test__ = False
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._durations: dict[str, dict[str, float]] = {}
+        self._lock = Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log_warn(f"Ignoring tests history file '{self.path}' - {e}")
+            return
+        if not isinstance(data, dict) or data.get("version") != _HISTORY_VERSION:
+            log_info(f"Ignoring tests history file '{self.path}' - unknown format")
+            return
+        durations = data.get("durations")
+        if isinstance(durations, dict):
+            self._durations = durations
+
+    def duration(self, name: str, mpi: int) -> float | None:
+        with self._lock:
+            return self._durations.get(name, {}).get(str(mpi))
+
+    def add(self, name: str, mpi: int, duration: float) -> None:
+        with self._lock:
+            test_durations = self._durations.setdefault(name, {})
+            prev = test_durations.get(str(mpi))
+            if prev is not None:
+                duration = _DURATION_WEIGHT * duration + (1 - _DURATION_WEIGHT) * prev
+            test_durations[str(mpi)] = round(duration, 3)
+
+    def add_run_result(self, run_res: RunResult) -> None:
+        for iter_res in run_res.iter_results:
+            for mtrx_res in iter_res.mtrx_results:
+                for name, test_res in mtrx_res.results.items():
+                    if test_res.status.primary not in (TestPrimaryStatus.Passed,
+                                                       TestPrimaryStatus.Failed) or \
+                            test_res.status.secondary == TestSecondaryStatus.Cached:
+                        continue
+                    self.add(name, mtrx_res.mpi, test_res.duration)
+
+    def save(self) -> None:
+        with self._lock:
+            data = {"version": _HISTORY_VERSION, "durations": self._durations}
+        atomic_write(self.path, json.dumps(data, indent=1, sort_keys=True),
+                     "tests history file")
@@ -24,6 +24,17 @@ class Matrix:
         for indices in self._permutation():
             yield {self.keys[i]: self.values[self.keys[i]][indices[i]] for i in range(self.n)}
 
+    #  The permutation at the given index of the permutations() order, without generating the
+    #  preceding ones
+    def permutation(self, index: int) -> MatrixPermutation:
+        if index < 0 or index >= self.prmttns_count:
+            raise IndexError(f"Matrix permutation index {index} out of range")
+        values = {}
+        for key in reversed(self.keys):
+            index, i = divmod(index, self.lengths[key])
+            values[key] = self.values[key][i]
+        return {key: values[key] for key in self.keys}
+
     def _permutation(self, indices: list[int] = list(), i: int = -1) -> Iterator[list[int]]:
         if i == -1:
             indices = [0] * self.n
@@ -0,0 +1,119 @@
+from threading import Lock
+from typing import Any, Callable
+import atexit
+import signal
+import os
+
+
+#  Processes of exec steps are started in sessions of their own, so every process leads a
+#  process group, with the process id as the group id. The process's descendants are in its
+#  group, unless they start sessions of their own, so processes are signaled with their entire
+#  group. Process groups aren't available on Windows, where only the process is signaled.
+PROCESS_GROUPS = hasattr(os, "killpg")
+
+
+def _signal(proc: Any, sig_name: str, fallback: Callable) -> None:
+    try:
+        if PROCESS_GROUPS:
+            os.killpg(proc.pid, getattr(signal, sig_name))
+        else:
+            fallback()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+#  The following take a subprocess.Popen or an asyncio process
+def terminate_process(proc: Any) -> None:
+    _signal(proc, "SIGTERM", proc.terminate)
+
+
+def kill_process(proc: Any) -> None:
+    _signal(proc, "SIGKILL", proc.kill)
+
+
+def interrupt_process(proc: Any) -> None:
+    _signal(proc, "SIGINT", lambda: proc.send_signal(signal.SIGINT))
+
+
+#  Whether any process is left in the group. Always False where there are no process groups.
+def process_group_alive(pgid: int) -> bool:
+    if not PROCESS_GROUPS:
+        return False
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+#  Ids of the processes in the group. Only available where there is a /proc file system.
+def process_group_pids(pgid: int) -> list[int]:
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return []
+    ret = []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        #  The command name may contain spaces and parentheses, the fields after it don't.
+        #  These are the state, the parent id and the group id.
+        fields = stat[stat.rfind(")") + 2:].split()
+        if len(fields) > 2 and fields[2] == str(pgid):
+            ret.append(int(entry))
+    return sorted(ret)
+
+
+#  Process groups that may still have running processes. These are killed when xeet exits, so
+#  processes left running by steps don't outlive the run. Processes aren't set to die with xeet,
+#  as that requires a subprocess preexec function, which isn't safe with runner threads and
+#  rules out the fast process spawning paths. If xeet is killed by a signal it doesn't handle,
+#  its processes are left running.
+_groups: set[int] = set()
+_groups_lock = Lock()
+
+
+def register_process_group(pgid: int) -> None:
+    with _groups_lock:
+        _groups.add(pgid)
+
+
+def release_process_group(pgid: int) -> None:
+    with _groups_lock:
+        _groups.discard(pgid)
+
+
+@atexit.register
+def _kill_process_groups() -> None:
+    if not PROCESS_GROUPS:
+        return
+    with _groups_lock:
+        groups = list(_groups)
+        _groups.clear()
+    for pgid in groups:
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+#  Exit handlers don't run when xeet is terminated by a signal. SIGTERM and SIGHUP kill the
+#  process groups, and then terminate xeet with the default action of the signal.
+def _exit_on_signal(signum: int, _: Any) -> None:
+    _kill_process_groups()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+#  Must be called from the main thread
+def handle_exit_signals() -> None:
+    for sig_name in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, sig_name):
+            signal.signal(getattr(signal, sig_name), _exit_on_signal)
@@ -4,6 +4,7 @@ from enum import Enum, auto
 from dataclasses import dataclass, field
 from timeit import default_timer as timer
 from functools import wraps
+from inspect import iscoroutinefunction
 from threading import Lock
 from typing import TYPE_CHECKING
 from functools import cached_property
@@ -34,6 +35,16 @@ class MeasuredResult:
 
 
 def time_result(func):
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = timer()
+            ret: MeasuredResult = await func(*args, **kwargs)
+            ret.start_time = start
+            ret.set_end_time()
+            return ret
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         start = timer()
@@ -71,6 +82,7 @@ class TestSecondaryStatus(Enum):
     Stopped = auto()
     UnexpectedPass = auto()
     ExpectedFail = auto()
+    Cached = auto()
 
 
 _STATUS_TEXT = {
@@ -90,6 +102,7 @@ _SUB_STATUS_TEXT = {
     TestSecondaryStatus.Stopped: "Stopped",
     TestSecondaryStatus.ExpectedFail: "Expected failure",
     TestSecondaryStatus.UnexpectedPass: "Unexpected pass",
+    TestSecondaryStatus.Cached: "Cached",
 }
 
 
@@ -233,6 +246,8 @@ class RunResult(MeasuredResult):
         self.iter_results = [IterationResult(i) for i in range(iterations)]
         self.mtrx_count: int = matrix_count
         self.criteria = criteria
+        self.stop_reason = ""  # Set if the run was stopped before all the tests were run
+        self.cancel_duration = 0.0
 
     @property
     def failed_tests(self) -> bool:
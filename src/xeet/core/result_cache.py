@@ -0,0 +1,118 @@
+from .result import TestResult, TestStatus, TestPrimaryStatus, TestSecondaryStatus
+from .test import Test
+from xeet import xeet_version
+from xeet.log import log_info, log_warn
+from xeet.common import atomic_write
+from threading import Lock
+import hashlib
+import json
+import glob
+import os
+
+
+_CACHE_VERSION = 1
+_CACHED_STTS = TestStatus(TestPrimaryStatus.Passed, TestSecondaryStatus.Cached)
+_MISSING_FILE = "<missing>"
+
+
+#  Passed tests results cache. A test's result is reused if the test's fingerprint didn't change
+#  since it last passed. The fingerprint covers the test's resolved model, its steps details
+#  after variables expansion and the content of its input files - files declared by the steps
+#  (e.g., expected output files) and by the test's 'inputs' glob patterns. Anything else the
+#  test depends on isn't covered, so the cache is only good for hermetic tests.
+#  Fingerprints are kept per test name and matrix permutation index, only the latest one.
+class ResultCache:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._results: dict[str, dict[str, str]] = {}
+        #  File hashes, by path, modification time and size, so files shared by many tests are
+        #  hashed once
+        self._file_hashes: dict[tuple[str, int, int], str] = {}
+        self._lock = Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log_warn(f"Ignoring results cache file '{self.path}' - {e}")
+            return
+        if not isinstance(data, dict) or data.get("version") != _CACHE_VERSION:
+            log_info(f"Ignoring results cache file '{self.path}' - unknown format")
+            return
+        results = data.get("results")
+        if isinstance(results, dict):
+            self._results = results
+
+    #  Return the test's fingerprint, or None if the test can't be fingerprinted. The test is set
+    #  up (its variables expanded) for this.
+    def fingerprint(self, test: Test) -> str | None:
+        if test.error or test.model.abstract:
+            return None
+        test.setup()
+        if test.error:
+            return None
+        h = hashlib.sha256()
+
+        def update(value) -> None:
+            h.update(json.dumps(value, sort_keys=True, default=str).encode())
+
+        update(xeet_version)
+        update(test.model.model_dump(mode="json"))
+        update(test.model.prmttn)
+        update(test.resource_vars)
+        input_files = []
+        for phase in (test.pre_phase, test.main_phase, test.post_phase):
+            for step in phase.steps:
+                update(step.details(full=True, printable=False, setup=True))
+                input_files.extend(step.input_files())
+        for pattern in test.model.inputs:
+            pattern = os.path.join(test.rti.root_dir, test.xvars.expand(pattern))
+            input_files.extend(sorted(glob.glob(pattern, recursive=True)))
+        for path in input_files:
+            update([path, self._file_hash(path)])
+        return h.hexdigest()
+
+    def _file_hash(self, path: str) -> str:
+        try:
+            st = os.stat(path)
+            key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+            with self._lock:
+                ret = self._file_hashes.get(key)
+            if ret is not None:
+                return ret
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                while chunk := f.read(1 << 20):
+                    h.update(chunk)
+        except OSError:
+            return _MISSING_FILE
+        ret = h.hexdigest()
+        with self._lock:
+            self._file_hashes[key] = ret
+        return ret
+
+    def lookup(self, test: Test, mpi: int, fingerprint: str) -> TestResult | None:
+        with self._lock:
+            if self._results.get(test.name, {}).get(str(mpi)) != fingerprint:
+                return None
+        return TestResult(test=test, status=_CACHED_STTS, status_reason="Unchanged since passed")
+
+    #  Record the test's result. Only passing results are kept, other results drop the test's
+    #  cached result.
+    def add(self, test_res: TestResult, mpi: int, fingerprint: str) -> None:
+        name = test_res.test.name
+        with self._lock:
+            if test_res.status.primary == TestPrimaryStatus.Passed:
+                self._results.setdefault(name, {})[str(mpi)] = fingerprint
+            elif name in self._results:
+                self._results[name].pop(str(mpi), None)
+
+    def save(self) -> None:
+        with self._lock:
+            data = {"version": _CACHE_VERSION, "results": self._results}
+        atomic_write(self.path, json.dumps(data, indent=1, sort_keys=True),
+                     "results cache file")
@@ -0,0 +1,81 @@
+from .result import RunResult, TestPrimaryStatus, TestSecondaryStatus
+from xeet.log import log_info, log_warn
+from xeet.common import atomic_write
+from dataclasses import dataclass, asdict
+import json
+import os
+
+
+_STORE_VERSION = 1
+
+
+@dataclass
+class StoredResult:
+    iteration: int
+    mpi: int
+    status: str  # TestPrimaryStatus name
+    secondary: str  # TestSecondaryStatus name
+    duration: float
+    reason: str
+
+    @property
+    def failed(self) -> bool:
+        if self.status == TestPrimaryStatus.Failed.name:
+            return True
+        #  Tests that weren't run because the run was stopped didn't fail
+        return self.status == TestPrimaryStatus.NotRun.name and \
+            self.secondary != TestSecondaryStatus.Stopped.name
+
+
+#  Persistent record of the latest results of every test, per iteration and matrix permutation.
+#  Every run replaces the records of the tests it ran, records of other tests are kept, so runs
+#  of a subset of the tests (e.g., only the failed ones) don't lose the other tests' results.
+class ResultsStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.results: dict[str, list[StoredResult]] = {}
+        self.found = False
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get("version") != _STORE_VERSION:
+                log_info(f"Ignoring results file '{self.path}' - unknown format")
+                return
+            self.results = {name: [StoredResult(**r) for r in records]
+                            for name, records in data.get("results", {}).items()}
+        except (OSError, ValueError, TypeError) as e:
+            log_warn(f"Ignoring results file '{self.path}' - {e}")
+            return
+        self.found = True
+
+    #  (test name, matrix permutation index) units that failed in any iteration
+    def failed_units(self) -> set[tuple[str, int]]:
+        return {(name, r.mpi) for name, records in self.results.items() for r in records
+                if r.failed}
+
+    def add_run_result(self, run_res: RunResult) -> None:
+        run_records: dict[str, list[StoredResult]] = {}
+        for iter_res in run_res.iter_results:
+            for mtrx_res in iter_res.mtrx_results:
+                for name, test_res in mtrx_res.results.items():
+                    run_records.setdefault(name, []).append(StoredResult(
+                        iteration=iter_res.iter_n, mpi=mtrx_res.mpi,
+                        status=test_res.status.primary.name,
+                        secondary=test_res.status.secondary.name,
+                        duration=round(test_res.duration, 3),
+                        reason=test_res.status_reason))
+        self.results.update(run_records)
+
+    def save(self) -> None:
+        data = {
+            "version": _STORE_VERSION,
+            "results": {name: [asdict(r) for r in records]
+                        for name, records in self.results.items()},
+        }
+        atomic_write(self.path, json.dumps(data, separators=(",", ":"), sort_keys=True),
+                     "results file")
@@ -0,0 +1,52 @@
+from .history import TestsHistory
+from xeet.common import XeetException
+import heapq
+import zlib
+
+
+#  A shard unit is a test name and a matrix permutation index
+ShardUnit = tuple[str, int]
+
+
+def _unit_hash(unit: ShardUnit) -> int:
+    return zlib.crc32(f"{unit[0]}:{unit[1]}".encode())
+
+
+#  Split the units into 'count' shards and return the units of shard 'index' (1 based). The
+#  split only depends on the units and on the history, so every node that runs with the same
+#  configuration, criteria and history file gets a part of the same split.
+#  Units with recorded durations are balanced by the longest processing time first method -
+#  the longest unit goes to the least loaded shard. Units with no history are placed by a
+#  stable hash of their name, so adding or removing a test doesn't move the other ones, and
+#  are counted with the average recorded duration.
+def shard_units(units: list[ShardUnit], index: int, count: int, history: TestsHistory
+                ) -> set[ShardUnit]:
+    if count < 1 or index < 1 or index > count:
+        raise XeetException(f"Invalid shard {index}/{count}")
+    if count == 1:
+        return set(units)
+
+    known: list[tuple[float, ShardUnit]] = []
+    unknown: list[ShardUnit] = []
+    for unit in units:
+        duration = history.duration(*unit)
+        if duration is None:
+            unknown.append(unit)
+        else:
+            known.append((duration, unit))
+    avg_duration = sum(d for d, _ in known) / len(known) if known else 1.0
+
+    loads = [0.0] * count
+    shards: list[set[ShardUnit]] = [set() for _ in range(count)]
+    for unit in unknown:
+        shard_i = _unit_hash(unit) % count
+        shards[shard_i].add(unit)
+        loads[shard_i] += avg_duration
+
+    heap = [(load, i) for i, load in enumerate(loads)]
+    heapq.heapify(heap)
+    for duration, unit in sorted(known, key=lambda k: (-k[0], k[1])):
+        load, shard_i = heapq.heappop(heap)
+        shards[shard_i].add(unit)
+        heapq.heappush(heap, (load + duration, shard_i))
+    return shards[index - 1]
@@ -5,6 +5,7 @@ from xeet.common import XeetVars, XeetException, KeysBaseModel, yes_no_str, plat
 from pydantic import ConfigDict, Field
 from typing import Any, TYPE_CHECKING
 from threading import Condition
+import asyncio
 import os
 
 if TYPE_CHECKING:
@@ -89,6 +90,20 @@ class Step:
         res.completed = self._run(res)
         return res
 
+    #  With the async executor, steps run on the process supervisor's loop. Otherwise, this
+    #  is the same as run(), and never suspends.
+    async def run_async(self) -> StepResult:
+        if self.rti.supervisor is None:
+            return self.run()
+        return await self._run_on_loop()
+
+    @time_result
+    async def _run_on_loop(self) -> StepResult:
+        res = self.result_class()(step=self)
+        os.makedirs(self.output_dir, exist_ok=True)
+        res.completed = await self._run_async(res)
+        return res
+
     def print_name(self) -> str:
         if self.model.name:
             return f"{self.model.step_type} ('{self.model.name}')"
@@ -104,6 +119,11 @@ class Step:
     def _run(self, _: StepResult) -> bool:
         raise NotImplementedError
 
+    #  Steps that don't wait on the loop themselves run in the loop's default executor, a thread
+    #  pool whose size doesn't depend on the number of jobs, so they don't block the loop.
+    async def _run_async(self, res: StepResult) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(None, self._run, res)
+
     def stop(self):
         with self.step_run_cond:
             self.stop_requested = True
@@ -112,6 +132,10 @@ class Step:
     def _stop(self) -> None:
         ...
 
+    #  Files the step reads, that affect its result. Valid after setup()
+    def input_files(self) -> list[str]:
+        return []
+
     _DFLT_KEYS = ["name", "step_type", "base"]
 
     #  The base list for details to print is the entire model dump. After which
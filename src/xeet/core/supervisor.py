@@ -0,0 +1,200 @@
+from .process_group import terminate_process, kill_process, process_group_alive
+from xeet.common import XeetException
+from threading import Thread
+from typing import Callable, Coroutine, IO
+from concurrent.futures import Future
+import asyncio
+import codecs
+import subprocess
+import os
+
+
+_PIDFD = hasattr(os, "pidfd_open")
+
+
+#  A process started by the supervisor. Returned by spawn(), and used to wait for the process
+#  or to terminate it.
+class SupervisedProcess:
+    def __init__(self, process: subprocess.Popen, readers: list[asyncio.Task]) -> None:
+        self.process = process
+        self.readers = readers
+        self.pid = process.pid
+        #  Watches the process until it ends, shared by all its waiters
+        self.exit_watch: asyncio.Task | None = None
+        #  A descriptor that becomes readable once the process ends, where available
+        self.pidfd: int | None = None
+        if _PIDFD:
+            try:
+                self.pidfd = os.pidfd_open(self.pid)
+            except OSError:
+                pass
+
+
+#  Supervises all the processes of a run from a single asyncio event loop, running in its own
+#  thread. The async executor runs the tests themselves on the loop, so waiting for processes,
+#  timeouts, termination and output tailing don't hold a thread per process. Processes are
+#  waited for with pidfds watched by the loop, where available, so no child watcher (and no
+#  global event loop policy) is involved. Elsewhere, running processes are polled.
+class ProcessSupervisor:
+    def __init__(self) -> None:
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.thread: Thread | None = None
+
+    def start(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, name="xeet-supervisor", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.loop is None or self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+        self.loop = None
+        self.thread = None
+
+    #  Run a coroutine on the loop, from another thread
+    def submit(self, coro: Coroutine) -> Future:
+        assert self.loop is not None
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    #  The following coroutines run on the loop.
+
+    #  Start a process. The arguments are the same as subprocess.Popen's. If a tail function is
+    #  given, the output is read by the loop, written to the output files and passed, line by
+    #  line, to the tail function. Separate stderr output is passed to err_tail, if given.
+    async def spawn(self, args: list[str] | str, shell: bool, stdout: IO, stderr: IO,
+                    tail: Callable | None = None, err_tail: Callable | None = None,
+                    **kwargs) -> SupervisedProcess:
+        if tail is None:
+            out, err = stdout, stderr
+        else:
+            out = subprocess.PIPE
+            err = subprocess.STDOUT if stderr is stdout else subprocess.PIPE
+        try:
+            process = subprocess.Popen(args, shell=shell, stdout=out, stderr=err, **kwargs)
+        except ValueError as e:
+            raise XeetException(f"Error starting process - {e}")
+        readers = []
+        if tail is not None:
+            assert process.stdout is not None
+            readers.append(asyncio.ensure_future(
+                self._pump_pipe(process.stdout, stdout, tail)))
+            if process.stderr is not None:
+                readers.append(asyncio.ensure_future(
+                    self._pump_pipe(process.stderr, stderr, err_tail or tail)))
+        return SupervisedProcess(process, readers)
+
+    #  Wait for the process to end and return its return code. If the timeout expires, the
+    #  process is killed and subprocess.TimeoutExpired is raised. The process's output might
+    #  still be read after it ends, see wait_output().
+    async def wait(self, proc: SupervisedProcess, timeout: float | None) -> int:
+        try:
+            await asyncio.wait_for(self._exited(proc), timeout)
+        except asyncio.TimeoutError:
+            kill_process(proc.process)
+            await self._exited(proc)
+            raise subprocess.TimeoutExpired(str(proc.pid), timeout)  # type: ignore
+        return proc.process.returncode
+
+    #  Wait for the ended process's output to be read. The output pipes might be kept open by
+    #  processes left running by the process, so reading is stopped after the timeout. Return
+    #  False if it was stopped.
+    async def wait_output(self, proc: SupervisedProcess, timeout: float) -> bool:
+        if not proc.readers:
+            return True
+        _, pending = await asyncio.wait(proc.readers, timeout=timeout)
+        for reader in pending:
+            reader.cancel()
+        return not pending
+
+    _GROUP_POLL_INTERVAL = 0.1
+
+    #  Terminate the process and kill it if it, or other processes in its group, are still
+    #  running after grace_period seconds.
+    async def terminate_group(self, proc: SupervisedProcess, grace_period: float) -> None:
+        if proc.process.returncode is not None and not process_group_alive(proc.pid):
+            return
+        assert self.loop is not None
+        deadline = self.loop.time() + grace_period
+        terminate_process(proc.process)
+        try:
+            await asyncio.wait_for(self._exited(proc), grace_period)
+        except asyncio.TimeoutError:
+            kill_process(proc.process)
+            return
+        while process_group_alive(proc.pid) and self.loop.time() < deadline:
+            await asyncio.sleep(self._GROUP_POLL_INTERVAL)
+        kill_process(proc.process)
+
+    #  Terminate the process, as terminate_group() does, from any thread. Doesn't wait for the
+    #  process to end.
+    def terminate(self, proc: SupervisedProcess, grace_period: float) -> None:
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.terminate_group(proc, grace_period), self.loop)
+
+    _EXIT_POLL_INTERVAL = 0.05
+
+    #  Wait for the process to end. Waiters may be cancelled (e.g., by a timeout), the watch
+    #  itself isn't.
+    async def _exited(self, proc: SupervisedProcess) -> None:
+        if proc.exit_watch is None:
+            proc.exit_watch = asyncio.ensure_future(self._watch_exit(proc))
+        await asyncio.shield(proc.exit_watch)
+
+    async def _watch_exit(self, proc: SupervisedProcess) -> None:
+        assert self.loop is not None
+        process = proc.process
+        if proc.pidfd is not None and process.poll() is None:
+            exited = self.loop.create_future()
+            self.loop.add_reader(proc.pidfd, lambda: exited.done() or exited.set_result(None))
+            try:
+                await exited
+            finally:
+                self.loop.remove_reader(proc.pidfd)
+        while process.poll() is None:
+            await asyncio.sleep(self._EXIT_POLL_INTERVAL)
+        if proc.pidfd is not None:
+            os.close(proc.pidfd)
+            proc.pidfd = None
+
+    async def _pump_pipe(self, pipe: IO[bytes], f: IO, tail: Callable) -> None:
+        assert self.loop is not None
+        reader = asyncio.StreamReader(limit=_READ_SIZE)
+        transport, _ = await self.loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        try:
+            await _pump(reader, f, tail)
+        finally:
+            transport.close()
+
+
+_READ_SIZE = 1 << 16
+
+
+#  Output is read in chunks, not with readline(), which fails on lines longer than the stream's
+#  limit and leaves the pipe unread, so the process is never done. Complete lines are passed
+#  to the tail function one by one, and partial lines once they are long enough.
+async def _pump(stream: asyncio.StreamReader, f: IO, tail: Callable) -> None:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        data = await stream.read(_READ_SIZE)
+        text = decoder.decode(data, final=not data)
+        if text:
+            f.write(text)
+            f.flush()
+            pending += text
+        start = 0
+        while (end := pending.find("\n", start)) != -1:
+            tail(pending[start:end + 1], end="")
+            start = end + 1
+        pending = pending[start:]
+        if pending and (not data or len(pending) >= _READ_SIZE):
+            tail(pending, end="")
+            pending = ""
+        if not data:
+            return
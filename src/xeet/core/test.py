@@ -1,15 +1,17 @@
 from .resource import Resource
-from .import RuntimeInfo, system_var_name, is_system_var_name
+from .import RuntimeInfo, RunScope, system_var_name, is_system_var_name
 from .result import (TestResult, TestPrimaryStatus, TestSecondaryStatus, PhaseResult, TestStatus,
                      time_result)
 from .step import Step, StepModel, XeetStepInitException
-from xeet.common import XeetException, XeetVars, pydantic_errmsg, KeysBaseModel, NonEmptyStr
+from xeet.common import (XeetException, XeetVars, pydantic_errmsg, KeysBaseModel, NonEmptyStr,
+                         run_sync)
 from xeet.steps import get_xstep_class
 from xeet.core.matrix import Matrix, MatrixModel
-from typing import Any, Callable
+from typing import Any, Awaitable, Callable, Iterator
 from pydantic import Field, ValidationError, ConfigDict, AliasChoices, model_validator
 from enum import Enum
 from dataclasses import dataclass, field
+from threading import RLock
 import logging
 import os
 
@@ -58,6 +60,9 @@ class TestModel(KeysBaseModel):
     matrix: MatrixModel = Field(default_factory=dict)
 
     platforms: list[str] = Field(default_factory=list)
+    #  Input files glob patterns, relative to the configuration file directory. Used by the
+    #  results cache
+    inputs: list[str] = Field(default_factory=list)
 
     #  Resource requirements
     resources: list[_ResouceRequiremnt] = Field(default_factory=list)
@@ -131,19 +136,15 @@ class TestModel(KeysBaseModel):
         if not self.has_key("resources") and other.has_key("resources"):
             self.resources = other.resources
 
-    def matrix_permutations(self) -> list["TestModel"]:
-        models = []
+    #  Permutations models are generated one at a time, as copies of this (already validated)
+    #  model
+    def matrix_permutations(self) -> Iterator["TestModel"]:
         if not self.matrix:
-            return models
+            return
         matrix = Matrix(self.matrix)
         for i, prmttn in enumerate(matrix.permutations()):
-            desc = self.model_dump()
-            desc["name"] = f"{self.name}:{i}"
-            desc["matrix"] = dict()
-            test = TestModel(**desc)
-            test.prmttn = prmttn
-            models.append(test)
-        return models
+            yield self.model_copy(deep=True, update={"name": f"{self.name}:{i}", "matrix": {},
+                                                     "prmttn": prmttn})
 
 
 @dataclass
@@ -164,41 +165,97 @@ class Phase:
 class Test:
     __test__ = False
 
-    def __init__(self, model: TestModel, rti: RuntimeInfo) -> None:
+    def __init__(self, model: TestModel, rti: RuntimeInfo, scope: RunScope | None = None) -> None:
         self.model = model
         self.rti = rti
+        self.scope = scope
         self.name: str = model.name
-        self.pre_phase = Phase(name="pre", test=self, short_name="pre", stop_on_err=True)
-        self.main_phase = Phase(name="main", test=self, short_name="stp", stop_on_err=True)
-        self.post_phase = Phase(name="post", test=self, short_name="pst", stop_on_err=False)
+        self._pre_phase = Phase(name="pre", test=self, short_name="pre", stop_on_err=True)
+        self._main_phase = Phase(name="main", test=self, short_name="stp", stop_on_err=True)
+        self._post_phase = Phase(name="post", test=self, short_name="pst", stop_on_err=False)
         self.obtained_resources: list[Resource] = []
-
-        if model.error:
-            self.error = model.error
+        #  Variables assigned with obtained resources values. Resources are obtained under the
+        #  tests pool lock, so the variables are set only when the test is set up, as setting
+        #  them materializes the test.
+        self.resource_vars: dict[str, Any] = {}
+        self._resource_vars_set = False
+        #  The resource pool that failed the last resources obtaining attempt
+        self.blocking_pool = _EMPTY_STR
+        self.base = self.model.base
+        self.output_dir = _EMPTY_STR
+        self.stop_requested = False
+        self.prmttn: dict[str, Any] = dict()
+        self._error = model.error
+        self._xvars: XeetVars | None = None
+        self._materialized = False
+        self._materializing = False
+        self._materialize_lock = RLock()
+
+    #  Steps and variables are built only when first needed - when the test is about to run, or
+    #  its details or errors are asked for. Tests that are only selected or listed stay cheap.
+    def materialize(self) -> None:
+        if self._materialized:
             return
+        with self._materialize_lock:
+            #  Steps initialization notifies reporters, which may access the test again
+            if self._materialized or self._materializing:
+                return
+            self._materializing = True
+            try:
+                self._materialize()
+            finally:
+                self._materialized = True
 
-        self.base = self.model.base
-        self.error = _EMPTY_STR
-        self._init_phase_steps(self.pre_phase, self.model.pre_run)
-        if self.error:
+    def _materialize(self) -> None:
+        if self._error:
             return
-        self._init_phase_steps(self.main_phase, self.model.run)
-        if self.error:
+        self._init_phase_steps(self._pre_phase, self.model.pre_run)
+        if self._error:
             return
-        self._init_phase_steps(self.post_phase, self.model.post_run)
-        if self.error:
+        self._init_phase_steps(self._main_phase, self.model.run)
+        if self._error:
+            return
+        self._init_phase_steps(self._post_phase, self.model.post_run)
+        if self._error:
             return
 
         try:
-            variables = {**model.var_map, **model.prmttn}
-            self.xvars = XeetVars(variables, rti.xvars)
+            variables = {**self.model.var_map, **self.model.prmttn}
+            parent_xvars = self.scope.xvars if self.scope else self.rti.xvars
+            self._xvars = XeetVars(variables, parent_xvars)
         except XeetException as e:
-            self.error = str(e)
+            self._error = str(e)
             return
-        self.xvars.set_vars({system_var_name("TEST_NAME"): self.name})
-        self.output_dir = _EMPTY_STR
-        self.stop_requested = False
-        self.prmttn: dict[str, Any] = dict()
+        self._xvars.set_vars({system_var_name("TEST_NAME"): self.name})
+
+    @property
+    def error(self) -> str:
+        self.materialize()
+        return self._error
+
+    @error.setter
+    def error(self, value: str) -> None:
+        self._error = value
+
+    @property
+    def pre_phase(self) -> Phase:
+        self.materialize()
+        return self._pre_phase
+
+    @property
+    def main_phase(self) -> Phase:
+        self.materialize()
+        return self._main_phase
+
+    @property
+    def post_phase(self) -> Phase:
+        self.materialize()
+        return self._post_phase
+
+    @property
+    def xvars(self) -> XeetVars:
+        self.materialize()
+        return self._xvars  # type: ignore
 
     def _init_phase_steps(self, phase: Phase, steps: list[dict]) -> None:
         for index, step_desc in enumerate(steps):
@@ -211,8 +268,8 @@ class Test:
                 step = step_class(model=step_model, test=self, phase=phase, step_index=index)
                 phase.steps.append(step)
             except XeetStepInitException as e:
-                self.error = f"error initializing {phase.name} step {index}: {e}"
-                self.warn(self.error)
+                self._error = f"error initializing {phase.name} step {index}: {e}"
+                self.warn(self._error)
 
     @property
     def debug_mode(self) -> bool:
@@ -220,9 +277,16 @@ class Test:
 
     def setup(self) -> None:
         self.notify("setting up test", dbg_pr=False)
-        self.output_dir = f"{self.rti.output_dir}/{self.name}"
+        base_output_dir = self.scope.output_dir if self.scope else self.rti.output_dir
+        self.output_dir = f"{base_output_dir}/{self.name}"
 
         self.xvars.set_vars({system_var_name("TEST_OUT_DIR"): self.output_dir})
+        try:
+            self._set_resource_vars()
+        except XeetException as e:
+            self.error = f"Error obtaining resources - {e}"
+            self.notify(self.error)
+            return
         step_xvars = XeetVars(parent=self.xvars)
 
         try:
@@ -234,12 +298,35 @@ class Test:
             self.error = str(e)
             self.notify(f"error setting up test - {e}", dbg_pr=True)
 
+    def _set_resource_vars(self) -> None:
+        if self._resource_vars_set or not self.resource_vars:
+            return
+        for name in self.resource_vars:
+            if self.xvars.has_var(name):
+                raise XeetException(f"Variable '{name}' already exists."
+                                    " Can't assign resource to it")
+        self.xvars.set_vars(self.resource_vars)
+        self._resource_vars_set = True
+
     def release_resources(self) -> None:
         for r in self.obtained_resources:
             r.release()
         self.obtained_resources.clear()
+        if self._resource_vars_set:
+            self.xvars.pop_vars(self.resource_vars.keys())
+            self._resource_vars_set = False
+        self.resource_vars.clear()
+
+    #  Number of resources the test requires from the given pool
+    def resource_demand(self, pool: str) -> int:
+        ret = 0
+        for req in self.model.resources:
+            if req.pool.root == pool:
+                ret += len(req.names) if req.names else req.count
+        return ret
 
     def obtain_resources(self) -> bool:
+        self.blocking_pool = _EMPTY_STR
         try:
             for req in self.model.resources:
                 self.notify(f"obtaining resource '{req.pool.root}'")
@@ -251,12 +338,13 @@ class Test:
 
                 if not obtained:
                     self.notify(f"resource '{req.pool.root}' not available")
+                    self.blocking_pool = req.pool.root
                     self.release_resources()
                     return False
 
                 self.obtained_resources.extend(obtained)
                 if req.as_var:
-                    if self.xvars.has_var(req.as_var):
+                    if req.as_var in self.resource_vars:
                         raise XeetException(f"Variable '{req.as_var}' already exists."
                                             " Can't assign resource to it")
                     if req.names:
@@ -266,7 +354,7 @@ class Test:
                             var_value = obtained[0].value
                         else:
                             var_value = [r.value for r in obtained]
-                    self.xvars.set_vars({req.as_var: var_value})
+                    self.resource_vars[req.as_var] = var_value
         except XeetException as e:
             self.error = f"Error obtaining resources - {e}"
             self.notify(self.error)
@@ -282,14 +370,21 @@ class Test:
         except OSError as e:
             raise XeetException(f"Error creating output directory - {e.strerror}")
 
-    _PhaseFunc = Callable[[TestResult], PhaseResult]
+    _PhaseFunc = Callable[[TestResult], Awaitable[PhaseResult]]
+
+    #  'setup' is False if the test was just set up by the caller, e.g., to fingerprint it
+    def run(self, setup: bool = True) -> TestResult:
+        return run_sync(self.run_async(setup))
 
+    #  With the async executor, tests run on the process supervisor's loop, and suspend while
+    #  their steps wait for processes. Otherwise, this never suspends, see run().
     @time_result
-    def run(self) -> TestResult:
+    async def run_async(self, setup: bool = True) -> TestResult:
         if self.model.abstract:
             raise XeetException("Can't run abstract tasks")
 
-        self.setup()
+        if setup:
+            self.setup()
         res = TestResult(test=self)
         if self.error:
             res.status = TestStatus(TestPrimaryStatus.NotRun, TestSecondaryStatus.InitErr)
@@ -315,13 +410,14 @@ class Test:
         self.notify("starting run", dbg_pr=False)
         self._mkdir_output_dir()
 
-        self._exec_phase(self.pre_phase, res, res.pre_run_res, self._pre_phase_exec, True)
-        self._exec_phase(self.main_phase, res, res.main_res, self._main_phase_exec, True)
-        self._exec_phase(self.post_phase, res, res.post_run_res, self._post_phase_exec, False)
+        await self._exec_phase(self.pre_phase, res, res.pre_run_res, self._pre_phase_exec, True)
+        await self._exec_phase(self.main_phase, res, res.main_res, self._main_phase_exec, True)
+        await self._exec_phase(self.post_phase, res, res.post_run_res, self._post_phase_exec,
+                               False)
         return res
 
-    def _exec_phase(self, phase: Phase, test_res: TestResult, phase_res: PhaseResult,
-                    phase_func: _PhaseFunc, skip_on_err: bool) -> PhaseResult:
+    async def _exec_phase(self, phase: Phase, test_res: TestResult, phase_res: PhaseResult,
+                          phase_func: _PhaseFunc, skip_on_err: bool) -> PhaseResult:
         if test_res.status.primary != TestPrimaryStatus.Undefined and skip_on_err:
             self.notify(f"skipping {phase.name} phase, test status={test_res.status}",
                         dbg_pr=False)
@@ -330,15 +426,15 @@ class Test:
             self.notify(f"skipping {phase.name} phase; no steps", dbg_pr=False)
             return phase_res
         self.rti.notifier.on_phase_start(phase)
-        phase_func(test_res)
+        await phase_func(test_res)
         self.rti.notifier.on_phase_end(phase_res)
         return phase_res
 
     @time_result
-    def _pre_phase_exec(self, res: TestResult) -> PhaseResult:
+    async def _pre_phase_exec(self, res: TestResult) -> PhaseResult:
         if not self.pre_phase.steps:
             return res.pre_run_res
-        self._run_phase(self.pre_phase, res.pre_run_res)
+        await self._run_phase(self.pre_phase, res.pre_run_res)
         if not res.pre_run_res.completed or res.pre_run_res.failed:
             res.status.primary = TestPrimaryStatus.NotRun
             if self.stop_requested:
@@ -349,10 +445,10 @@ class Test:
         return res.pre_run_res
 
     @time_result
-    def _main_phase_exec(self, res: TestResult) -> PhaseResult:
+    async def _main_phase_exec(self, res: TestResult) -> PhaseResult:
         if res.status.primary != TestPrimaryStatus.Undefined:
             return res.main_res
-        self._run_phase(self.main_phase, res.main_res)
+        await self._run_phase(self.main_phase, res.main_res)
         if not res.main_res.completed:
             res.status.primary = TestPrimaryStatus.NotRun
             if self.stop_requested:
@@ -377,10 +473,10 @@ class Test:
         return res.main_res
 
     @time_result
-    def _post_phase_exec(self, res: TestResult) -> PhaseResult:
+    async def _post_phase_exec(self, res: TestResult) -> PhaseResult:
         if not self.post_phase.steps:
             return res.post_run_res
-        self._run_phase(self.post_phase, res.post_run_res)
+        await self._run_phase(self.post_phase, res.post_run_res)
 
         if res.post_run_res.completed and not res.post_run_res.failed:
             return res.post_run_res
@@ -391,14 +487,14 @@ class Test:
             res.post_run_status = TestPrimaryStatus.Failed
         return res.post_run_res
 
-    def _run_phase(self, phase: Phase, res: PhaseResult) -> None:
+    async def _run_phase(self, phase: Phase, res: PhaseResult) -> None:
         if not phase.steps:
             return
         notifier = self.rti.notifier
 
         for step in phase.steps:
             notifier.on_step_start(step)
-            step_res = step.run()
+            step_res = await step.run_async()
             notifier.on_step_end(step_res)
             res.append_step_result(step_res)
             if phase.stop_on_err and (step_res.failed or not step_res.completed):
@@ -406,9 +502,9 @@ class Test:
 
     def stop(self) -> None:
         self.stop_requested = True
-        self.pre_phase.stop()
-        self.main_phase.stop()
-        self.post_phase.stop()
+        self._pre_phase.stop()
+        self._main_phase.stop()
+        self._post_phase.stop()
 
     def notify(self, *args, **kwargs) -> None:
         self.rti.notifier.on_test_message(self, *args, **kwargs)
@@ -418,6 +514,22 @@ class Test:
 
     _DFLT_STEP_TYPE_PATH = "settings.xeet.default_step_type"
 
+    #  Base steps models are built once per configuration, and shared by the steps inheriting
+    #  them. Inheriting doesn't modify the base model.
+    def _base_step_model(self, base: str, included: set[str]) -> StepModel:
+        ret = self.rti.base_step_models.get(base)
+        if ret is not None:
+            return ret
+        #  TODO: add refernce by name in addition to path
+        base_desc, found = self.rti.config_ref(base)
+        if not found:
+            raise XeetStepInitException(f"Base step '{base}' not found")
+        if not isinstance(base_desc, dict):
+            raise XeetStepInitException(f"Invalid base step '{base}'")
+        ret = self._gen_step_model(base_desc, included | {base})
+        self.rti.base_step_models[base] = ret
+        return ret
+
     def _gen_step_model(self, desc: dict, included: set[str] | None = None) -> StepModel:
         if included is None:
             included = set()
@@ -428,13 +540,7 @@ class Test:
         base_step_model = None
         base_type = None
         if base:
-            #  TODO: add refernce by name in addition to path
-            base_desc, found = self.rti.config_ref(base)
-            if not found:
-                raise XeetStepInitException(f"Base step '{base}' not found")
-            if not isinstance(base_desc, dict):
-                raise XeetStepInitException(f"Invalid base step '{base}'")
-            base_step_model = self._gen_step_model(base_desc, included)
+            base_step_model = self._base_step_model(base, included)
             base_type = base_step_model.step_type
 
         model_type = desc.get("type")
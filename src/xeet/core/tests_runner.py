@@ -1,20 +1,46 @@
 from dataclasses import dataclass, field
-from . import RuntimeInfo, BaseXeetSettings, TestsCriteria
+from . import RuntimeInfo, RunScope, BaseXeetSettings, TestsCriteria
+from .supervisor import ProcessSupervisor
+from .process_group import handle_exit_signals
 from .result import (IterationResult, TestResult, MtrxResult, TestPrimaryStatus,
                      TestSecondaryStatus, RunResult, TestStatus, time_result)
 from .xeet_conf import xeet_conf
 from .events import EventReporter, EventNotifier
 from .test import Test
-from .matrix import Matrix
+from .matrix import Matrix, MatrixPermutation
+from .history import TestsHistory
+from .result_cache import ResultCache
+from .results_store import ResultsStore
+from .sharding import shard_units, ShardUnit
+from .resource import ResourcePool
+from .worker import ProcessWorker, RemoteWorker, parse_worker_address, WorkerHandle
 from xeet import XeetException
 from xeet.log import log_info
-from threading import Thread, Event, Condition
+from xeet.common import run_sync
+from threading import Thread, Event, Condition, Lock, Semaphore
+from timeit import default_timer as timer
 from signal import signal, SIGINT
 from typing import Callable
+from enum import Enum
+import asyncio
 import random
+import heapq
 
 
 _INIT_ERR_STTS = TestStatus(TestPrimaryStatus.NotRun, TestSecondaryStatus.InitErr)
+_STOPPED_STTS = TestStatus(TestPrimaryStatus.NotRun, TestSecondaryStatus.Stopped)
+
+
+class SchedulePolicy(str, Enum):
+    Config = "config"
+    Random = "random"
+    LongestFirst = "longest-first"
+
+
+class ExecutorType(str, Enum):
+    Thread = "thread"
+    Process = "process"
+    Async = "async"  # Tests run as tasks of a single asyncio loop, which supervises processes
 
 
 @dataclass
@@ -23,7 +49,21 @@ class XeetRunSettings(BaseXeetSettings):
     reporters: list[EventReporter] = field(default_factory=list)
     iterations: int = 1
     jobs: int = 1
-    randomize: bool = False
+    randomize: bool = False  # Same as schedule=SchedulePolicy.Random
+    schedule: str = SchedulePolicy.Config
+    history_file: str = ""
+    concurrent_prmttns: bool = False
+    executor: str = ExecutorType.Thread
+    fail_fast: int = 0  # Stop the run after this many failed tests, 0 means never
+    shard: tuple[int, int] = (1, 1)  # Run only shard K (1 based) of N
+    workers: list[str] = field(default_factory=list)  # Remote workers, as HOST:PORT
+    workers_authkey: bytes = b""
+    use_cache: bool = False  # Reuse passed results of unchanged tests
+    cache_file: str = ""
+    results_file: str = ""
+    last_failed: bool = False  # Run only the tests that failed in the last run
+    failed_first: bool = False  # Run the tests that failed in the last run first
+    save_conf_cache: bool = True
 
     #  The hash is only used for the xeet_conf cache key, so do the same thing as
     #  the parent class
@@ -31,100 +71,202 @@ class XeetRunSettings(BaseXeetSettings):
         return hash((self.file_path, self.debug, self.output_dir))
 
 
+@dataclass
+class _WorkItem:
+    test: Test
+    mtrx_res: MtrxResult
+    expected_duration: float = float("inf")
+    first: bool = False  # Dispatched before other items, regardless of the schedule policy
+
+
+#  Priority, sequence number and work item. The sequence number is unique, so work items are
+#  never compared.
+_QueueEntry = tuple[float, int, _WorkItem]
+
+
+#  The pool is created once per run and lives across all the iterations and permutations.
+#  Work items are streamed into it by the run loop with add(), and the runner threads pull
+#  them with next_item() until the pool is closed and drained. The number of queued items
+#  is bounded, so a long run doesn't instantiate all of its work items up front.
+#  The order of the queued items is set by the schedule policy. With the longest-first policy,
+#  items are ordered by their expected duration, taken from the tests history. Tests with no
+#  history are considered the longest, and keep their configuration order.
+#
+#  Queued items are kept in a ready heap, ordered by priority and queueing order. An item whose
+#  resources can't be obtained is moved to the wait queue of the resource pool that blocked it.
+#  It is moved back to the ready heap only when resources of that pool are released, and only
+#  as many waiting items as the released resources can satisfy. Runners are woken one per
+#  ready item, so dispatching doesn't scan blocked items, and releasing a test doesn't wake
+#  all the idle runners.
 class _TestsPool:
-    def __init__(self, tests: list[Test], threads: int, randomize: bool) -> None:
-        self._base_tests = tests
+    def __init__(self, threads: int, schedule: str, history: TestsHistory) -> None:
         self.threads = threads
-        self.randomize = randomize
-        self._tests: list[Test] = []
-        self.condition = Condition()
+        self.schedule = schedule
+        self.history = history
+        self.max_queued = max(2 * threads, 8)
+        self._ready: list[_QueueEntry] = []
+        self._waiting: dict[str, list[_QueueEntry]] = {}
+        self._queued = 0  # ready and waiting items
+        self._pending = 0  # queued and running items
+        self._seq = 0
+        self._closed = False
+        self.lock = Lock()
+        self.work_cond = Condition(self.lock)  # Runners wait for ready items
+        self.space_cond = Condition(self.lock)  # The run loop waits for space or idleness
         self.abort = Event()
-        self.reset()
         self.runner_id_str = ""
         self.info: Callable = log_info
 
     def stop(self) -> None:
         self.abort.set()
-        with self.condition:
-            self.condition.notify_all()
-
-    def next_test(self, info: Callable) -> Test | None:
+        with self.lock:
+            self.work_cond.notify_all()
+            self.space_cond.notify_all()
+
+    #  Add a batch of work items. Blocks while the queue is full. Returns False if the pool was
+    #  stopped and the items weren't added.
+    def add(self, items: list[_WorkItem]) -> bool:
+        if self.schedule == SchedulePolicy.Random:
+            random.shuffle(items)
+        elif self.schedule == SchedulePolicy.LongestFirst:
+            for item in items:
+                duration = self.history.duration(item.test.name, item.mtrx_res.mpi)
+                if duration is not None:
+                    item.expected_duration = duration
+        longest_first = self.schedule == SchedulePolicy.LongestFirst
+        with self.lock:
+            while self._queued >= self.max_queued and not self.abort.is_set():
+                self.space_cond.wait()
+            if self.abort.is_set():
+                return False
+            for item in items:
+                priority = -item.expected_duration if longest_first else 0.0
+                if item.first:
+                    priority = float("-inf")
+                heapq.heappush(self._ready, (priority, self._seq, item))
+                self._seq += 1
+            self._queued += len(items)
+            self._pending += len(items)
+            self.work_cond.notify(len(items))
+        return True
+
+    #  Wait until all the added items are done. If the pool is stopped, wait only for the running
+    #  items; queued items will never run.
+    def wait_idle(self) -> None:
+        with self.lock:
+            while self._pending > 0:
+                if self.abort.is_set() and self._pending == self._queued:
+                    break
+                self.space_cond.wait()
+
+    #  Remove and return all the queued items
+    def drain(self) -> list[_WorkItem]:
+        with self.lock:
+            entries = self._ready
+            for waiting in self._waiting.values():
+                entries.extend(waiting)
+            self._ready = []
+            self._waiting.clear()
+            self._queued = 0
+            self._pending -= len(entries)
+            self.space_cond.notify_all()
+        entries.sort(key=lambda e: e[1])  # queueing order
+        return [e[2] for e in entries]
+
+    #  No more items will be added. Runners exit once the queue is drained.
+    def close(self) -> None:
+        with self.lock:
+            self._closed = True
+            self.work_cond.notify_all()
+
+    def next_item(self, info: Callable) -> _WorkItem | None:
         self.info = info
-        with self.condition:
+        with self.lock:
             while True:
                 if self.abort.is_set():
                     return None
-                test, busy = self._next_test()
-                if busy:
-                    self.info(f"no obtainable tests, waiting")
-                    self.condition.wait()
-                    self.info(f"woke up")
-                    continue
-                return test
-
-    #  returns a tuple of test and a boolean indicating if there are no tests to run
-    #  in case there are tests but they are busy, the return value is (None, True),
-    #  meaning not current test is available but there are tests to run
-    def _next_test(self) -> tuple[Test | None, bool]:
-        if len(self._tests) == 0:
-            return None, False
-        for i, test in enumerate(self._tests):
+                item = self._next_item()
+                if item is not None:
+                    return item
+                if self._queued == 0 and self._closed:
+                    return None
+                self.info(f"no obtainable tests, waiting")
+                self.work_cond.wait()
+                self.info(f"woke up")
+
+    #  returns the next ready work item, or None if there are no ready items. Items whose
+    #  resources can't be obtained are moved to the wait queue of the blocking pool.
+    def _next_item(self) -> _WorkItem | None:
+        while self._ready:
+            entry = heapq.heappop(self._ready)
+            item = entry[2]
+            test = item.test
             self.info(f"Trying to get test '{test.name}'")
             try:
-                #  if test.error is set, it means that the test is not runnable
-                #  and should be skipped. No need to check for resources.
-                if not test.error and not test.obtain_resources():
+                #  if the test's model has an error, the test is not runnable and should be
+                #  skipped. No need to check for resources. The test itself isn't checked for
+                #  errors here, as that materializes it, and this is done under the pool lock.
+                #  The runner checks it once the test is taken.
+                if not test.model.error and not test.obtain_resources():
                     self.info(f"resources not available for '{test.name}'")
+                    heapq.heappush(self._waiting.setdefault(test.blocking_pool, []), entry)
                     continue
-                if i > 0:
-                    busy_tests = self._tests[0:i]
-                    self._tests = self._tests[i:]
-                    if len(self._tests) < self.threads:
-                        self._tests.extend(busy_tests)
-                    else:
-                        self._tests = self._tests[0:self.threads] + busy_tests + \
-                            self._tests[self.threads:]
                 self.info(f"got '{test.name}'")
-                return self._tests.pop(i), False
             except XeetException as e:
                 self.info(f"Error occurred getting test '{test.name}': {e}")
-                test.error = str(e)
-                return test, False  # return the test with error, will become a runtime error
-        return None, True
-
-    def release_test(self, test: Test) -> None:
-        with self.condition:
-            test.release_resources()
-            self.condition.notify_all()
-
-    def insert(self, test: Test) -> None:
-        if len(self._tests) < self.threads:
-            self._tests.append(test)
-        else:
-            self._tests.insert(self.threads, test)
+                test.error = str(e)  # return the test with error, will become a runtime error
+            self._queued -= 1
+            self.space_cond.notify_all()
+            if self._queued == 0 and self._closed:
+                self.work_cond.notify_all()  # Let the idle runners exit
+            return item
+        return None
+
+    #  Move waiting items of the given resource pool to the ready heap, as many as its free
+    #  resources can satisfy. Returns the number of moved items.
+    def _wake_waiting(self, res_pool: ResourcePool) -> int:
+        waiting = self._waiting.get(res_pool.name)
+        if not waiting:
+            return 0
+        free = res_pool.free_count()
+        woken = 0
+        skipped: list[_QueueEntry] = []
+        while waiting and free > 0:
+            entry = heapq.heappop(waiting)
+            demand = entry[2].test.resource_demand(res_pool.name)
+            if demand > free:
+                skipped.append(entry)
+                continue
+            free -= demand
+            heapq.heappush(self._ready, entry)
+            woken += 1
+        for entry in skipped:
+            heapq.heappush(waiting, entry)
+        return woken
 
-    def reset(self) -> None:
-        self._tests = self._base_tests.copy()
-        if self.randomize:
-            random.shuffle(self._tests)
+    def release_item(self, item: _WorkItem) -> None:
+        with self.lock:
+            res_pools = {r.pool.name: r.pool for r in item.test.obtained_resources}
+            item.test.release_resources()
+            woken = sum(self._wake_waiting(res_pool) for res_pool in res_pools.values())
+            if woken:
+                self.work_cond.notify(woken)
+            self._pending -= 1
+            if self._pending == 0 or self.abort.is_set():
+                self.space_cond.notify_all()
 
 
-class _TestRunner(Thread):
-    runner_id_count = 0
-    stop_event = Event()
+_ResultCallback = Callable[[TestResult], None]
 
-    @staticmethod
-    def reset() -> None:
-        _TestRunner.runner_id_count = 0
 
-    def __init__(self, pool: _TestsPool, notifier: EventNotifier, mtrx_res: MtrxResult,
-                 ) -> None:
+class _TestRunner(Thread):
+    def __init__(self, runner_id: int, pool: _TestsPool, notifier: EventNotifier,
+                 on_result: _ResultCallback | None = None) -> None:
         super().__init__()
         self.pool = pool
         self.notifier = notifier
-        self.mtrx_res = mtrx_res
-        self.runner_id = _TestRunner.runner_id_count
-        _TestRunner.runner_id_count += 1
+        self.on_result = on_result
+        self.runner_id = runner_id
         self.error: XeetException | None = None
         self.test: Test | None = None
 
@@ -133,38 +275,160 @@ class _TestRunner(Thread):
 
     def run(self) -> None:
         while True:
-            if self.stop_event.is_set():
-                self.info(f"stopping")
-                break
-            self.test = self.pool.next_test(self.info)
-            if self.test is None:
+            item = self.pool.next_item(self.info)
+            if item is None:
                 self.info("No more tests, goodbye")
                 break
+            self.test = item.test
             self.notifier.on_test_start(test=self.test)
             try:
-                test_res = self._run_test()
+                if self.pool.abort.is_set():
+                    #  The pool was stopped after the item was taken, don't run it
+                    test_res = TestResult(test=self.test, status=_STOPPED_STTS)
+                else:
+                    test_res = run_sync(self._run_cached(item))
+                self._report(item, test_res)
             except XeetException as e:
-                self.info(f"Error occurred during test '{self.test.name}': {e}")
-                self.error = e
-                #  _TestRunner.stop_all()
+                self._item_error(item, e)
                 break
             finally:
-                self.pool.release_test(self.test)
+                #  The item is released only after its result is reported, so waiting for the
+                #  pool to be idle also means waiting for all the results
+                self.test = None
+                self.pool.release_item(item)
+
+    def stop(self) -> None:
+        test = self.test
+        if test:
+            self.info("stopping test")
+            test.stop()
+
+    def _report(self, item: _WorkItem, test_res: TestResult) -> None:
+        item.mtrx_res.add_test_result(test_res.test.name, test_res)
+        item.mtrx_res.set_end_time()
+        self.notifier.on_test_end(test_res)
+        if self.on_result:
+            self.on_result(test_res)
+
+    def _item_error(self, item: _WorkItem, e: XeetException) -> None:
+        self.info(f"Error occurred during test '{item.test.name}': {e}")
+        self.error = e
+        self.pool.stop()
+
+    #  Tests are run as coroutines, which suspend only on the process supervisor's loop
+    async def _run_cached(self, item: _WorkItem) -> TestResult:
+        cache = item.test.rti.result_cache
+        fingerprint = cache.fingerprint(item.test) if cache is not None else None
+        if cache is None or fingerprint is None:
+            return await self._run_test(item)
+        test_res = cache.lookup(item.test, item.mtrx_res.mpi, fingerprint)
+        if test_res is not None:
+            self.info(f"using cached result of '{item.test.name}'")
+            return test_res
+        #  Fingerprinting set the test up, no need to do it again
+        test_res = await self._run_test(item, setup=False)
+        cache.add(test_res, item.mtrx_res.mpi, fingerprint)
+        return test_res
+
+    async def _run_test(self, item: _WorkItem, setup: bool = True) -> TestResult:
+        test = item.test
+        if test.error:
+            return TestResult(test=test, status=_INIT_ERR_STTS, status_reason=test.error)
+        return await test.run_async(setup)
+
+
+#  The async executor's runner. Tests are run as tasks on the process supervisor's loop, up to
+#  'jobs' tests at a time, so a test waiting for its processes doesn't hold a thread. A single
+#  thread takes the work items from the pool. Steps that don't wait on the loop, and reporting
+#  the results, are done by the loop's default executor, whose size doesn't depend on the jobs
+#  count.
+class _AsyncTestRunner(_TestRunner):
+    def __init__(self, runner_id: int, pool: _TestsPool, notifier: EventNotifier,
+                 supervisor: ProcessSupervisor, jobs: int,
+                 on_result: _ResultCallback | None = None) -> None:
+        super().__init__(runner_id, pool, notifier, on_result)
+        self.supervisor = supervisor
+        self.jobs = jobs
+        self.slots = Semaphore(jobs)
+        self.running: set[Test] = set()
+        self.running_lock = Lock()
+
+    def run(self) -> None:
+        while True:
+            self.slots.acquire()
+            item = self.pool.next_item(self.info)
+            if item is None:
+                self.slots.release()
+                break
+            with self.running_lock:
+                self.running.add(item.test)
+            self.notifier.on_test_start(test=item.test)
+            self.supervisor.submit(self._run_item(item))
+        #  Wait for the running tests
+        for _ in range(self.jobs):
+            self.slots.acquire()
+        self.info("No more tests, goodbye")
+
+    def stop(self) -> None:
+        with self.running_lock:
+            tests = list(self.running)
+        for test in tests:
+            self.info(f"stopping test '{test.name}'")
+            test.stop()
+
+    async def _run_item(self, item: _WorkItem) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            if self.pool.abort.is_set():
+                test_res = TestResult(test=item.test, status=_STOPPED_STTS)
+            else:
+                test_res = await self._run_cached(item)
+            #  Reporting might stop the run, which waits for tests to stop, so it's done off the
+            #  loop
+            await loop.run_in_executor(None, self._report, item, test_res)
+        except XeetException as e:
+            self._item_error(item, e)
+        finally:
+            with self.running_lock:
+                self.running.discard(item.test)
+            self.pool.release_item(item)
+            self.slots.release()
+
+
+#  A runner that runs its tests in a worker - a local worker process, so Python side test work
+#  (variables expansion, output filtering and comparison, in-process steps) isn't serialized on
+#  the GIL, or a remote one, to spread the run over several machines. Work items are still taken
+#  from the pool, and resources are still obtained, by the runner thread in the coordinating
+#  process.
+class _WorkerTestRunner(_TestRunner):
+    def __init__(self, runner_id: int, pool: _TestsPool, notifier: EventNotifier,
+                 worker: WorkerHandle, on_result: _ResultCallback | None = None) -> None:
+        super().__init__(runner_id, pool, notifier, on_result)
+        self.worker = worker
 
-            self.mtrx_res.add_test_result(self.test.name, test_res)
-            self.notifier.on_test_end(test_res)
+    def run(self) -> None:
+        try:
+            self.worker.start()
+        except XeetException as e:
+            self.info(f"Error starting worker: {e}")
+            self.error = e
+            self.pool.stop()
+            return
+        try:
+            super().run()
+        finally:
+            self.worker.close()
 
     def stop(self) -> None:
         if self.test:
             self.info("stopping test")
-            self.test.stop()
-
-    def _run_test(self) -> TestResult:
-        assert self.test is not None
-        if self.test.error:
-            return TestResult(test=self.test, status=_INIT_ERR_STTS, status_reason=self.test.error)
+            self.worker.interrupt()
 
-        return self.test.run()
+    #  The worker sets up its own copy of the test
+    async def _run_test(self, item: _WorkItem, setup: bool = True) -> TestResult:
+        if item.test.error:
+            return await super()._run_test(item, setup)
+        return self.worker.run_test(item.test, item.mtrx_res, self.notifier)
 
 
 _EmptyRunResult = RunResult(iterations=0, matrix_count=0, criteria=TestsCriteria())
@@ -185,10 +449,52 @@ class XeetRunner:
         self.matrix = Matrix(self.xeet.model.matrix)
         self.run_res = RunResult(iterations=settings.iterations, criteria=settings.criteria,
                                  matrix_count=self.matrix.prmttns_count)
-        self.tests = self.xeet.get_tests(settings.criteria)
-
-        self.pool = _TestsPool(self.tests, settings.jobs, settings.randomize)
-        self.threads = settings.jobs
+        results_file = settings.results_file
+        if not results_file:
+            results_file = f"{self.rti.base_output_dir}/.results.json"
+        self.results_store = ResultsStore(results_file)
+        #  If set, only these (test, permutation) units are run
+        self.units: set[ShardUnit] | None = None
+        self.failed_units: set[ShardUnit] = set()
+        if settings.last_failed or settings.failed_first:
+            self.failed_units = self.results_store.failed_units()
+        if settings.last_failed and self.failed_units:
+            #  Only the failed tests are instantiated
+            self.units = self.failed_units
+            self.tests = self.xeet.get_tests(settings.criteria,
+                                             {name for name, _ in self.failed_units})
+        else:
+            if settings.last_failed:
+                log_info("No failed tests in the last run, running all tests")
+            self.tests = self.xeet.get_tests(settings.criteria)
+
+        schedule = settings.schedule
+        if settings.randomize:
+            schedule = SchedulePolicy.Random
+        history_file = settings.history_file
+        if not history_file:
+            history_file = f"{self.rti.base_output_dir}/.history.json"
+        self.history = TestsHistory(history_file)
+        #  The runtime info is shared by runs of the same configuration, always reset the cache
+        self.rti.result_cache = None
+        if settings.use_cache:
+            cache_file = settings.cache_file
+            if not cache_file:
+                cache_file = f"{self.rti.base_output_dir}/.results_cache.json"
+            self.rti.result_cache = ResultCache(cache_file)
+        #  With remote workers, there's a runner thread per worker address
+        self.worker_addrs = [parse_worker_address(addr) for addr in settings.workers]
+        self.workers_authkey = settings.workers_authkey
+        self.threads = len(self.worker_addrs) or settings.jobs
+        self.pool = _TestsPool(self.threads, schedule, self.history)
+        if settings.shard[1] > 1:
+            self._set_shard(*settings.shard)
+        self.concurrent_prmttns = settings.concurrent_prmttns
+        self.executor = settings.executor
+        self.fail_fast = settings.fail_fast
+        self.failures = 0
+        self.failures_lock = Lock()
+        self.cancel_start = 0.0
         self.runners: list[_TestRunner] = []
         self.stop_event = Event()
 
@@ -200,48 +506,194 @@ class XeetRunner:
         if not self.tests:
             return _EmptyRunResult
         self.run_res.set_start_time()
-        self.rti.notifier.on_run_start(self.run_res, self.tests, self.matrix, self.threads)
+        self.rti.notifier.on_run_start(self.run_res, self.tests, self.matrix, self.threads,
+                                       self.concurrent_prmttns)
         signal(SIGINT, self._stop_runners)
-        for iter_n in range(self.rti.iterations):
-            self._run_iter(iter_n)
+        handle_exit_signals()
+        if self.executor == ExecutorType.Async:
+            self.rti.supervisor = ProcessSupervisor()
+            self.rti.supervisor.start()
+        self._start_runners()
+        try:
+            if self.concurrent_prmttns:
+                self._run_concurrently()
+            else:
+                for iter_n in range(self.rti.iterations):
+                    self._run_iter(iter_n)
+        finally:
+            self._join_runners()
+            if self.rti.supervisor is not None:
+                self.rti.supervisor.stop()
+                self.rti.supervisor = None
+        if self.run_res.stop_reason:
+            self._mark_not_run(self.pool.drain())
+            self.run_res.cancel_duration = timer() - self.cancel_start
+            self.rti.notifier.on_run_message(
+                f"{self.run_res.stop_reason}, cancellation took "
+                f"{self.run_res.cancel_duration:.3f}s")
         self.run_res.set_end_time()
+        self.history.add_run_result(self.run_res)
+        self.history.save()
+        self.results_store.add_run_result(self.run_res)
+        self.results_store.save()
+        if self.rti.result_cache is not None:
+            self.rti.result_cache.save()
         self.rti.notifier.on_run_end()
         return self.run_res
 
-    @time_result
-    def _run_iter(self, iter_n: int) -> IterationResult:
-        iter_res = self.run_res.iter_results[iter_n]
-        self.rti.set_iteration(iter_n)
-        self.rti.notifier.on_iteration_start(iter_res)
+    def _prmttns(self) -> list[tuple[int, MatrixPermutation]]:
+        ret = []
         for mtrx_i, mtrx_prmmtn in enumerate(self.matrix.permutations()):
             if (self.criteria.prmttn_idxs_inc and mtrx_i not in
                 self.criteria.prmttn_idxs_inc) or \
                 (self.criteria.prmttn_idxs_exc and mtrx_i in
                  self.criteria.prmttn_idxs_exc):
                 continue
-            _TestRunner.reset()
-            self.pool.reset()
+            ret.append((mtrx_i, mtrx_prmmtn))
+        return ret
+
+    #  Each permutation is a separate barrier - the shared variables are set to the
+    #  permutation values and all the tests must end before moving to the next permutation.
+    @time_result
+    def _run_iter(self, iter_n: int) -> IterationResult:
+        iter_res = self.run_res.iter_results[iter_n]
+        self.rti.set_iteration(iter_n)
+        self.rti.notifier.on_iteration_start(iter_res)
+        for mtrx_i, mtrx_prmmtn in self._prmttns():
             mtrx_res = iter_res.add_mtrx_res(mtrx_prmmtn, mtrx_i)
             self.rti.xvars.set_vars(mtrx_prmmtn)
             self.rti.notifier.on_matrix_start(mtrx_prmmtn, mtrx_res)
 
             mtrx_res.set_start_time()
-            self.runners = [_TestRunner(self.pool, self.rti.notifier, mtrx_res) for _ in
-                            range(self.threads)]
-            for runner in self.runners:
-                runner.start()
-            for runner in self.runners:
-                runner.join()
+            self._add_items([self._work_item(test, mtrx_res) for test in self.tests
+                             if self._selected(test, mtrx_i)])
+            self._wait_idle(iter_n)
             mtrx_res.set_end_time()
-            first_error = next((runner.error for runner in self.runners if runner.error), None)
-            if first_error:
-                self.rti.notifier.on_run_message(
-                    f"Error occurred during iteration {iter_n}: {first_error}")
-                raise first_error
             self.rti.notifier.on_matrix_end()
         self.rti.notifier.on_iteration_end()
         return iter_res
 
+    #  All the (iteration, permutation, test) work items are streamed to the pool without
+    #  barriers. Every permutation of every iteration gets its own scope, and every test is
+    #  instantiated per scope, so tests of different permutations don't share any run state.
+    #  End events are sent once all the work is done.
+    def _run_concurrently(self) -> None:
+        multi_prmttns = self.matrix.prmttns_count > 1
+        prmttns = self._prmttns()
+        for iter_res in self.run_res.iter_results:
+            iter_res.set_start_time()
+            self.rti.notifier.on_iteration_start(iter_res)
+            iter_output_dir = self.rti.iteration_output_dir(iter_res.iter_n)
+            for mtrx_i, mtrx_prmmtn in prmttns:
+                mtrx_res = iter_res.add_mtrx_res(mtrx_prmmtn, mtrx_i)
+                output_dir = iter_output_dir
+                if multi_prmttns:
+                    output_dir = f"{output_dir}/m{mtrx_i}"
+                scope = RunScope(self.rti, iter_res.iter_n, mtrx_i, mtrx_prmmtn, output_dir)
+                self.rti.notifier.on_matrix_start(mtrx_prmmtn, mtrx_res)
+                mtrx_res.set_start_time()
+                self._add_items([self._work_item(Test(test.model, self.rti, scope), mtrx_res)
+                                 for test in self.tests if self._selected(test, mtrx_i)])
+                self._check_runners_error(iter_res.iter_n)
+        self._wait_idle(self.rti.iterations - 1)
+
+        for iter_res in self.run_res.iter_results:
+            for mtrx_res in iter_res.mtrx_results:
+                self.rti.notifier.on_matrix_end(mtrx_res.mp, mtrx_res, iter_res)
+            if iter_res.mtrx_results:
+                iter_res.end_time = max(m.end_time for m in iter_res.mtrx_results)
+            self.rti.notifier.on_iteration_end(iter_res)
+
+    #  Keep only the (test, permutation) units of the given shard. Tests that have no units in
+    #  the shard aren't run at all.
+    def _set_shard(self, index: int, count: int) -> None:
+        units = [(test.name, mtrx_i) for mtrx_i, _ in self._prmttns() for test in self.tests
+                 if self._selected(test, mtrx_i)]
+        self.units = shard_units(units, index, count, self.history)
+        shard_tests = {name for name, _ in self.units}
+        self.tests = [test for test in self.tests if test.name in shard_tests]
+        log_info(f"Shard {index}/{count}: {len(self.units)} of {len(units)} tests")
+
+    def _selected(self, test: Test, mtrx_i: int) -> bool:
+        return self.units is None or (test.name, mtrx_i) in self.units
+
+    def _work_item(self, test: Test, mtrx_res: MtrxResult) -> _WorkItem:
+        return _WorkItem(test, mtrx_res, first=(test.name, mtrx_res.mpi) in self.failed_units)
+
+    def _add_items(self, items: list[_WorkItem]) -> None:
+        if not self.pool.add(items):
+            self._mark_not_run(items)
+
+    #  Tests that weren't run since the run was stopped
+    def _mark_not_run(self, items: list[_WorkItem]) -> None:
+        for item in items:
+            test_res = TestResult(test=item.test, status=_STOPPED_STTS,
+                                  status_reason=self.run_res.stop_reason)
+            item.mtrx_res.add_test_result(item.test.name, test_res)
+
+    def _start_runners(self) -> None:
+        on_result = self._on_test_result if self.fail_fast > 0 else None
+        if self.worker_addrs:
+            self.runners = [
+                _WorkerTestRunner(i, self.pool, self.rti.notifier,
+                                  RemoteWorker(self.rti, addr, self.workers_authkey), on_result)
+                for i, addr in enumerate(self.worker_addrs)]
+        elif self.executor == ExecutorType.Process:
+            self.runners = [_WorkerTestRunner(i, self.pool, self.rti.notifier,
+                                              ProcessWorker(self.rti), on_result)
+                            for i in range(self.threads)]
+        elif self.rti.supervisor is not None:
+            self.runners = [_AsyncTestRunner(0, self.pool, self.rti.notifier,
+                                             self.rti.supervisor, self.threads, on_result)]
+        else:
+            self.runners = [_TestRunner(i, self.pool, self.rti.notifier, on_result)
+                            for i in range(self.threads)]
+        for runner in self.runners:
+            runner.start()
+
+    def _join_runners(self) -> None:
+        self.pool.close()
+        for runner in self.runners:
+            runner.join()
+
+    def _wait_idle(self, iter_n: int) -> None:
+        self.pool.wait_idle()
+        self._check_runners_error(iter_n)
+
+    def _check_runners_error(self, iter_n: int) -> None:
+        first_error = next((runner.error for runner in self.runners if runner.error), None)
+        if first_error:
+            self.rti.notifier.on_run_message(
+                f"Error occurred during iteration {iter_n}: {first_error}")
+            raise first_error
+
+    #  Called by the runners for every test result when fail-fast is set. Tests stopped by
+    #  the cancellation itself aren't counted.
+    def _on_test_result(self, test_res: TestResult) -> None:
+        status = test_res.status
+        if status.primary != TestPrimaryStatus.Failed and \
+                (status.primary != TestPrimaryStatus.NotRun or
+                 status.secondary == TestSecondaryStatus.Stopped):
+            return
+        with self.failures_lock:
+            self.failures += 1
+            if self.failures != self.fail_fast:
+                return
+        self._cancel_run(f"Run stopped after {self.failures} failed test(s)")
+
+    #  Stop dispatching tests and stop the running ones. The running tests are stopped side by
+    #  side, as stopping a test may wait for its processes to end.
+    def _cancel_run(self, reason: str) -> None:
+        self.cancel_start = timer()
+        self.run_res.stop_reason = reason
+        self.rti.notifier.on_run_message(f"{reason}, cancelling")
+        self.pool.stop()
+        stoppers = [Thread(target=runner.stop) for runner in self.runners]
+        for stopper in stoppers:
+            stopper.start()
+        for stopper in stoppers:
+            stopper.join()
+
     def _stop_runners(self, *_, **__) -> None:
         if self.stop_event.is_set():
             return
@@ -0,0 +1,384 @@
+from . import BaseXeetSettings, RuntimeInfo, RunScope
+from .events import EventReporter, EventNotifier
+from .result import (TestResult, PhaseResult, StepResult, MtrxResult, TestStatus,
+                     TestPrimaryStatus, TestSecondaryStatus)
+from .test import Test, Phase
+from .step import Step
+from .process_group import handle_exit_signals
+from .xeet_conf import xeet_conf
+from xeet.common import XeetException
+from xeet.log import log_info, log_warn
+from abc import ABC, abstractmethod
+from multiprocessing import get_context, active_children, AuthenticationError
+from multiprocessing.connection import Connection, Listener, Client
+from dataclasses import dataclass, field
+from signal import signal, SIGINT
+from threading import Thread, Lock
+from queue import Queue
+from typing import Any
+from copy import copy
+import time
+import os
+
+
+#  Messages sent from the worker process to the parent. Events carry the name of the notifier
+#  method, a reference to the phase or step (by name and index), and the method arguments.
+#  Results are sent detached from the worker's test, phases and steps, and are attached to the
+#  parent's objects on arrival.
+#  Messages sent from the parent are a _WorkerInit (first), test requests, stop requests and
+#  None to end the session.
+_EVENT_MSG = "event"
+_RESULT_MSG = "result"
+_ERROR_MSG = "error"
+_STOP_MSG = "stop"
+
+_StepRef = tuple[str, int]  # phase name, step index
+
+_RUN_ERR_STTS = TestStatus(TestPrimaryStatus.NotRun, TestSecondaryStatus.TestErr)
+
+
+@dataclass
+class _WorkerInit:
+    iterations: int
+
+
+@dataclass
+class _TestRequest:
+    name: str
+    iteration: int
+    mpi: int
+    prmttn: dict[str, Any]
+    output_subdir: str  # relative to the output root, the worker resolves it against its own
+    resource_vars: dict[str, Any] = field(default_factory=dict)
+
+
+def _output_subdir(rti: RuntimeInfo, output_dir: str) -> str:
+    return os.path.relpath(output_dir, rti.base_output_dir)
+
+
+def _worker_output_dir(rti: RuntimeInfo, output_subdir: str) -> str:
+    if output_subdir == os.curdir:
+        return rti.base_output_dir
+    return f"{rti.base_output_dir}/{output_subdir}"
+
+
+def _step_ref(step: Step) -> _StepRef:
+    return step.phase.name, step.step_index
+
+
+def _detach_step_res(step_res: StepResult) -> StepResult:
+    ret = copy(step_res)
+    ret.step = None  # type: ignore
+    ret.phase_res = None  # type: ignore
+    return ret
+
+
+def _detach_phase_res(phase_res: PhaseResult) -> PhaseResult:
+    ret = copy(phase_res)
+    ret.phase = None  # type: ignore
+    ret.test_result = None  # type: ignore
+    ret.steps_results = []
+    for step_res in phase_res.steps_results:
+        ret.append_step_result(_detach_step_res(step_res))
+    return ret
+
+
+def _detach_test_res(test_res: TestResult) -> TestResult:
+    ret = copy(test_res)
+    ret.test = None  # type: ignore
+    for attr in ("pre_run_res", "main_res", "post_run_res"):
+        phase_res = _detach_phase_res(getattr(test_res, attr))
+        phase_res.test_result = ret
+        setattr(ret, attr, phase_res)
+    return ret
+
+
+def _attach_phase_res(phase_res: PhaseResult, phase: Phase) -> None:
+    phase_res.phase = phase
+    for i, step_res in enumerate(phase_res.steps_results):
+        step_res.step = phase.steps[i]
+        step_res.phase_res = phase_res
+
+
+def _attach_test_res(test_res: TestResult, test: Test) -> None:
+    test_res.test = test
+    _attach_phase_res(test_res.pre_run_res, test.pre_phase)
+    _attach_phase_res(test_res.main_res, test.main_phase)
+    _attach_phase_res(test_res.post_run_res, test.post_phase)
+
+
+#  Forwards the events of the worker's tests to the parent process
+@dataclass
+class _PipeReporter(EventReporter):
+    conn: Connection = None  # type: ignore
+    send_lock: Lock = field(default_factory=Lock)
+
+    def send(self, *msg) -> None:
+        with self.send_lock:
+            self.conn.send(msg)
+
+    def _event(self, method: str, ref: Any, *args, **kwargs) -> None:
+        self.send(_EVENT_MSG, method, ref, args, kwargs)
+
+    def on_phase_start(self, phase: Phase) -> None:
+        self._event("on_phase_start", phase.name)
+
+    def on_phase_end(self, phase_res: PhaseResult) -> None:
+        self._event("on_phase_end", phase_res.phase.name, _detach_phase_res(phase_res))
+
+    def on_step_start(self, step: Step) -> None:
+        self._event("on_step_start", _step_ref(step))
+
+    def on_step_end(self, step_res: StepResult) -> None:
+        self._event("on_step_end", _step_ref(step_res.step), _detach_step_res(step_res))
+
+    def on_test_message(self, _: Test, *args, **kwargs) -> None:
+        self._event("on_test_message", None, *args, **kwargs)
+
+    def on_step_message(self, step: Step, *args, **kwargs) -> None:
+        self._event("on_step_message", _step_ref(step), *args, **kwargs)
+
+
+#  Worker side of a session. The worker reads the configuration by itself, and runs the tests it
+#  is requested to, each in the scope of its iteration and permutation, until the session ends.
+#  Requests are received by a separate thread, so stop requests are handled while a test runs.
+class _WorkerSession:
+    def __init__(self, conn: Connection) -> None:
+        self.conn = conn
+        self.reporter = _PipeReporter(conn=conn)
+        self.requests: Queue[_TestRequest | None] = Queue()
+        self.test: Test | None = None
+        self.test_lock = Lock()
+
+    def serve(self, settings: BaseXeetSettings) -> None:
+        try:
+            xeet = xeet_conf(settings)
+            init: _WorkerInit = self.conn.recv()
+        except XeetException as e:
+            self.reporter.send(_ERROR_MSG, str(e))
+            return
+        except (EOFError, OSError):
+            return
+        rti = xeet.rti
+        rti.iterations = init.iterations
+        rti.add_run_reporter(self.reporter)
+        signal(SIGINT, self._stop_test)
+        handle_exit_signals()
+        Thread(target=self._receive, daemon=True).start()
+
+        while True:
+            req = self.requests.get()
+            if req is None:
+                break
+            try:
+                base_test = xeet.test(req.name)
+                if base_test is None:
+                    raise XeetException(f"Test '{req.name}' not found in worker")
+                output_dir = _worker_output_dir(rti, req.output_subdir)
+                scope = RunScope(rti, req.iteration, req.mpi, req.prmttn, output_dir)
+                test = Test(base_test.model, rti, scope)
+                if test.error:
+                    raise XeetException(f"Test '{req.name}' initialization error: {test.error}")
+                test.resource_vars = dict(req.resource_vars)
+                with self.test_lock:
+                    self.test = test
+                test_res = test.run()
+                self.reporter.send(_RESULT_MSG, _detach_test_res(test_res))
+            except XeetException as e:
+                self.reporter.send(_ERROR_MSG, str(e))
+            finally:
+                with self.test_lock:
+                    self.test = None
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                msg = None
+            if msg == _STOP_MSG:
+                self._stop_test()
+                continue
+            self.requests.put(msg)
+            if msg is None:
+                return
+
+    def _stop_test(self, *_, **__) -> None:
+        with self.test_lock:
+            if self.test is not None:
+                self.test.stop()
+
+
+def _worker_main(settings: BaseXeetSettings, conn: Connection) -> None:
+    _WorkerSession(conn).serve(settings)
+
+
+#  Parent side handle of a worker. Runs a single test at a time; the test's events are replayed
+#  on the parent notifier, with the parent's test, phases and steps, as they arrive. Derived
+#  classes set up the connection to the worker.
+class WorkerHandle(ABC):
+    def __init__(self, rti: RuntimeInfo) -> None:
+        self.rti = rti
+        self.conn: Connection | None = None
+        self.send_lock = Lock()
+
+    @abstractmethod
+    def _connect(self) -> Connection:
+        pass
+
+    def start(self) -> None:
+        self.conn = self._connect()
+        self._send(_WorkerInit(self.rti.iterations))
+
+    def _send(self, msg: Any) -> None:
+        assert self.conn is not None
+        with self.send_lock:
+            self.conn.send(msg)
+
+    def close(self) -> None:
+        if self.conn is None:
+            return
+        try:
+            self._send(None)
+        except (OSError, ValueError):
+            pass
+        self.conn.close()
+
+    #  Stop the test the worker is currently running
+    def interrupt(self) -> None:
+        if self.conn is None:
+            return
+        try:
+            self._send(_STOP_MSG)
+        except (OSError, ValueError):
+            pass
+
+    def run_test(self, test: Test, mtrx_res: MtrxResult, notifier: EventNotifier) -> TestResult:
+        assert self.conn is not None
+        scope = test.scope
+        if scope is not None:
+            req = _TestRequest(test.name, scope.iteration, scope.mpi, scope.prmttn,
+                               _output_subdir(self.rti, scope.output_dir))
+        else:
+            req = _TestRequest(test.name, self.rti.iteration, mtrx_res.mpi, mtrx_res.mp,
+                               _output_subdir(self.rti, self.rti.output_dir))
+        req.resource_vars = test.resource_vars
+        try:
+            self._send(req)
+            while True:
+                msg = self.conn.recv()
+                if msg[0] == _RESULT_MSG:
+                    test_res = msg[1]
+                    _attach_test_res(test_res, test)
+                    return test_res
+                #  The worker failed to run the test, this is the test's runtime error
+                if msg[0] == _ERROR_MSG:
+                    return TestResult(test=test, status=_RUN_ERR_STTS, status_reason=msg[1])
+                self._replay_event(test, notifier, *msg[1:])
+        except (EOFError, OSError) as e:
+            raise XeetException(f"Worker error running test '{test.name}' - {e}")
+
+    @staticmethod
+    def _replay_event(test: Test, notifier: EventNotifier, method: str, ref: Any, args: tuple,
+                      kwargs: dict) -> None:
+        phases = {p.name: p for p in (test.pre_phase, test.main_phase, test.post_phase)}
+        if method == "on_test_message":
+            notifier.on_test_message(test, *args, **kwargs)
+        elif method == "on_phase_start":
+            notifier.on_phase_start(phases[ref])
+        elif method == "on_phase_end":
+            phase_res: PhaseResult = args[0]
+            _attach_phase_res(phase_res, phases[ref])
+            notifier.on_phase_end(phase_res)
+        else:
+            phase_name, step_index = ref
+            step = phases[phase_name].steps[step_index]
+            if method == "on_step_end":
+                step_res: StepResult = args[0]
+                step_res.step = step
+                notifier.on_step_end(step_res)
+            else:
+                getattr(notifier, method)(step, *args, **kwargs)
+
+
+#  A local worker process, connected with a pipe
+class ProcessWorker(WorkerHandle):
+    def __init__(self, rti: RuntimeInfo) -> None:
+        super().__init__(rti)
+        self.settings = BaseXeetSettings(file_path=rti.xeet_file_path, debug=rti.debug_mode,
+                                         output_dir=rti.base_output_dir)
+        self.process = None
+
+    def _connect(self) -> Connection:
+        ctx = get_context("spawn")
+        conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, daemon=True,
+                                   args=(self.settings, child_conn))
+        try:
+            self.process.start()
+        except OSError as e:
+            raise XeetException(f"Error starting worker process - {e}")
+        child_conn.close()
+        return conn
+
+    def close(self) -> None:
+        super().close()
+        if self.process is not None:
+            self.process.join()
+
+
+WorkerAddress = tuple[str, int]
+
+
+def parse_worker_address(address: str) -> WorkerAddress:
+    host, sep, port = address.strip().rpartition(":")
+    if not sep or not host or not port.isdigit():
+        raise XeetException(f"Invalid worker address '{address}', expected HOST:PORT")
+    return host, int(port)
+
+
+#  A worker served by 'xeet serve-workers', possibly on another machine, connected with an
+#  authenticated socket. The worker uses its own copy of the configuration, so the tests are
+#  looked up by name and must match the coordinator's.
+class RemoteWorker(WorkerHandle):
+    CONNECT_TIMEOUT = 10.0
+    _CONNECT_INTERVAL = 0.2
+
+    def __init__(self, rti: RuntimeInfo, address: WorkerAddress, authkey: bytes) -> None:
+        super().__init__(rti)
+        self.address = address
+        self.authkey = authkey
+
+    #  Workers may still be starting (e.g., on CI), so connection attempts are retried
+    def _connect(self) -> Connection:
+        deadline = time.monotonic() + self.CONNECT_TIMEOUT
+        while True:
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except AuthenticationError as e:
+                raise XeetException(f"Worker {self.address[0]}:{self.address[1]} "
+                                    f"authentication failed - {e}")
+            except OSError as e:
+                if time.monotonic() >= deadline:
+                    raise XeetException(f"Error connecting to worker "
+                                        f"{self.address[0]}:{self.address[1]} - {e}")
+            time.sleep(self._CONNECT_INTERVAL)
+
+
+#  Serve workers on the given address until interrupted. Every accepted connection is served by
+#  a new worker process, so a coordinator gets as many workers as the connections it opens.
+def serve_workers(settings: BaseXeetSettings, address: WorkerAddress, authkey: bytes) -> None:
+    ctx = get_context("spawn")
+    with Listener(address, authkey=authkey) as listener:
+        log_info(f"serving workers on {address[0]}:{address[1]}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                log_warn(f"rejected worker connection - {e}")
+                continue
+            process = ctx.Process(target=_worker_main, daemon=True, args=(settings, conn))
+            process.start()
+            conn.close()
+            log_info(f"worker process {process.pid} started")
+            active_children()  # Reap ended workers
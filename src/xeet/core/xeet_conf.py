@@ -1,22 +1,35 @@
 from .test import Test, TestModel
 from . import RuntimeInfo, BaseXeetSettings, TestsCriteria
 from .resource import ResourceModel
-from .matrix import Matrix, MatrixModel
+from .matrix import Matrix, MatrixModel, MatrixPermutation
 from .event_logger import EventLogger
+from xeet import xeet_version
 from xeet.log import log_info, logging_enabled
-from xeet.common import XeetException, NonEmptyStr, pydantic_errmsg, XeetVars, validate_token
+from xeet.common import (XeetException, NonEmptyStr, pydantic_errmsg, XeetVars, validate_token,
+                         atomic_write, env_var_refs)
 from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+from pydantic import VERSION as pydantic_version
 from typing import Any
-from yaml import safe_load
+from collections.abc import Iterable, Iterator, Mapping
+from functools import cached_property
+from dataclasses import dataclass, field
+from yaml import load as yaml_load
 from yaml.parser import ParserError as YamlParserError
 from yaml.constructor import ConstructorError
 from yaml.composer import ComposerError
 from yaml.scanner import ScannerError
+from timeit import default_timer as timer
 from copy import deepcopy
+import hashlib
 import re
 import json
 import os
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader  # type: ignore
+
 
 _NAME = "name"
 _GROUPS = "groups"
@@ -48,21 +61,9 @@ class XeetModel(BaseModel):
                 raise ValueError(f"Duplicate test name '{name}'")
             revised_tests.append(d)
             self.tests_dict[name] = d
-            if not name:
-                continue
             mtrx = d.get(_MATRIX)
-            if not mtrx:
-                continue  # Do nothing. Use original test.
-            mtrx = Matrix(mtrx)
-            prmmtns = mtrx.permutations()
-            for i, p in enumerate(prmmtns):
-                prmttn_name = f"{name}:{i}"
-                new_test = deepcopy(d)
-                new_test[_NAME] = prmttn_name
-                new_test[_PRMTTN] = p
-                new_test.pop(_MATRIX, None)  # Remove matrix from the test
-                revised_tests.append(new_test)
-                self.tests_dict[prmttn_name] = new_test
+            if name and mtrx:
+                Matrix(mtrx)  # Validate only, permutations tests are generated on demand
         self.tests = revised_tests
 
         for s in self.settings.keys():
@@ -71,6 +72,28 @@ class XeetModel(BaseModel):
 
         return self
 
+    #  All the tests descriptors, each matrix test followed by its permutations tests
+    def all_test_descs(self) -> Iterator[Mapping]:
+        for desc in self.tests:
+            yield desc
+            mtrx = desc.get(_MATRIX)
+            if not mtrx or not desc.get(_NAME):
+                continue
+            for i in range(Matrix(mtrx).prmttns_count):
+                yield _PrmttnTestDesc(desc, i)
+
+    def test_desc(self, name: str) -> Mapping | None:
+        desc = self.tests_dict.get(name)
+        if desc is not None or not _MTRX_PRMMTN_TEST_NAME_PATTERN.match(name):
+            return desc
+        base_name, index = name.split(":")
+        base_desc = self.tests_dict.get(base_name)
+        if base_desc is None or not base_desc.get(_MATRIX):
+            return None
+        if int(index) >= Matrix(base_desc[_MATRIX]).prmttns_count:
+            return None
+        return _PrmttnTestDesc(base_desc, int(index))
+
     def include(self, other: "XeetModel") -> None:
         self.variables = {**other.variables, **self.variables}
         self.resources = {**other.resources, **self.resources}
@@ -94,12 +117,163 @@ _TEST_NAME_PATTERN = re.compile(r"^[a-zA-Z0-9_]*$")
 _MTRX_PRMMTN_TEST_NAME_PATTERN = re.compile(r"^[a-zA-Z0-9_]+:[0-9]+$")
 
 
+#  A matrix permutation test descriptor. A read only view over the matrix test's descriptor and
+#  a permutation index, so permutations tests cost nothing until they are selected. A full
+#  descriptor is materialized only when the test is instantiated.
+class _PrmttnTestDesc(Mapping):
+    def __init__(self, base: dict, index: int) -> None:
+        self.base = base
+        self.index = index
+        self.name = f"{base[_NAME]}:{index}"
+
+    @cached_property
+    def prmttn(self) -> MatrixPermutation:
+        return Matrix(self.base[_MATRIX]).permutation(self.index)
+
+    def __getitem__(self, key: str) -> Any:
+        if key == _NAME:
+            return self.name
+        if key == _PRMTTN:
+            return self.prmttn
+        if key == _MATRIX:
+            raise KeyError(key)
+        return self.base[key]
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.base:
+            if key != _NAME and key != _MATRIX:
+                yield key
+        yield _NAME
+        yield _PRMTTN
+
+    def __len__(self) -> int:
+        return len(self.base)  # Name and permutation instead of name and matrix
+
+    def materialize(self) -> dict:
+        ret = {k: deepcopy(v) for k, v in self.base.items() if k != _MATRIX}
+        ret[_NAME] = self.name
+        ret[_PRMTTN] = self.prmttn
+        return ret
+
+
+_NGRAM_LEN = 3
+
+
+def _ngrams(s: str) -> set[str]:
+    return {s[i:i + _NGRAM_LEN] for i in range(len(s) - _NGRAM_LEN + 1)}
+
+
+#  Inverted indexes of the tests descriptors, so tests selection is answered with set operations
+#  instead of evaluating the criteria against every descriptor. Tests are identified by their
+#  position in the descriptors order, and selections are returned in that order.
+#  Name criteria apply to permutations tests by their matrix test name (the name without the
+#  permutation index) or by their full name. Fuzzy names are matched with an n-gram index of the
+#  names, and verified on the few candidates.
+class _TestsIndex:
+    def __init__(self, descs: Iterable[Mapping]) -> None:
+        self.descs: list[Mapping] = []
+        self.by_name: dict[str, set[int]] = {}  # Name, or matrix test name, to tests
+        self.by_group: dict[str, set[int]] = {}
+        self.by_ngram: dict[str, set[int]] = {}
+        self.names: dict[str, set[int]] = {}  # Name, without permutation index, to tests
+        self.abstract: set[int] = set()
+        self.matrix: set[int] = set()
+        self.prmttn: set[int] = set()
+        for i, desc in enumerate(descs):
+            self.descs.append(desc)
+            name = desc.get(_NAME, "")
+            if desc.get(_ABSTRACT, False):
+                self.abstract.add(i)
+            if desc.get(_MATRIX):
+                self.matrix.add(i)
+            if desc.get(_PRMTTN):
+                self.prmttn.add(i)
+            for group in desc.get(_GROUPS, []):
+                self.by_group.setdefault(group, set()).add(i)
+            if not name:
+                continue
+            if _MTRX_PRMMTN_TEST_NAME_PATTERN.match(name):
+                self.by_name.setdefault(name, set()).add(i)
+                name = name.split(':')[0]
+            self.by_name.setdefault(name, set()).add(i)
+            self.names.setdefault(name, set()).add(i)
+        for name, indices in self.names.items():
+            for ngram in _ngrams(name):
+                self.by_ngram.setdefault(ngram, set()).update(indices)
+        self.all = set(range(len(self.descs)))
+
+    def _groups(self, groups: Iterable[str]) -> set[int]:
+        ret = set()
+        for group in groups:
+            ret |= self.by_group.get(group, set())
+        return ret
+
+    def _fuzzy(self, fuzzy: str) -> set[int]:
+        if len(fuzzy) < _NGRAM_LEN:
+            candidates = self.names.keys()
+        else:
+            ngram_sets = sorted((self.by_ngram.get(ngram, set()) for ngram in _ngrams(fuzzy)),
+                                key=len)
+            indices = set.intersection(*ngram_sets)
+            candidates = {self.descs[i].get(_NAME, "").split(':')[0] for i in indices}
+        ret = set()
+        for name in candidates:
+            if fuzzy in name:
+                ret |= self.names[name]
+        return ret
+
+    def _fuzzy_any(self, fuzzy_names: Iterable[str]) -> set[int]:
+        ret = set()
+        for fuzzy in fuzzy_names:
+            ret |= self._fuzzy(fuzzy)
+        return ret
+
+    def select(self, criteria: TestsCriteria) -> list[Mapping]:
+        if not criteria.names and not criteria.fuzzy_names and not criteria.include_groups:
+            selected = set(self.all)
+        else:
+            selected = set()
+            if criteria.names:
+                for name in criteria.names:
+                    selected |= self.by_name.get(name, set())
+            elif criteria.fuzzy_names:
+                selected = self._fuzzy_any(criteria.fuzzy_names)
+            selected |= self._groups(criteria.include_groups)
+
+        if not criteria.hidden_tests:
+            selected -= self.abstract
+        if not criteria.matrix_tests:
+            selected -= self.matrix
+        if not criteria.prmttn_tests:
+            selected -= self.prmttn
+        for name in criteria.exclude_names:
+            selected -= self.by_name.get(name, set())
+        if criteria.fuzzy_exclude_names:
+            selected -= self._fuzzy_any(criteria.fuzzy_exclude_names)
+        for group in criteria.require_groups:
+            selected &= self.by_group.get(group, set())
+        selected -= self._groups(criteria.exclude_groups)
+        return [self.descs[i] for i in sorted(selected)]
+
+
+#  What listing tests needs, taken from the raw descriptor without resolving or validating it
+@dataclass
+class TestHeader:
+    name: str
+    short_desc: str = ""
+    error: str = ""
+    __test__ = False
+
+
 class _XeetConf:
     def __init__(self, model: XeetModel, rti: RuntimeInfo) -> None:
         self.model = model
         self.rti = rti
         self.rti.xvars.set_vars(model.variables)
         self.tests_cache: dict[str, Test] = {}
+        #  Resolved models of base tests, shared by all the tests that inherit them. Inheriting
+        #  doesn't modify the base model, so these are never changed after they are built.
+        self.base_models: dict[str, TestModel] = {}
 
         #  Check if any of the matrix names conflict with the existing variables
         colliding_keys = set(model.matrix.keys()) & set(self.rti.xvars.vars_map.keys())
@@ -143,18 +317,21 @@ class _XeetConf:
             desc = {"name": name, "error": f"Inheritance loop detected for '{base_name}'"}
             return TestModel(**desc)
         inherited.add(name)
-        base_desc = self.test_desc(base_name)
-        if not base_desc:
-            desc = {"name": name, "error": f"No such base test '{base_name}'"}
-            return TestModel(**desc)
-        base_model = self._test_model(base_desc, inherited)
+        base_model = self.base_models.get(base_name)
+        if base_model is None:
+            base_desc = self.test_desc(base_name)
+            if not base_desc:
+                desc = {"name": name, "error": f"No such base test '{base_name}'"}
+                return TestModel(**desc)
+            base_model = self._test_model(base_desc, inherited)
+            self.base_models[base_name] = base_model
         if base_model.error:
             ret.error = f"Base test '{base_name}' error: {base_model.error}"
             return ret
         ret.inherit(base_model)
         return ret
 
-    def _test(self, arg: str | dict) -> Test | None:
+    def _test(self, arg: str | Mapping) -> Test | None:
         if isinstance(arg, str):
             name: str = arg
             desc = self.test_desc(name)
@@ -172,66 +349,50 @@ class _XeetConf:
         if name in self.tests_cache:
             return self.tests_cache[name]
 
+        if isinstance(desc, _PrmttnTestDesc):
+            desc = desc.materialize()
         model = self._test_model(desc)
         test = Test(model, self.rti)
         self.tests_cache[desc[_NAME]] = test
 
         return test
 
-    def _filter_test_desc(self, criteria: TestsCriteria, desc: dict) -> bool:
-        if desc.get(_ABSTRACT, False) and not criteria.hidden_tests:
-            return False
-        if desc.get(_MATRIX) and not criteria.matrix_tests:
-            return False
-        if desc.get(_PRMTTN) and not criteria.prmttn_tests:
-            return False
-
-        name = desc.get(_NAME, "")
-        prmttn_name = ""
-        included = not criteria.names and not criteria.fuzzy_names and not criteria.include_groups
-        if not included and name:
-            if _MTRX_PRMMTN_TEST_NAME_PATTERN.match(name):
-                prmttn_name = name
-                name = name.split(':')[0]  # Strip permutation index for filtering
-
-            if criteria.names:
-                included = name in criteria.names or \
-                    (prmttn_name and prmttn_name in criteria.names)
-            elif criteria.fuzzy_names:
-                included = any(fuzzy in name for fuzzy in criteria.fuzzy_names)
-
-        groups = set(desc.get(_GROUPS, []))
-        if not included and criteria.include_groups and \
-                criteria.include_groups.intersection(groups):
-            included = True
-
-        if not included:
-            return False
-
-        if criteria.exclude_names and name in criteria.exclude_names:
-            return False
-
-        if prmttn_name and prmttn_name in criteria.exclude_names:
-            return False
-
-        if criteria.fuzzy_exclude_names and \
-                any(fuzzy in name for fuzzy in criteria.fuzzy_exclude_names):
-            return False
+    #  Built on first use, the model doesn't change after the configuration is loaded
+    @cached_property
+    def tests_index(self) -> "_TestsIndex":
+        return _TestsIndex(self.model.all_test_descs())
+
+    #  If names are given, only tests with these names are considered
+    def get_tests(self, criteria: TestsCriteria, names: set[str] | None = None) -> list[Test]:
+        descs = self.tests_index.select(criteria)
+        if names is not None:
+            descs = [desc for desc in descs if desc.get(_NAME) in names]
+        ret = [self._test(desc) for desc in descs]
+        return [t for t in ret if t is not None]
 
-        if criteria.require_groups and not criteria.require_groups.issubset(groups):
-            return False
+    #  Cheap version of get_tests(), for listing. Descriptors errors other than invalid names
+    #  are found only when the tests are built.
+    def get_test_headers(self, criteria: TestsCriteria) -> list[TestHeader]:
+        ret = []
+        for desc in self.tests_index.select(criteria):
+            name = desc.get(_NAME)
+            if not name:
+                continue
+            header = TestHeader(name, str(desc.get("short_desc", "")))
+            if not _TEST_NAME_PATTERN.match(name) and \
+                    not _MTRX_PRMMTN_TEST_NAME_PATTERN.match(name):
+                header.error = f"Invalid test name '{name}'"
+            ret.append(header)
+        return ret
 
-        if criteria.exclude_groups and criteria.exclude_groups.intersection(groups):
-            return False
-        return True
-
-    def get_tests(self, criteria: TestsCriteria) -> list[Test]:
-        ret = [self._test(desc)
-               for desc in self.model.tests if self._filter_test_desc(criteria, desc)]
-        return [t for t in ret if t is not None]
+    def test(self, name: str) -> Test | None:
+        return self._test(name)
 
     def test_desc(self, name: str) -> dict | None:
-        return self.model.tests_dict.get(name, None)
+        desc = self.model.test_desc(name)
+        if isinstance(desc, _PrmttnTestDesc):
+            return desc.materialize()
+        return desc  # type: ignore
 
     def all_groups(self) -> set[str]:
         ret = set()
@@ -249,26 +410,21 @@ class XeetIncludeLoopException(XeetConfigException):
         super().__init__(f"Include loop detected - '{file_path}'")
 
 
-def _read_conf_file(file_path: str,
-                    xvars: XeetVars,
-                    root_dir: str,
-                    included: set[str] | None = None) -> XeetModel:
-    if included is None:
-        included = set()
-
+def _conf_file_path(file_path: str, xvars: XeetVars, root_dir: str) -> str:
     file_path = xvars.expand(file_path)
     if not os.path.isabs(file_path):
         file_path = os.path.join(root_dir, file_path)
+    return file_path
 
-    if file_path in included:
-        raise XeetIncludeLoopException(file_path)
 
+#  Parse and validate a single configuration file, without its includes
+def _parse_conf_file(file_path: str, root_dir: str) -> XeetModel:
     file_suffix = os.path.splitext(file_path)[1]
-    log_info(f"reading configuration file '{file_path}'")
+    start = timer()
     try:
         with open(file_path, 'r') as f:
             if file_suffix == ".yaml" or file_suffix == ".yml":
-                desc = safe_load(f)
+                desc = yaml_load(f, Loader=_YamlLoader)
             else:
                 desc = json.load(f)
             model = XeetModel(**desc)
@@ -278,17 +434,152 @@ def _read_conf_file(file_path: str,
     except (IOError, TypeError, ValueError, YamlParserError, ConstructorError,
             ComposerError, ScannerError) as e:
         raise XeetConfigException(f"Error parsing {file_path} - {e}")
+    log_info(f"read configuration file '{file_path}' in {timer() - start:.3f}s")
+    return model
 
-    included.add(file_path)
-    if model.includes:
-        includes = [r.root for r in model.includes]
-        log_info(f"reading included files: {', '.join(includes)}")
-        for i in includes[::-1]:
-            inc_model = _read_conf_file(i, xvars, root_dir, included)
-            model.include(inc_model)
-    included.remove(file_path)
 
-    return model
+#  Read a configuration file and all the files it includes, directly or not. Each file is parsed
+#  once, even if it is included several times. Includes are then merged, each file's merged model
+#  is built once and reused by all its includers.
+#  If sources is given, the read files and the environment variables referenced by include
+#  paths are added to it.
+def _read_conf_file(file_path: str,
+                    xvars: XeetVars,
+                    root_dir: str,
+                    sources: "_ConfSources | None" = None) -> XeetModel:
+    file_path = _conf_file_path(file_path, xvars, root_dir)
+    parsed: dict[str, XeetModel] = {}
+    includes: dict[str, list[str]] = {}
+
+    pending = [file_path]
+    while pending:
+        path = pending.pop(0)
+        if path in parsed:
+            continue
+        model = _parse_conf_file(path, root_dir)
+        parsed[path] = model
+        includes[path] = [_conf_file_path(r.root, xvars, root_dir) for r in model.includes]
+        if sources is not None:
+            for r in model.includes:
+                sources.env_vars.update(env_var_refs(r.root))
+        if includes[path]:
+            log_info(f"'{path}' includes: {', '.join(includes[path])}")
+        pending.extend(includes[path])
+    if sources is not None:
+        sources.files.extend(parsed.keys())
+
+    merged: dict[str, XeetModel] = {}
+    stack: set[str] = set()
+
+    def merge(path: str) -> XeetModel:
+        if path in merged:
+            return merged[path]
+        if path in stack:
+            raise XeetIncludeLoopException(path)
+        stack.add(path)
+        model = parsed[path]
+        for inc_path in includes[path][::-1]:
+            model.include(merge(inc_path))
+        stack.remove(path)
+        merged[path] = model
+        return model
+
+    return merge(file_path)
+
+
+@dataclass
+class _ConfSources:
+    files: list[str] = field(default_factory=list)
+    env_vars: set[str] = field(default_factory=set)
+
+
+_CONF_CACHE_VERSION = 2
+
+
+def _file_digest(path: str) -> str | None:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _file_stat(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+#  Whether the file is the same as when it was cached. Files whose modification time and size
+#  didn't change aren't read. Otherwise, the file is hashed, so touched files that didn't
+#  change don't invalidate the cache.
+def _same_file(path: str, stat: list, digest: str) -> bool:
+    cur_stat = _file_stat(path)
+    if cur_stat is None:
+        return False
+    if list(cur_stat) == stat:
+        return True
+    return cur_stat[1] == stat[1] and _file_digest(path) == digest
+
+
+#  On disk cache of the merged configuration definitions. The cache is plain JSON, and the model
+#  is validated again when it is loaded. The cache is valid as long as the configuration files
+#  didn't change, and it is keyed by everything the include paths expansion may depend on,
+#  including the values of the environment variables they reference. Only runs save the cache,
+#  other commands only use it.
+def _conf_cache_path(rti: RuntimeInfo) -> str:
+    return f"{rti.base_output_dir}/.conf_cache"
+
+
+def _conf_cache_key(rti: RuntimeInfo) -> list:
+    return [_CONF_CACHE_VERSION, xeet_version, pydantic_version, rti.xeet_file_path,
+            rti.root_dir, rti.cwd, rti.base_output_dir]
+
+
+def _load_cached_model(rti: RuntimeInfo) -> tuple[XeetModel, dict] | None:
+    path = _conf_cache_path(rti)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        log_info(f"Ignoring configuration cache '{path}' - {e}")
+        return None
+    try:
+        if data["key"] != _conf_cache_key(rti):
+            return None
+        for name, value in data["env"].items():
+            if os.environ.get(name) != value:
+                log_info(f"Environment variable '{name}' changed, cache is invalid")
+                return None
+        for file_path, stat, digest in data["files"]:
+            if not _same_file(file_path, stat, digest):
+                log_info(f"Configuration file '{file_path}' changed, cache is invalid")
+                return None
+        defs = data["defs"]
+        model = XeetModel(**defs)
+    except (KeyError, TypeError, ValueError) as e:
+        log_info(f"Ignoring configuration cache '{path}' - {e}")
+        return None
+    model.root_dir = rti.root_dir
+    log_info(f"using configuration cache '{path}'")
+    return model, defs
+
+
+def _save_cached_model(rti: RuntimeInfo, defs: dict, sources: _ConfSources) -> None:
+    path = _conf_cache_path(rti)
+    files = [(f, _file_stat(f), _file_digest(f)) for f in sources.files]
+    env = {name: os.environ.get(name) for name in sorted(sources.env_vars)}
+    data = {"key": _conf_cache_key(rti), "env": env, "files": files, "defs": defs}
+    try:
+        content = json.dumps(data)
+    except (TypeError, ValueError) as e:
+        log_info(f"Not saving configuration cache '{path}' - {e}")
+        return
+    atomic_write(path, content, "configuration cache")
 
 
 #  Cache for XeetConf instances, don't use the @cache decorator here
@@ -312,8 +603,16 @@ def xeet_conf(settings: BaseXeetSettings) -> _XeetConf:
     rti = RuntimeInfo(settings)
     if logging_enabled():
         rti.add_run_reporter(EventLogger())
-    model = _read_conf_file(rti.xeet_file_path, rti.xvars, rti.root_dir)
-    rti.set_defs(model.model_dump(by_alias=True))
+    cached = _load_cached_model(rti)
+    if cached is not None:
+        model, defs = cached
+    else:
+        sources = _ConfSources()
+        model = _read_conf_file(rti.xeet_file_path, rti.xvars, rti.root_dir, sources=sources)
+        defs = model.model_dump(by_alias=True)
+        if settings.save_conf_cache:
+            _save_cached_model(rti, defs, sources)
+    rti.set_defs(defs)
     rti.notifier.on_init()
     ret = _XeetConf(model, rti)
     _conf_cache[settings_hash] = ret
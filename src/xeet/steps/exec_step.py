@@ -1,22 +1,67 @@
-from xeet.common import (text_file_tail, in_windows, FileTailer, validate_types, yes_no_str,
-                         StrFilterData, filter_str, validate_str)
+from xeet.common import (text_file_tail, in_windows, validate_types, yes_no_str,
+                         StrFilterData, StrFilter, validate_str, iter_text_lines,
+                         text_streams_equal, bounded_unified_diff)
 from xeet.pr import pr_info
 from xeet.core.step import Step, StepModel, StepResult
+from xeet.core.supervisor import SupervisedProcess
+from xeet.core.process_group import (terminate_process, kill_process, interrupt_process,
+                                     process_group_alive, process_group_pids,
+                                     register_process_group, release_process_group)
 from xeet import XeetException
 from pydantic import field_validator, ValidationInfo, model_validator, Field
 from enum import Enum
-from io import TextIOWrapper
-from dataclasses import dataclass
-from typing import Any
+from io import TextIOWrapper, StringIO
+from dataclasses import dataclass, field
+from threading import Thread, Event
+from typing import Any, Callable, IO
 import time
 import shlex
 import os
 import subprocess
-import signal
-import difflib
 import json
 
 
+def _has_expected(string: str | None, file_path: str | None) -> bool:
+    return string is not None or bool(file_path)
+
+
+#  Expected output is read as a stream, so large expected output files aren't read entirely
+def _open_expected(string: str | None, file_path: str | None) -> IO[str]:
+    if string is not None:
+        return StringIO(string)
+    assert file_path
+    return open(file_path, "r")
+
+
+#  Write the output read from the pipe to the output file, and pass it, line by line, to func.
+#  Once stopped, output is ignored, as the output file might be closed.
+def _pump_pipe(pipe: IO[bytes], f: IO, func: Callable, stopped: Event) -> None:
+    with pipe:
+        for line in iter(pipe.readline, b""):
+            if stopped.is_set():
+                return
+            text = line.decode(errors="replace")
+            try:
+                f.write(text)
+                f.flush()
+            except ValueError:  # Closed file
+                return
+            func(text)
+
+
+#  The state of a single run of an exec step's process
+@dataclass
+class _ExecRun:
+    args: dict
+    verifiers: tuple["_OutputVerifier | None", "_OutputVerifier | None"] | None
+    out_file: TextIOWrapper
+    err_file: TextIOWrapper
+    #  Streamed output functions - of stdout (or unified output), and of split stderr
+    stream_funcs: list[Callable] = field(default_factory=list)
+    pid: int | None = None
+    keep_group: bool = False  # Processes left running in the group are kept running
+
+
 class _OutputBehavior(str, Enum):
     Unify = "unify"
     Split = "split"
@@ -25,6 +70,16 @@ class _OutputBehavior(str, Enum):
         return self.value
 
 
+#  What to do with processes that are left running in the process group of a step's process,
+#  once it ends. Left processes are killed when xeet exits anyway.
+class _LeftoverProcesses(str, Enum):
+    Warn = "warn"
+    Kill = "kill"
+
+    def __str__(self) -> str:
+        return self.value
+
+
 class ExecStepModel(StepModel):
     timeout: float | None = Field(None, ge=0)
     shell_path: str | None = None
@@ -45,6 +100,12 @@ class ExecStepModel(StepModel):
     debug_new_line: bool = False
     output_filters: list[StrFilterData] = Field(default_factory=list)
     stop_process_wait: float = Field(3, ge=0)
+    #  Verify the output while the process runs, and stop the process once the output differs
+    #  from the expected output. Output filters are applied line by line.
+    stream_verification: bool = False
+    #  Maximal number of lines in the output difference report
+    max_diff_lines: int = Field(500, ge=1)
+    leftover_processes: _LeftoverProcesses = _LeftoverProcesses.Warn
 
     @field_validator('allowed_rc')
     @classmethod
@@ -74,6 +135,45 @@ class ExecStepResult(StepResult):
     rc_ok: bool = False
     stdout_diff: str = ""
     stderr_diff: str = ""
+    leftover_pids: list[int] = field(default_factory=list)
+
+
+#  Compares output, as it is produced, with the expected output lines. Only complete lines are
+#  filtered and compared, the last (partial) line is left for the verification after the process
+#  ends. The output filter must be line safe.
+class _OutputVerifier:
+    def __init__(self, name: str, expected: IO[str], output_filter: StrFilter) -> None:
+        self.name = name
+        self.expected_f = expected
+        self.expected = iter_text_lines(expected)
+        self.output_filter = output_filter
+        self.pending = ""
+        self.line_no = 0
+        self.diverged = False
+        #  The expected line for the next output line, and the one after it
+        self.cur_line = next(self.expected, None)
+        self.next_line = next(self.expected, None)
+
+    def close(self) -> None:
+        self.expected_f.close()
+
+    #  Return False if the output differs from the expected output
+    def feed(self, text: str) -> bool:
+        if self.diverged:
+            return False
+        text, sep, self.pending = (self.pending + text).rpartition("\n")
+        if not sep:
+            return True
+        if self.output_filter:
+            text = self.output_filter(text + sep)[:-1]
+        for line in text.split("\n"):
+            #  The expected output's last line has no line break
+            if self.next_line is None or line != self.cur_line:
+                self.diverged = True
+                return False
+            self.line_no += 1
+            self.cur_line, self.next_line = self.next_line, next(self.expected, None)
+        return True
 
 
 class ExecStep(Step):
@@ -106,7 +206,10 @@ class ExecStep(Step):
             self.shell_path, _ = self.rti.config_ref("settings.exec_step.default_shell_path")
         self.output_verification_err = False
         self.output_filters: list[StrFilterData] = []
+        self.output_filter = StrFilter(self.output_filters)
         self.p: subprocess.Popen | None = None
+        self.sp: SupervisedProcess | None = None
+        self.diverged_output: _OutputVerifier | None = None
 
     def setup(self, **kwargs) -> None:  # type: ignore
         super().setup(**kwargs)
@@ -187,6 +290,7 @@ class ExecStep(Step):
             if not validate_types(ef.regex, bool):
                 raise XeetException(f"Invalid regex flag '{ef.regex}'")
             self.output_filters.append(ef)
+        self.output_filter = StrFilter(self.output_filters)
 
     def _io_descriptors(self) -> tuple[TextIOWrapper, TextIOWrapper]:
         out_file = open(self.stdout_file, "w")
@@ -216,17 +320,19 @@ class ExecStep(Step):
             ret.update(self.env)
         return ret
 
-    def _run(self, res: ExecStepResult) -> bool:  # type: ignore
+    #  Prepare a run of the process - its arguments, output files and output streaming. Return
+    #  None if it can't be run.
+    def _prepare_run(self, res: ExecStepResult) -> _ExecRun | None:
         try:
             env = self._read_env_vars()
         except OSError as e:
             res.errmsg = f"Error reading env file: {e}"
             self.warn(res.errmsg)
-            return False
+            return None
 
         #  start_new_session=True is used to make sure the process is detached from the current
         #  session, so that it isn't killed when the parent process is killed. Instead we can
-        #  kill the spawned process orderly.
+        #  kill the spawned process orderly, with its entire process group.
         subproc_args: dict = {
             "start_new_session": True,
             "env": env,
@@ -241,23 +347,88 @@ class ExecStep(Step):
                 command = shlex.split(command)
             except ValueError as e:
                 res.errmsg = f"Error splitting command: {e}"
-                return False
+                return None
         subproc_args["args"] = command
 
         res.stdout_file = self.stdout_file
         res.stderr_file = self.stderr_file
         res.output_behavior = self.output_behavior
         res.allowed_rc = self.exec_model.allowed_rc
-        timeout = self.exec_model.timeout
+
+        try:
+            verifiers = self._output_verifiers()
+        except OSError as e:
+            res.errmsg = f"Error reading expected output: {e}"
+            self.warn(res.errmsg)
+            return None
+        self.diverged_output = None
 
         out_file, err_file = self._io_descriptors()
         subproc_args["stdout"] = out_file
         subproc_args["stderr"] = err_file
-        tails: list[FileTailer] = []
-        if self.debug_mode:
-            tails.append(FileTailer(self.stdout_file, pr_func=self.notify))
+        run = _ExecRun(subproc_args, verifiers, out_file, err_file)
+        #  Streamed output (verified, or printed in debug mode) is read from pipes, by the
+        #  supervisor or by reader threads, which write it to the output files. Unified output
+        #  is read from a single pipe, so its order is kept.
+        if verifiers is not None or self.debug_mode:
+            stdout_verifier, stderr_verifier = verifiers or (None, None)
+            run.stream_funcs.append(self._stream_func(stdout_verifier))
             if self.output_behavior == _OutputBehavior.Split:
-                tails.append(FileTailer(self.stderr_file, pr_func=self.notify))
+                run.stream_funcs.append(self._stream_func(stderr_verifier))
+        return run
+
+    #  Called with step_run_cond held, once the process is set
+    def _process_started(self, pid: int) -> None:
+        register_process_group(pid)
+        self.notify(f"process started with pid {pid}", dbg_pr=False)
+        #  Output might have diverged before the process was set
+        if self.diverged_output is not None:
+            self._stop_diverged()
+
+    def _end_run(self, run: _ExecRun) -> None:
+        if run.pid is not None and not run.keep_group:
+            release_process_group(run.pid)
+        self.debug(" output end ".center(33, "-"))
+        for verifier in run.verifiers or ():
+            if verifier is not None:
+                verifier.close()
+        run.out_file.close()
+        if run.err_file is not run.out_file:
+            run.err_file.close()
+        with self.step_run_cond:
+            self.p = None
+            self.sp = None
+
+    def _timeout_result(self, res: ExecStepResult, e: subprocess.TimeoutExpired) -> bool:
+        self.notify(str(e))
+        res.timeout_period = self.exec_model.timeout
+        res.errmsg = f"Timeout expired after {res.timeout_period}s"
+        return False
+
+    def _run_result(self, res: ExecStepResult) -> bool:
+        self.notify(f"command finished with return code {res.rc}")
+        if self.diverged_output is not None:
+            return self._diverged_output_result(res, self.diverged_output)
+        try:
+            self._verify_rc(res)
+            self._verify_output(res)
+        except OSError as e:
+            res.errmsg = f"Error verifying result: {e}"
+            self.warn(res.errmsg)
+            return False
+        return True
+
+    def _run(self, res: ExecStepResult) -> bool:  # type: ignore
+        run = self._prepare_run(res)
+        if run is None:
+            return False
+        subproc_args = run.args
+        readers: list[Thread] = []
+        readers_stopped = Event()
+        if run.stream_funcs:
+            subproc_args["stdout"] = subprocess.PIPE
+            subproc_args["stderr"] = subprocess.PIPE if len(run.stream_funcs) > 1 else \
+                subprocess.STDOUT
         try:
             self.debug(" output start ".center(33, "-"))
             with self.step_run_cond:
@@ -265,59 +436,162 @@ class ExecStep(Step):
                     res.errmsg = "Stop requested before starting the process"
                     return False
                 self.p = subprocess.Popen(**subproc_args)
-                self.notify(f"process started with pid {self.p.pid}", dbg_pr=False)
-                for tail in tails:
-                    tail.start()
-            res.rc = self.p.wait(timeout)
-            for tail in tails:
-                tail.stop()
+                run.pid = self.p.pid
+                if run.stream_funcs:
+                    pipes = [self.p.stdout, self.p.stderr]
+                    files = [run.out_file, run.err_file]
+                    for pipe, f, func in zip(pipes, files, run.stream_funcs):
+                        readers.append(Thread(target=_pump_pipe,
+                                              args=(pipe, f, func, readers_stopped),
+                                              daemon=True))
+                    for reader in readers:
+                        reader.start()
+                self._process_started(run.pid)
+            res.rc = self.p.wait(self.exec_model.timeout)
+            run.keep_group = self._sweep_process_group(run.pid, res)
+            self._wait_output(readers, readers_stopped)
             if self.stop_requested:
                 res.errmsg = "Stop requested while waiting for the process"
                 return False
             if self.exec_model.debug_new_line:
                 self.debug("")
         except OSError as e:
-            for tail in tails:
-                tail.stop(kill=True)
             res.os_error = e
             res.errmsg = str(e)
             self.notify(res.errmsg)
             return False
         except subprocess.TimeoutExpired as e:
-            assert self.p is not None
-            try:
-                for tail in tails:
-                    tail.stop(kill=True)
-                self.p.kill()
-                self.p.wait()
-            except OSError as kill_e:
-                self.error(f"error killing process - {kill_e}")
-            self.notify(str(e))
-            res.timeout_period = timeout
-            res.errmsg = f"Timeout expired after {timeout}s"
-            return False
+            if self.p is not None:
+                try:
+                    kill_process(self.p)
+                    self.p.wait()
+                except OSError as kill_e:
+                    self.error(f"error killing process - {kill_e}")
+            self._wait_output(readers, readers_stopped)
+            return self._timeout_result(res, e)
         except KeyboardInterrupt:
             if self.p and not self.debug_mode:
-                p.send_signal(signal.SIGINT)  # type: ignore
-                p.wait()  # type: ignore
+                interrupt_process(self.p)
+                self.p.wait()
             res.errmsg = "User interrupt"
             return False
         finally:
-            self.debug(" output end ".center(33, "-"))
-            if isinstance(out_file, TextIOWrapper):
-                out_file.close()
-            if isinstance(err_file, TextIOWrapper):
-                err_file.close()
+            readers_stopped.set()
+            self._end_run(run)
+        return self._run_result(res)
+
+    #  Run on the supervisor's loop (the async executor). The process is started and waited for
+    #  by the supervisor, which also reads the streamed output.
+    async def _run_async(self, res: ExecStepResult) -> bool:  # type: ignore
+        supervisor = self.rti.supervisor
+        assert supervisor is not None
+        run = self._prepare_run(res)
+        if run is None:
+            return False
+        try:
+            self.debug(" output start ".center(33, "-"))
+            if self.stop_requested:
+                res.errmsg = "Stop requested before starting the process"
+                return False
+            if run.stream_funcs:
+                sp = await supervisor.spawn(tail=run.stream_funcs[0],
+                                            err_tail=run.stream_funcs[-1], **run.args)
+            else:
+                sp = await supervisor.spawn(**run.args)
+            run.pid = sp.pid
+            #  step_run_cond isn't held while the process is spawned, as stopping threads may
+            #  wait for it while the loop waits for them, so a stop requested meanwhile is
+            #  handled here.
             with self.step_run_cond:
-                self.p = None
-        self.notify(f"command finished with return code {res.rc}")
+                self.sp = sp
+                self._process_started(sp.pid)
+                if self.stop_requested:
+                    self._stop()
+            try:
+                res.rc = await supervisor.wait(sp, self.exec_model.timeout)
+            except subprocess.TimeoutExpired as e:
+                #  The process is killed by the supervisor
+                await supervisor.wait_output(sp, self._OUTPUT_WAIT_PERIOD)
+                return self._timeout_result(res, e)
+            run.keep_group = await self._sweep_process_group_async(sp, res)
+            if not await supervisor.wait_output(sp, self._OUTPUT_WAIT_PERIOD):
+                self._output_left_open()
+            if self.stop_requested:
+                res.errmsg = "Stop requested while waiting for the process"
+                return False
+            if self.exec_model.debug_new_line:
+                self.debug("")
+        except OSError as e:
+            res.os_error = e
+            res.errmsg = str(e)
+            self.notify(res.errmsg)
+            return False
+        finally:
+            self._end_run(run)
+        return self._run_result(res)
+
+    #  Return the stdout and stderr verifiers, or None if output isn't verified while it's
+    #  produced. Expected stderr is verified only with split output.
+    def _output_verifiers(self) -> tuple[_OutputVerifier | None, _OutputVerifier | None] | None:
+        if not self.exec_model.stream_verification:
+            return None
+        if not self.output_filter.line_safe:
+            self.notify("output filters can't be applied line by line, output is verified "
+                        "after the process ends", dbg_pr=False)
+            return None
+        ret: list[_OutputVerifier | None] = []
+        for name, string, file_path in (
+                ("stdout", self.expected_stdout, self.expected_stdout_file),
+                ("stderr", self.expected_stderr, self.expected_stderr_file)):
+            if not _has_expected(string, file_path) or \
+                    (name == "stderr" and self.output_behavior == _OutputBehavior.Unify):
+                ret.append(None)
+                continue
+            ret.append(_OutputVerifier(name, _open_expected(string, file_path),
+                                       self.output_filter))
+        if ret[0] is None and ret[1] is None:
+            return None
+        return ret[0], ret[1]
+
+    def _stream_func(self, verifier: _OutputVerifier | None) -> Callable:
+        def _on_output(text: str, **_) -> None:
+            if self.debug_mode:
+                self.notify(text, end="")
+            if verifier is None or verifier.feed(text) or self.diverged_output is not None:
+                return
+            #  step_run_cond isn't taken here, as the supervisor calls this from its loop, which
+            #  the process starting thread may be waiting for while holding it. If the process
+            #  isn't set yet, the starting thread stops it.
+            self.diverged_output = verifier
+            self.notify(f"{verifier.name} differs from expected at line "
+                        f"{verifier.line_no + 1}, stopping the process", dbg_pr=False)
+            self._stop_diverged()
+        return _on_output
+
+    #  Doesn't wait for the process to end, since it's called by the output readers, which
+    #  should keep reading the output until it ends
+    def _stop_diverged(self) -> None:
+        if self.sp is not None and self.rti.supervisor is not None:
+            self.rti.supervisor.terminate(self.sp, self.exec_model.stop_process_wait)
+        elif self.p is not None:
+            Thread(target=self._stop, daemon=True).start()
+
+    def _diverged_output_result(self, res: ExecStepResult, verifier: _OutputVerifier) -> bool:
         try:
-            self._verify_rc(res)
             self._verify_output(res)
         except OSError as e:
             res.errmsg = f"Error verifying result: {e}"
             self.warn(res.errmsg)
             return False
+        if not res.failed:
+            #  The complete output matches, the stopped process is reported by its return code
+            self.notify(f"{verifier.name} matches expected after the process was stopped")
+            self._verify_rc(res)
+            return True
+        errmsg = f"{verifier.name} differs from expected at line {verifier.line_no + 1}, " \
+            "process was stopped"
+        diff = res.stdout_diff if verifier.name == "stdout" else res.stderr_diff
+        res.errmsg = f"{errmsg}\n{diff}" if diff else errmsg
         return True
 
     def _verify_rc(self, res: ExecStepResult) -> None:
@@ -355,46 +629,50 @@ class ExecStep(Step):
         else:
             res.errmsg += "\nempty stderr"
 
-    def _verify_output(self, res: ExecStepResult) -> None:
-        def _expected_text(string, file_path) -> list[str] | None:
-            if string is not None:
-                return string.split("\n")
-            if file_path:
-                with open(file_path, "r") as f:
-                    return f.read().split("\n")
-            return None
-
-        def _compare_std_file(name, file_path, expected):
-            with open(file_path, "r") as f:
-                content = f.read()
-                if self.output_filters:
-                    self.notify(f"applying filters to {name} - {self.output_filters}")
-                    content = filter_str(content, self.output_filters)
-                    with open(f"{file_path}.filtered", "w") as filtered_f:
-                        filtered_f.write(content)
-                content = content.split("\n")
-            diff = difflib.unified_diff(
-                content,  # List of lines from file1
-                expected,  # List of lines from file2
-                fromfile=file_path,
-                tofile=f"expected_{name}",
-                lineterm=''  # Suppress extra newlines
-            )
-            return '\n'.join(diff)
+    #  Write the filtered output next to the output file, and return its path. Filters that
+    #  can be applied line by line are, so the output isn't read entirely.
+    def _filter_output_file(self, file_path: str) -> str:
+        filtered_path = f"{file_path}.filtered"
+        with open(file_path, "r") as f, open(filtered_path, "w", newline="") as filtered_f:
+            for text in self.output_filter.filter_stream(f):
+                filtered_f.write(text)
+        return filtered_path
+
+    #  Compare the output file with the expected output, and return their difference. Both are
+    #  streamed, and compared in chunks first, so equal outputs aren't split to lines or diffed.
+    #  Different outputs are diffed from their first difference, up to max_diff_lines lines.
+    def _compare_std_file(self, name: str, file_path: str, expected_str: str | None,
+                          expected_file: str | None) -> str:
+        cmp_path, newline = file_path, None
+        if self.output_filter:
+            self.notify(f"applying filters to {name} - {self.output_filters}")
+            cmp_path, newline = self._filter_output_file(file_path), ""
+        with open(cmp_path, "r", newline=newline) as f, \
+                _open_expected(expected_str, expected_file) as expected:
+            if text_streams_equal(f, expected):
+                return ""
+            f.seek(0)
+            expected.seek(0)
+            return bounded_unified_diff(iter_text_lines(f), iter_text_lines(expected),
+                                        fromfile=file_path, tofile=f"expected_{name}",
+                                        max_lines=self.exec_model.max_diff_lines)
 
+    def _verify_output(self, res: ExecStepResult) -> None:
         self.notify("verifying output", dbg_pr=False)
         if res.failed:
             self.notify("skipping output verification, prior step failed")
             return
 
-        expected_stdout = _expected_text(self.expected_stdout, self.expected_stdout_file)
-        expected_stderr = _expected_text(self.expected_stderr, self.expected_stderr_file)
+        expected_stdout = _has_expected(self.expected_stdout, self.expected_stdout_file)
+        expected_stderr = _has_expected(self.expected_stderr, self.expected_stderr_file)
         if not expected_stdout and not expected_stderr:
             self.notify("no output verification is required")
             return
 
         if expected_stdout:
-            res.stdout_diff = _compare_std_file("stdout", res.stdout_file, expected_stdout)
+            res.stdout_diff = self._compare_std_file("stdout", res.stdout_file,
+                                                     self.expected_stdout,
+                                                     self.expected_stdout_file)
             if res.stdout_diff:
                 res.failed = True
                 self.notify("stdout differs from expected", dbg_pr=False)
@@ -406,7 +684,9 @@ class ExecStep(Step):
             if self.output_behavior == _OutputBehavior.Unify:
                 self.warn("expected_stderr is ignored when output_behavior is 'unify'")
                 return
-            res.stderr_diff = _compare_std_file("stderr", res.stderr_file, expected_stderr)
+            res.stderr_diff = self._compare_std_file("stderr", res.stderr_file,
+                                                     self.expected_stderr,
+                                                     self.expected_stderr_file)
             if res.stderr_diff:
                 res.failed = True
                 self.notify("stderr differs from expected", dbg_pr=False)
@@ -415,27 +695,93 @@ class ExecStep(Step):
                 return
         self.notify("output is verified")
 
-    _STOP_WAIT_INTERVAL = 0.1
-
-    def _stop(self) -> None:
-        if self.p and self.p.poll() is None:
-            self.notify("Stopping process...{self.p.pid}")
-            self.p.terminate()
-
-            time_waited = 0
+    #  Processes left running in the process group once the process ended. These are killed if
+    #  the step is set to, or if the step is stopped. Otherwise, they are left running until
+    #  xeet exits. Return True if they are left running, False if they are to be stopped, and
+    #  None if there are none.
+    def _group_leftovers(self, pgid: int, res: ExecStepResult) -> bool | None:
+        if not process_group_alive(pgid):
+            return None
+        res.leftover_pids = process_group_pids(pgid)
+        pids_str = ", ".join(str(pid) for pid in res.leftover_pids) or "unknown pids"
+        if self.exec_model.leftover_processes == _LeftoverProcesses.Warn and \
+                not self.stop_requested:
+            self.warn(f"processes left running by the command ({pids_str})")
+            return True
+        self.notify(f"stopping processes left running by the command ({pids_str})")
+        return False
+
+    #  Stop the processes left running, if needed. Return True if they are left running.
+    def _sweep_process_group(self, pgid: int, res: ExecStepResult) -> bool:
+        leftovers = self._group_leftovers(pgid, res)
+        if leftovers is False:
+            assert self.p is not None
+            self._stop_process_group(self.p)
+        return bool(leftovers)
+
+    async def _sweep_process_group_async(self, sp: SupervisedProcess,
+                                         res: ExecStepResult) -> bool:
+        leftovers = self._group_leftovers(sp.pid, res)
+        if leftovers is False:
+            assert self.rti.supervisor is not None
+            await self.rti.supervisor.terminate_group(sp, self.exec_model.stop_process_wait)
+        return bool(leftovers)
+
+    _OUTPUT_WAIT_PERIOD = 1.0
+
+    #  Wait for the output readers to read the ended process's output. Output pipes might be
+    #  kept open by processes left running by the process, so reading is stopped after a while.
+    def _wait_output(self, readers: list[Thread], stopped: Event) -> None:
+        done = True
+        deadline = time.monotonic() + self._OUTPUT_WAIT_PERIOD
+        for reader in readers:
+            reader.join(max(deadline - time.monotonic(), 0))
+            done = done and not reader.is_alive()
+        if not done:
+            stopped.set()
+            self._output_left_open()
+
+    def _output_left_open(self) -> None:
+        self.warn("output is kept open by processes left running, stopped reading it")
 
-            # Poll every interval until process is terminated
-            while time_waited <= self.exec_model.stop_process_wait:
-                if self.p.poll() is not None:  # Process exited
-                    return
-                time.sleep(self._STOP_WAIT_INTERVAL)
-                time_waited += self._STOP_WAIT_INTERVAL
+    _STOP_WAIT_INTERVAL = 0.1
 
-            if self.p.poll() is not None:  # Process exited
+    #  Terminate the process with its group, and kill them if the process or other processes in
+    #  the group are still running after stop_process_wait seconds.
+    def _stop_process_group(self, proc: subprocess.Popen) -> None:
+        def _alive() -> bool:
+            if proc.poll() is None:
+                return True
+            return process_group_alive(proc.pid)
+
+        terminate_process(proc)
+        time_waited = 0.0
+        # Poll every interval until the processes are terminated
+        while time_waited <= self.exec_model.stop_process_wait:
+            if not _alive():
                 return
-            # If still running after timeout, force kill
-            self.notify("Process termination timeout, forcing kill...")
-            self.p.kill()
+            time.sleep(self._STOP_WAIT_INTERVAL)
+            time_waited += self._STOP_WAIT_INTERVAL
+        if not _alive():
+            return
+        # If still running after timeout, force kill
+        self.notify("Process termination timeout, forcing kill...")
+        kill_process(proc)
+
+    def _stop(self) -> None:
+        if self.sp is not None and self.rti.supervisor is not None:
+            self.notify(f"Stopping process {self.sp.pid}")
+            self.rti.supervisor.terminate(self.sp, self.exec_model.stop_process_wait)
+            return
+        #  The process is released by the running thread once it ends
+        p = self.p
+        if p and p.poll() is None:
+            self.notify(f"Stopping process...{p.pid}")
+            self._stop_process_group(p)
+
+    def input_files(self) -> list[str]:
+        files = [self.env_file, self.expected_stdout_file, self.expected_stderr_file]
+        return [f for f in files if f]
 
     def _detail_value(self, key: str, printable: bool, setup: bool = False, **_) -> Any:
         if key == "env":